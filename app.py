@@ -1,203 +1,949 @@
-from flask import Flask, jsonify, request, session, send_from_directory
+from flask import Flask, Response, jsonify, request, session, send_from_directory
 from flask_cors import CORS
 import sqlite3
 import bcrypt
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import secrets
 import time
 import json
+import hashlib
 import calendar
+import csv
+import threading
+import operator
+import queue
+import fcntl
+from contextlib import contextmanager
+import urllib.request
+import urllib.parse
+import urllib.error
+import http.cookiejar
+
+# --- OTURUM ANAHTARI ---
+# Birden fazla worker process aynı oturum çerezini doğrulayabilsin diye
+# anahtar her açılışta yeniden üretilmez: PANEL_SECRET_KEY ortam
+# değişkeninden ya da ilk açılışta oluşturulan dosyadan okunur.
+SECRET_KEY_FILE = os.environ.get('PANEL_SECRET_KEY_FILE', '.secret_key')
+
+def load_secret_key():
+    env_key = os.environ.get('PANEL_SECRET_KEY')
+    if env_key:
+        return env_key
+    try:
+        fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Başka bir process dosyayı oluşturmuş olabilir, yazması bitene kadar bekle
+        for _ in range(50):
+            with open(SECRET_KEY_FILE, 'r') as f:
+                key = f.read().strip()
+            if key:
+                return key
+            time.sleep(0.1)
+        raise RuntimeError(f"Oturum anahtarı dosyası boş: {SECRET_KEY_FILE}")
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, 'w') as f:
+        f.write(key)
+    return key
 
 app = Flask(__name__, static_folder='.')
-app.secret_key = secrets.token_hex(32)
+app.secret_key = load_secret_key()
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=12)
 CORS(app, supports_credentials=True)
 
+# --- PANEL AYARLARI ---
+# Panel adı gibi kuruluma özel ayarlar kaynak koda yazılmaz, JSON dosyadan
+# okunur (kurulum betiği oluşturur). Dosya ilk kullanımda yüklenir ve
+# değiştirme zamanı değişince yeniden okunur; yeniden başlatma gerekmez.
+PANEL_CONFIG_FILE = os.environ.get('PANEL_CONFIG_FILE', 'panel_config.json')
+PANEL_CONFIG_DEFAULTS = {
+    'panel_name': 'NovaCell-3'
+}
+# Oturum açmadan (giriş sayfasında) gösterilebilecek ayarlar
+PANEL_CONFIG_PUBLIC = ('panel_name',)
+
+_panel_config = {'mtime': None, 'values': dict(PANEL_CONFIG_DEFAULTS)}
+_panel_config_lock = threading.Lock()
+
+def get_panel_config():
+    try:
+        mtime = os.stat(PANEL_CONFIG_FILE).st_mtime_ns
+    except OSError:
+        mtime = None
+    with _panel_config_lock:
+        if mtime != _panel_config['mtime']:
+            values = dict(PANEL_CONFIG_DEFAULTS)
+            if mtime is not None:
+                try:
+                    with open(PANEL_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                        loaded = json.load(f)
+                    values.update({key: value for key, value in loaded.items() if key in PANEL_CONFIG_DEFAULTS})
+                except (OSError, ValueError, AttributeError) as e:
+                    print(f"⚠️  Ayar dosyası okunamadı ({PANEL_CONFIG_FILE}): {e}")
+            _panel_config['values'] = values
+            _panel_config['mtime'] = mtime
+        return _panel_config['values']
+
 # --- VERITABANI DOSYA YOLLARI ---
-PANEL_DB = 'admin_panel.db'
-XUI_DB = '/etc/x-ui/x-ui.db'
+# Test ve benchmark için ortam değişkeniyle değiştirilebilir
+PANEL_DB = os.environ.get('PANEL_DB', 'admin_panel.db')
+XUI_DB = os.environ.get('XUI_DB', '/etc/x-ui/x-ui.db')
 
-def init_db():
-    conn = sqlite3.connect(PANEL_DB)
-    c = conn.cursor()
+VALID_FOLDERS = ['Tümü', 'Superbox', 'AX', 'GSM', 'ÖZEL', 'KLASÖR-1', 'KLASÖR-2', 'KLASÖR-3', 'KLASÖR-4']
+
+# --- VERİTABANI BAĞLANTI YÖNETİMİ ---
+# Her thread her veritabanı için tek bir kalıcı bağlantı kullanır.
+# Bağlantılar autocommit modundadır; yazmalar db_transaction() ile
+# BEGIN IMMEDIATE altında yapılır, kilit çakışmasında yeniden denenir.
+DB_BUSY_TIMEOUT_MS = 5000
+DB_BUSY_RETRIES = 5
+DB_CACHE_SIZE_KB = 8192
+
+_db_local = threading.local()
+_schema_lock = threading.RLock()
+_schema_ready = set()  # şeması bu process'te doğrulanmış panel veritabanları
+
+def _configure_connection(path, conn):
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if path == PANEL_DB:
+        # Panel veritabanı bize ait: WAL ile okuyucular yazarı beklemez
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+    # x-ui.db'nin journal modu ve senkron ayarı x-ui'ye aittir, değiştirilmez
+
+def get_db(path):
+    """Bu thread'in ilgili veritabanı için havuzlanmış bağlantısını döndür"""
+    conns = getattr(_db_local, 'conns', None)
+    if conns is None:
+        conns = _db_local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        _configure_connection(path, conn)
+        conns[path] = conn
+        if path == PANEL_DB and path not in _schema_ready:
+            # init_db() çağrılmamış giriş noktaları (araçlar, testler) için
+            ensure_panel_schema()
+    return conn
+
+def close_thread_connections():
+    """Bu thread'in havuzdaki bağlantılarını kapat"""
+    conns = getattr(_db_local, 'conns', None) or {}
+    for conn in conns.values():
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    conns.clear()
+
+def _is_busy_error(e):
+    message = str(e).lower()
+    return 'locked' in message or 'busy' in message
+
+@contextmanager
+def db_transaction(path):
+    """
+    Yazma işlemi için cursor ver: BEGIN IMMEDIATE ... COMMIT.
+    Hata olursa geri alınır. Aynı thread'de iç içe çağrılırsa dıştaki
+    işleme katılır.
+    """
+    conn = get_db(path)
+    if conn.in_transaction:
+        yield conn.cursor()
+        return
     
-    c.execute('''CREATE TABLE IF NOT EXISTS admin_users
+    for attempt in range(DB_BUSY_RETRIES):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            break
+        except sqlite3.OperationalError as e:
+            if not _is_busy_error(e) or attempt == DB_BUSY_RETRIES - 1:
+                raise
+            time.sleep(0.05 * (2 ** attempt))
+    
+    try:
+        yield conn.cursor()
+        for attempt in range(DB_BUSY_RETRIES):
+            try:
+                conn.execute("COMMIT")
+                break
+            except sqlite3.OperationalError as e:
+                if not _is_busy_error(e) or attempt == DB_BUSY_RETRIES - 1:
+                    raise
+                time.sleep(0.05 * (2 ** attempt))
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+def _chunked(items, size=500):
+    """SQLite parametre sınırına takılmamak için listeyi parçalara böl"""
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# --- PROCESS'LER ARASI DURUM ---
+# Arka plan worker'larının durumu lider process'te oluşur; diğer worker
+# process'leri de gösterebilsin diye panel veritabanında JSON olarak tutulur.
+def save_runtime_state(c, key, value):
+    c.execute("""INSERT INTO runtime_state (key, value, updated_at) VALUES (?, ?, ?)
+                 ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at""",
+              (key, json.dumps(value), time.time()))
+
+def load_runtime_state(c, key):
+    c.execute("SELECT value FROM runtime_state WHERE key = ?", (key,))
+    row = c.fetchone()
+    return json.loads(row[0]) if row else None
+
+# --- ŞEMA SÜRÜMLERİ ---
+# Mevcut kurulumlardaki tablolar CREATE TABLE IF NOT EXISTS ile değişmez;
+# sütun/indeks değişiklikleri buraya sıralı migration olarak eklenir.
+# Uygulanan son sürüm PRAGMA user_version'da tutulur, her migration
+# şema işlemi içinde bir kez çalışır. Yeni değişiklik = listenin sonuna
+# yeni fonksiyon (mevcutlar değiştirilmez). Şema sürümü güncel olan
+# veritabanında açılışta hiçbir CREATE çalışmaz; bu yüzden yeni tablolar da
+# migration ile eklenmelidir.
+def _table_columns(c, table):
+    c.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in c.fetchall()}
+
+def _migration_quota_reset_date(c):
+    """user_settings.quota_reset_date sütunu (eski kurulumlarda yok)"""
+    if 'quota_reset_date' not in _table_columns(c, 'user_settings'):
+        c.execute("ALTER TABLE user_settings ADD COLUMN quota_reset_date INTEGER DEFAULT 0")
+
+def _migration_query_indexes(c):
+    """ödeme, sıfırlama geçmişi ve yeniden yükleme kuyruğu indeksleri"""
+    # /api/payment-history: WHERE email = ? ORDER BY payment_date DESC
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_payment_history_email_date
+                 ON payment_history(email, payment_date)''')
+    # Kullanıcı bazında sıfırlama geçmişi ve tarih aralığı sorguları
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_quota_reset_log_email_date
+                 ON quota_reset_log(email, reset_date)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_quota_reset_log_date
+                 ON quota_reset_log(reset_date)''')
+    # Zamanlayıcı her saniye bekleyen işleri yoklar; uygulanmış işler taranmasın
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_xui_reload_jobs_pending
+                 ON xui_reload_jobs(requested_at) WHERE started_at IS NULL''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_xui_reload_jobs_batch
+                 ON xui_reload_jobs(batch_id)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_xui_reload_jobs_applied
+                 ON xui_reload_jobs(applied_at)''')
+
+def _migration_payment_date_index(c):
+    """tarih aralığına göre ödeme dökümü indeksi"""
+    # /api/export/payments?from=&to=: tüm kullanıcılarda tarih aralığı
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_payment_history_date
+                 ON payment_history(payment_date)''')
+
+def _migration_revenue_monthly(c):
+    """aylık gelir özetini mevcut ödemelerden doldur"""
+    c.execute("DELETE FROM revenue_monthly")
+    c.execute("""INSERT INTO revenue_monthly (month, email, collected, payments)
+                 SELECT substr(payment_date, 1, 7), email, SUM(amount), COUNT(*)
+                 FROM payment_history GROUP BY 1, 2""")
+
+def _migration_operation_journal(c):
+    """iki veritabanına yazan işlemler için işlem günlüğü"""
+    c.execute('''CREATE TABLE IF NOT EXISTS operation_journal
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  username TEXT NOT NULL UNIQUE,
-                  password_hash TEXT NOT NULL)''')
+                  kind TEXT NOT NULL,
+                  payload TEXT NOT NULL,
+                  state TEXT NOT NULL DEFAULT 'pending',
+                  attempts INTEGER NOT NULL DEFAULT 0,
+                  created_at REAL NOT NULL,
+                  updated_at REAL NOT NULL,
+                  error TEXT)''')
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_operation_journal_pending
+                 ON operation_journal(created_at) WHERE state = 'pending'""")
+
+def _migration_next_quota_reset_date(c):
+    """otomatik aylık kota sıfırlama için next_quota_reset_date"""
+    if 'next_quota_reset_date' not in _table_columns(c, 'user_settings'):
+        c.execute("ALTER TABLE user_settings ADD COLUMN next_quota_reset_date TEXT")
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_user_settings_next_quota_reset
+                 ON user_settings(next_quota_reset_date)''')
+    c.execute("SELECT email, quota_reset_date FROM user_settings")
+    c.executemany("UPDATE user_settings SET next_quota_reset_date = ? WHERE email = ?",
+                  [(add_one_month(anchor).isoformat(), row[0])
+                   for row in c.fetchall() for anchor in [_parse_day(row[1])] if anchor is not None])
+
+def _migration_operation_counters(c):
+    """işlem günlüğünde sıfırlanan sayaçlar (x-ui adımının tekrar kontrolü için)"""
+    if 'counters' not in _table_columns(c, 'operation_journal'):
+        c.execute("ALTER TABLE operation_journal ADD COLUMN counters TEXT")
+
+def _migration_quota_reset_day(c):
+    """kota döneminin ayın hangi günü başladığı (kısa aylarda kaymasın)"""
+    if 'quota_reset_day' not in _table_columns(c, 'user_settings'):
+        c.execute("ALTER TABLE user_settings ADD COLUMN quota_reset_day INTEGER")
+    c.execute("""UPDATE user_settings SET quota_reset_day = CAST(substr(quota_reset_date, 9, 2) AS INTEGER)
+                 WHERE quota_reset_day IS NULL
+                   AND quota_reset_date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'""")
+
+def _migration_seed_quota_anchor(c):
+    """kota dönemi olmayan eski kayıtlar: dönem son ödeme tarihinden başlar"""
+    c.execute("""SELECT email, last_payment_date FROM user_settings
+                 WHERE (next_quota_reset_date IS NULL OR next_quota_reset_date = '')
+                   AND last_payment_date IS NOT NULL AND last_payment_date != ''""")
+    periods = []
+    for email, last_payment in c.fetchall():
+        anchor = _parse_day(str(last_payment)[:10])
+        if anchor is not None:
+            periods.append((anchor.isoformat(), add_one_month(anchor).isoformat(), anchor.day, email))
+    c.executemany("""UPDATE user_settings SET quota_reset_date = ?, next_quota_reset_date = ?,
+                                              quota_reset_day = ?
+                     WHERE email = ?""", periods)
+
+SCHEMA_MIGRATIONS = [
+    _migration_quota_reset_date,   # 1
+    _migration_query_indexes,      # 2
+    _migration_payment_date_index, # 3
+    _migration_revenue_monthly,    # 4
+    _migration_operation_journal,  # 5
+    _migration_next_quota_reset_date,  # 6
+    _migration_operation_counters, # 7
+    _migration_quota_reset_day,    # 8
+    _migration_seed_quota_anchor,  # 9
+]
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
+def migrate_panel_db(c):
+    """Bekleyen migration'ları sırayla uygula; veritabanının şema sürümünü döndür"""
+    c.execute("PRAGMA user_version")
+    version = c.fetchone()[0]
+    if version > SCHEMA_VERSION:
+        print(f"⚠️  Veritabanı şeması ({version}) bu sürümden yeni ({SCHEMA_VERSION})")
+        return version
+    for number, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        print(f"🗄️  Şema migration {number}: {migration.__doc__}")
+        migration(c)
+        c.execute(f"PRAGMA user_version = {number}")
+    if version < SCHEMA_VERSION:
+        # Yeni indeksler için sorgu planlayıcı istatistiklerini güncelle
+        c.execute("ANALYZE")
+    return SCHEMA_VERSION
+
+def create_panel_schema():
+    with db_transaction(PANEL_DB) as c:
+        c.execute('''CREATE TABLE IF NOT EXISTS admin_users
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      username TEXT NOT NULL UNIQUE,
+                      password_hash TEXT NOT NULL)''')
                   
-    c.execute('''CREATE TABLE IF NOT EXISTS user_settings
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  email TEXT NOT NULL UNIQUE,
-                  monthly_price REAL DEFAULT 0,
-                  last_payment_date TEXT,
-                  next_payment_date TEXT,
-                  notes TEXT,
-                  quota_start_date TEXT,
-                  quota_reset_date TEXT,
-                  total_usage_ever REAL DEFAULT 0,
-                  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                  updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                  folder TEXT DEFAULT 'Tümü')''')
+        c.execute('''CREATE TABLE IF NOT EXISTS user_settings
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      email TEXT NOT NULL UNIQUE,
+                      monthly_price REAL DEFAULT 0,
+                      last_payment_date TEXT,
+                      next_payment_date TEXT,
+                      notes TEXT,
+                      quota_start_date TEXT,
+                      quota_reset_date TEXT,
+                      total_usage_ever REAL DEFAULT 0,
+                      created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                      updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                      folder TEXT DEFAULT 'Tümü')''')
                   
-    c.execute('''CREATE TABLE IF NOT EXISTS payment_history
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  email TEXT NOT NULL,
-                  amount REAL NOT NULL,
-                  payment_date TEXT NOT NULL,
-                  payment_method TEXT,
-                  notes TEXT,
-                  created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS payment_history
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      email TEXT NOT NULL,
+                      amount REAL NOT NULL,
+                      payment_date TEXT NOT NULL,
+                      payment_method TEXT,
+                      notes TEXT,
+                      created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
                   
-    c.execute('''CREATE TABLE IF NOT EXISTS quota_reset_log
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  email TEXT NOT NULL,
-                  reset_date TEXT NOT NULL,
-                  reset_type TEXT DEFAULT 'auto',
-                  created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS quota_reset_log
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      email TEXT NOT NULL,
+                      reset_date TEXT NOT NULL,
+                      reset_type TEXT DEFAULT 'auto',
+                      created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+        
+        c.execute('''CREATE TABLE IF NOT EXISTS xui_reload_jobs
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      reason TEXT,
+                      emails TEXT,
+                      requested_at REAL NOT NULL,
+                      batch_id INTEGER,
+                      started_at REAL,
+                      applied_at REAL,
+                      duration_ms INTEGER,
+                      backend TEXT,
+                      error TEXT)''')
+        
+        c.execute('''CREATE TABLE IF NOT EXISTS runtime_state
+                     (key TEXT PRIMARY KEY,
+                      value TEXT NOT NULL,
+                      updated_at REAL NOT NULL)''')
+        
+        c.execute('''CREATE TABLE IF NOT EXISTS panel_settings
+                     (key TEXT PRIMARY KEY,
+                      value TEXT NOT NULL,
+                      updated_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+        
+        c.execute('''CREATE TABLE IF NOT EXISTS notifications
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      email TEXT NOT NULL,
+                      type TEXT NOT NULL,
+                      priority TEXT NOT NULL,
+                      priority_rank INTEGER NOT NULL,
+                      message TEXT NOT NULL,
+                      first_seen TEXT NOT NULL,
+                      acknowledged_at TEXT,
+                      resolved_at TEXT)''')
+        # Kullanıcı ve tür başına tek açık bildirim; açık liste sıralı indeksten okunur
+        c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_open_user
+                     ON notifications(email, type) WHERE resolved_at IS NULL''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_notifications_open_order
+                     ON notifications(priority_rank, first_seen) WHERE resolved_at IS NULL''')
+        
+        # Ödemelerin kullanıcı ve ay bazında özeti; add_payment ile güncellenir
+        c.execute('''CREATE TABLE IF NOT EXISTS revenue_monthly
+                     (month TEXT NOT NULL,
+                      email TEXT NOT NULL,
+                      collected REAL NOT NULL DEFAULT 0,
+                      payments INTEGER NOT NULL DEFAULT 0,
+                      PRIMARY KEY (month, email)) WITHOUT ROWID''')
+        
+        # (email, resolution, bucket) birincil anahtarı aralık sorgularının indeksidir
+        c.execute('''CREATE TABLE IF NOT EXISTS traffic_samples
+                     (email TEXT NOT NULL,
+                      resolution INTEGER NOT NULL,
+                      bucket INTEGER NOT NULL,
+                      up INTEGER NOT NULL DEFAULT 0,
+                      down INTEGER NOT NULL DEFAULT 0,
+                      PRIMARY KEY (email, resolution, bucket)) WITHOUT ROWID''')
+        
+        c.execute('''CREATE TABLE IF NOT EXISTS traffic_counters
+                     (email TEXT PRIMARY KEY,
+                      up INTEGER NOT NULL DEFAULT 0,
+                      down INTEGER NOT NULL DEFAULT 0,
+                      sampled_at INTEGER NOT NULL)''')
 
-    try:
-        c.execute("SELECT quota_reset_date FROM user_settings LIMIT 1")
-    except sqlite3.OperationalError:
-        print("Sistem: quota_reset_date sütunu eksik, otomatik ekleniyor...")
+        migrate_panel_db(c)
+
+        c.execute("SELECT COUNT(*) FROM admin_users WHERE username = 'novacell'")
+        if c.fetchone()[0] == 0:
+            hashed = bcrypt.hashpw('NovaCell25Hakki'.encode('utf-8'), bcrypt.gensalt())
+            c.execute("INSERT INTO admin_users (username, password_hash) VALUES (?, ?)", ('novacell', hashed))
+
+def ensure_panel_schema():
+    """
+    Panel veritabanı şemasını process başına bir kez doğrula. Şema sürümü
+    güncelse sadece PRAGMA user_version okunur; değilse tablolar, migration'lar
+    ve varsayılan admin kullanıcısı oluşturulur.
+    """
+    path = PANEL_DB
+    if path in _schema_ready:
+        return
+    with _schema_lock:
+        if path in _schema_ready:
+            return
+        # Sürüm okunurken get_db() bu fonksiyonu tekrar çağırmasın
+        _schema_ready.add(path)
         try:
-            c.execute("ALTER TABLE user_settings ADD COLUMN quota_reset_date INTEGER DEFAULT 0")
-            print("Sistem: Sütun başarıyla eklendi.")
-        except Exception as e:
-            print(f"Sistem: Sütun ekleme hatası: {e}")
+            version = get_db(path).execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                create_panel_schema()
+        except BaseException:
+            _schema_ready.discard(path)
+            raise
+
+def init_db():
+    """Açılışta çağrılır; şema güncelse hızlıca döner"""
+    ensure_panel_schema()
+
+# --- X-UI YENİDEN YÜKLEME ZAMANLAYICISI ---
+# Değişiklikler x-ui'ye her istekte ayrı restart ile değil, kısa bir bekleme
+# penceresinde biriktirilip tek restart ile uygulanır. İstekler panel
+# veritabanındaki xui_reload_jobs kuyruğuna yazılır; böylece hangi worker
+# process'i kaydederse kaydetsin, lider process'teki tek thread uygular.
+# Her istek bir iş numarası alır; işin durumu kuyruktaki satırından okunur.
+RELOAD_DEBOUNCE_SECONDS = 3     # son istekten sonra beklenecek sessizlik süresi
+RELOAD_MAX_DELAY_SECONDS = 15   # ilk istekten sonra en geç bu kadar beklenir
+RELOAD_POLL_SECONDS = 1         # başka process'lerin eklediği işler için yoklama aralığı
+RELOAD_JOB_RETENTION_SECONDS = 86400  # uygulanmış işler bu kadar saklanır
+
+_reload_cond = threading.Condition()
+_reload_thread = None
+_reload_stats = {
+    'applied_seq': 0,
+    'reload_count': 0,
+    'last_applied_at': None,
+    'last_duration_ms': None,
+    'last_backend': None,
+    'last_error': None
+}
+
+# --- DEĞİŞİKLİK UYGULAMA BACKEND'LERİ ---
+# 'systemctl': x-ui'yi durdurup başlatır, tüm VPN bağlantıları kopar.
+# 'api': değişen client'ları x-ui panel API'sine (updateClient) gönderir;
+#        x-ui bunları Xray'e canlı uygular, diğer kullanıcılar etkilenmez.
+# API başarısız olursa ya da tam restart gerekirse systemctl'e düşülür.
+XUI_APPLY_BACKEND = os.environ.get('XUI_APPLY_BACKEND', 'systemctl')
+XUI_API_URL = os.environ.get('XUI_API_URL', 'http://127.0.0.1:2053')
+XUI_API_USERNAME = os.environ.get('XUI_API_USERNAME', 'admin')
+XUI_API_PASSWORD = os.environ.get('XUI_API_PASSWORD', 'admin')
+XUI_API_TIMEOUT = 10  # saniye
+
+class XuiApplyError(Exception):
+    """Değişiklik seçilen backend ile uygulanamadı"""
+
+# asgi.py aynı komut ve beklemeleri asyncio ile uygular
+XUI_STOP_COMMAND = ['/usr/bin/systemctl', 'stop', 'x-ui']
+XUI_START_COMMAND = ['/usr/bin/systemctl', 'start', 'x-ui']
+XUI_STOP_WAIT_SECONDS = 2
+XUI_START_WAIT_SECONDS = 3
+
+def restart_xui():
+    """x-ui'yi durdurup başlat (config veritabanından yeniden oluşturulur)"""
+    print("  🛑 x-ui durduruluyor...")
+    os.system(' '.join(XUI_STOP_COMMAND))
+    time.sleep(XUI_STOP_WAIT_SECONDS)
+    print("  ▶️  x-ui başlatılıyor...")
+    os.system(' '.join(XUI_START_COMMAND))
+    time.sleep(XUI_START_WAIT_SECONDS)
+
+def apply_via_systemctl(emails, full_restart):
+    restart_xui()
+
+_xui_api_lock = threading.Lock()
+_xui_api_opener = None
 
-    c.execute("SELECT COUNT(*) FROM admin_users WHERE username = 'novacell'")
-    if c.fetchone()[0] == 0:
-        hashed = bcrypt.hashpw('NovaCell25Hakki'.encode('utf-8'), bcrypt.gensalt())
-        c.execute("INSERT INTO admin_users (username, password_hash) VALUES (?, ?)", ('novacell', hashed))
+def _xui_api_request(path, payload=None, form=None):
+    if form is not None:
+        body = urllib.parse.urlencode(form).encode('utf-8')
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    else:
+        body = json.dumps(payload or {}, ensure_ascii=False).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+    req = urllib.request.Request(XUI_API_URL.rstrip('/') + path, data=body, headers=headers, method='POST')
+    with _xui_api_opener.open(req, timeout=XUI_API_TIMEOUT) as resp:
+        return json.loads(resp.read().decode('utf-8') or '{}')
+
+def _xui_api_login():
+    global _xui_api_opener
+    _xui_api_opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    result = _xui_api_request('/login', form={'username': XUI_API_USERNAME, 'password': XUI_API_PASSWORD})
+    if not result.get('success'):
+        _xui_api_opener = None
+        raise XuiApplyError(f"x-ui API girişi başarısız: {result.get('msg')}")
+
+def _xui_api_update_client(inbound_id, client):
+    # vmess/vless için id, trojan için password, shadowsocks için email
+    client_key = client.get('id') or client.get('password') or client.get('email')
+    path = f"/panel/api/inbounds/updateClient/{urllib.parse.quote(str(client_key), safe='')}"
+    payload = {'id': inbound_id, 'settings': json.dumps({'clients': [client]}, ensure_ascii=False)}
+    
+    for attempt in range(2):
+        if _xui_api_opener is None:
+            _xui_api_login()
+        try:
+            result = _xui_api_request(path, payload)
+        except urllib.error.HTTPError as e:
+            if e.code in (401, 403, 404) and attempt == 0:
+                # Oturum düşmüş olabilir, yeniden giriş yap
+                _xui_api_login()
+                continue
+            raise XuiApplyError(f"x-ui API HTTP {e.code}")
+        if result.get('success'):
+            return
+        raise XuiApplyError(f"x-ui API hatası ({client.get('email')}): {result.get('msg')}")
+
+def apply_via_xui_api(emails, full_restart):
+    """Değişen client'ların güncel JSON'unu x-ui API ile canlı uygula"""
+    if full_restart or not emails:
+        raise XuiApplyError("tam yeniden başlatma gerekiyor")
     
-    conn.commit()
-    conn.close()
+    c = get_db(XUI_DB).cursor()
+    updates = []
+    for email in emails:
+        located = locate_client(c, email)
+        if located is None:
+            continue
+        settings = load_inbound_settings(c, located[0])
+        for client in (settings or {}).get('clients', []):
+            if client.get('email') == email:
+                updates.append((located[0], client))
+                break
+    
+    with _xui_api_lock:
+        for inbound_id, client in updates:
+            _xui_api_update_client(inbound_id, client)
+            print(f"  ⚡ {client.get('email')} x-ui API ile canlı güncellendi")
+
+XUI_APPLY_BACKENDS = {
+    'systemctl': apply_via_systemctl,
+    'api': apply_via_xui_api
+}
 
-def sync_xui_expiry(email, expiry_timestamp_ms):
-    """X-UI client_traffics tablosunu güncelle"""
+def apply_xui_live(emails, full_restart):
+    """Seçili backend yeniden başlatmasız ise onunla uygula; başarılıysa adını, restart gerekiyorsa None döndür"""
+    backend_name = XUI_APPLY_BACKEND if XUI_APPLY_BACKEND in XUI_APPLY_BACKENDS else 'systemctl'
+    if backend_name == 'systemctl':
+        return None
     try:
-        if not os.path.exists(XUI_DB): return
-        
-        conn = sqlite3.connect(XUI_DB)
-        c = conn.cursor()
-        c.execute("UPDATE client_traffics SET expiry_time = ? WHERE email = ?", (expiry_timestamp_ms, email))
-        conn.commit()
-        conn.close()
-        print(f"X-UI Sync: {email} -> {expiry_timestamp_ms}")
+        XUI_APPLY_BACKENDS[backend_name](emails, full_restart)
+        return backend_name
+    except XuiApplyError as e:
+        print(f"  ↪ {backend_name} uygulanamadı ({e}), systemctl ile yeniden başlatılıyor")
     except Exception as e:
-        print(f"X-UI Sync Hatası: {e}")
+        print(f"  ↪ {backend_name} hatası ({e}), systemctl ile yeniden başlatılıyor")
+    return None
 
-def toggle_refresh_user(email):
+def apply_xui_changes(emails, full_restart):
+    """Seçili backend ile uygula, başarısız olursa systemctl'e düş; kullanılan backend'i döndür"""
+    backend_name = apply_xui_live(emails, full_restart)
+    if backend_name is None:
+        apply_via_systemctl(emails, True)
+        backend_name = 'systemctl'
+    return backend_name
+
+def schedule_xui_reload(reason='', emails=None):
     """
-    Kullanıcıyı toggle ederek cache'i temizle
-    systemctl stop + start ile config'i zorla yeniden oluştur
-    İki tabloyu da güncelle: inbounds.settings + client_traffics
+    x-ui yeniden yüklemesini kuyruğa al, hemen iş numarası döndür.
+    emails verilirse sadece bu client'lar değişmiştir (canlı uygulanabilir),
+    verilmezse tam yeniden başlatma istenir.
     """
+    emails_json = None if emails is None else json.dumps(sorted(set(emails)))
+    with db_transaction(PANEL_DB) as c:
+        c.execute("INSERT INTO xui_reload_jobs (reason, emails, requested_at) VALUES (?, ?, ?)",
+                  (reason, emails_json, time.time()))
+        job_id = c.lastrowid
+    with _reload_cond:
+        _reload_cond.notify_all()
+    return job_id
+
+def _reload_window_wait():
+    """Grup uygulanmaya hazırsa None, değilse tekrar bakmadan önce beklenecek saniye"""
+    c = get_db(PANEL_DB).cursor()
+    c.execute("SELECT MIN(requested_at), MAX(requested_at) FROM xui_reload_jobs WHERE started_at IS NULL")
+    first_at, last_at = c.fetchone()
+    if first_at is None:
+        return RELOAD_POLL_SECONDS
+    # Yeni istek geldikçe pencereyi uzat, ama en fazla RELOAD_MAX_DELAY_SECONDS
+    now = time.time()
+    quiet_left = last_at + RELOAD_DEBOUNCE_SECONDS - now
+    deadline_left = first_at + RELOAD_MAX_DELAY_SECONDS - now
+    if min(quiet_left, deadline_left) <= 0:
+        return None
+    return min(quiet_left, deadline_left, RELOAD_POLL_SECONDS)
+
+def _wait_for_reload_window():
+    """Bekleyen işler sessizleşene ya da azami gecikme dolana kadar bekle"""
+    while True:
+        wait_for = _reload_window_wait()
+        if wait_for is None:
+            return
+        with _reload_cond:
+            _reload_cond.wait(wait_for)
+
+def _claim_reload_batch():
+    """Bekleyen tüm işleri tek grup olarak işaretle; (grup no, sebepler, emailler, tam restart) döndür"""
+    with db_transaction(PANEL_DB) as c:
+        c.execute("SELECT id, reason, emails FROM xui_reload_jobs WHERE started_at IS NULL ORDER BY id")
+        rows = c.fetchall()
+        if not rows:
+            return None
+        batch_id = rows[-1]['id']
+        c.execute("UPDATE xui_reload_jobs SET started_at = ?, batch_id = ? WHERE started_at IS NULL AND id <= ?",
+                  (time.time(), batch_id, batch_id))
+    
+    reasons = [row['reason'] for row in rows if row['reason']]
+    emails = set()
+    full_restart = False
+    for row in rows:
+        if row['emails'] is None:
+            full_restart = True
+        else:
+            emails.update(json.loads(row['emails']))
+    return batch_id, reasons, emails, full_restart
+
+def _reload_loop():
+    while True:
+        try:
+            _wait_for_reload_window()
+            batch = _claim_reload_batch()
+        except Exception as e:
+            print(f"❌ Yeniden yükleme kuyruğu okunamadı: {e}")
+            time.sleep(RELOAD_POLL_SECONDS)
+            continue
+        if batch is None:
+            continue
+        batch_id, reasons, emails, full_restart = batch
+        
+        started = time.time()
+        error = None
+        backend = None
+        print(f"🔄 x-ui yeniden yükleniyor ({len(reasons)} değişiklik): {', '.join(reasons[:10])}")
+        try:
+            backend = apply_xui_changes(sorted(emails), full_restart)
+        except Exception as e:
+            error = str(e)
+            print(f"❌ x-ui yeniden yükleme hatası: {e}")
+        _finish_reload_batch(batch_id, started, backend, error)
+
+def _finish_reload_batch(batch_id, started, backend, error):
+    """Uygulanan grubun sonucunu istatistiklere ve iş kayıtlarına yaz"""
+    finished = time.time()
+    duration_ms = int((finished - started) * 1000)
+    
+    _reload_stats.update({
+        'applied_seq': batch_id,
+        'reload_count': _reload_stats['reload_count'] + 1,
+        'last_applied_at': datetime.fromtimestamp(finished).strftime('%Y-%m-%d %H:%M:%S'),
+        'last_duration_ms': duration_ms,
+        'last_backend': backend,
+        'last_error': error
+    })
     try:
-        if not os.path.exists(XUI_DB):
-            return False
-        
-        print(f"🔄 Toggle refresh başlıyor: {email}")
-        
-        conn = sqlite3.connect(XUI_DB)
-        c = conn.cursor()
-        
-        # 1. PASIF ET (hem JSON hem client_traffics)
-        c.execute("SELECT id, settings FROM inbounds")
-        inbounds = c.fetchall()
-        
-        for inbound in inbounds:
-            inbound_id = inbound[0]
-            settings = json.loads(inbound[1])
-            clients = settings.get('clients', [])
-            
-            for client in clients:
-                if client.get('email') == email:
-                    client['enable'] = False
-                    break
-            
-            settings['clients'] = clients
-            new_json = json.dumps(settings, ensure_ascii=False)
-            c.execute("UPDATE inbounds SET settings = ? WHERE id = ?", (new_json, inbound_id))
-            conn.commit()
-            print(f"  ↓ {email} pasif edildi (JSON)")
-            break
-        
-        c.execute("UPDATE client_traffics SET enable = 0 WHERE email = ?", (email,))
-        conn.commit()
-        print(f"  ↓ {email} pasif edildi (client_traffics)")
-        
-        time.sleep(1)
+        with db_transaction(PANEL_DB) as c:
+            c.execute("""UPDATE xui_reload_jobs
+                         SET applied_at = ?, duration_ms = ?, backend = ?, error = ?
+                         WHERE batch_id = ?""",
+                      (finished, duration_ms, backend, error, batch_id))
+            c.execute("DELETE FROM xui_reload_jobs WHERE applied_at < ?",
+                      (finished - RELOAD_JOB_RETENTION_SECONDS,))
+            save_runtime_state(c, 'reload', _reload_stats)
+    except Exception as e:
+        print(f"❌ Yeniden yükleme sonucu kaydedilemedi: {e}")
+    print(f"✅ x-ui yeniden yüklendi (iş #{batch_id})")
+
+def _prepare_reload_worker():
+    # Önceki lider bir grubu uygularken öldüyse o işler yeniden denenir
+    with db_transaction(PANEL_DB) as c:
+        c.execute("UPDATE xui_reload_jobs SET started_at = NULL, batch_id = NULL WHERE applied_at IS NULL")
+        previous = load_runtime_state(c, 'reload')
+    if previous:
+        _reload_stats.update(previous)
+
+def _start_reload_worker():
+    global _reload_thread
+    with _reload_cond:
+        if _reload_thread is not None and _reload_thread.is_alive():
+            return
+        _prepare_reload_worker()
+        _reload_thread = threading.Thread(target=_reload_loop, name='xui-reload-worker', daemon=True)
+        _reload_thread.start()
+
+def get_reload_status(job_id=None):
+    """Zamanlayıcının genel durumu; job_id verilirse o işin durumu da eklenir"""
+    c = get_db(PANEL_DB).cursor()
+    status = {
+        'requested_seq': 0,
+        'applied_seq': 0,
+        'reload_count': 0,
+        'last_applied_at': None,
+        'last_duration_ms': None,
+        'last_backend': None,
+        'last_error': None
+    }
+    status.update(load_runtime_state(c, 'reload') or {})
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'xui_reload_jobs'")
+    row = c.fetchone()
+    status['requested_seq'] = row[0] if row else 0
+    c.execute("""SELECT COALESCE(SUM(started_at IS NULL), 0),
+                        COALESCE(SUM(started_at IS NOT NULL AND applied_at IS NULL), 0)
+                 FROM xui_reload_jobs""")
+    pending_count, in_progress_count = c.fetchone()
+    status['pending'] = pending_count > 0
+    status['in_progress'] = in_progress_count > 0
+    status['backend'] = XUI_APPLY_BACKEND
+    
+    if job_id is not None:
+        c.execute("SELECT started_at, applied_at FROM xui_reload_jobs WHERE id = ?", (job_id,))
+        job = c.fetchone()
+        if job is None:
+            # Saklama süresi dolup silinen işler uygulanmıştır
+            job_state = 'applied' if 0 < job_id <= status['applied_seq'] else 'unknown'
+        elif job['applied_at'] is not None:
+            job_state = 'applied'
+        elif job['started_at'] is not None:
+            job_state = 'in_progress'
+        else:
+            job_state = 'pending'
+        status['job_id'] = job_id
+        status['job_state'] = job_state
+    return status
+
+# --- INBOUND DEĞİŞİKLİK TAKİBİ ---
+# Her inbound'un settings JSON'u için bir özet (digest) tutulur; sadece
+# özeti değişen inbound'lar yeniden parse edilir. Parse edilen client'lar
+# email anahtarlı indekste saklanır. Önbellekteki client listeleri salt
+# okunurdur: yazan kod ilgili inbound'u kendisi yükleyip düzenler.
+_inbound_cache_lock = threading.Lock()
+_inbound_cache = {}   # inbound_id -> {'digest', 'clients', 'emails'}
+_client_index = {}    # email -> (inbound_id, client sırası)
+
+def _settings_digest(settings_json):
+    return hashlib.blake2b((settings_json or '').encode('utf-8'), digest_size=16).digest()
+
+def _cache_inbound(inbound_id, digest, settings):
+    """Bir inbound'un parse edilmiş halini önbelleğe ve email indeksine yaz"""
+    _uncache_inbound(inbound_id)
+    clients = settings.get('clients', []) if isinstance(settings, dict) else []
+    emails = []
+    for pos, client in enumerate(clients):
+        email = client.get('email')
+        if email:
+            _client_index[email] = (inbound_id, pos)
+            emails.append(email)
+    _inbound_cache[inbound_id] = {'digest': digest, 'clients': clients, 'emails': emails}
+
+def _uncache_inbound(inbound_id):
+    entry = _inbound_cache.pop(inbound_id, None)
+    if entry is None:
+        return
+    for email in entry['emails']:
+        located = _client_index.get(email)
+        if located is not None and located[0] == inbound_id:
+            del _client_index[email]
+
+def load_inbounds(c):
+    """
+    inbounds tablosunu oku, sadece değişen inbound'ları parse et.
+    [(inbound_id, clients), ...] döndürür; client'lar salt okunurdur.
+    """
+    c.execute("SELECT id, settings FROM inbounds")
+    rows = c.fetchall()
+    
+    with _inbound_cache_lock:
+        seen = set()
+        for row in rows:
+            inbound_id, settings_json = row[0], row[1]
+            seen.add(inbound_id)
+            digest = _settings_digest(settings_json)
+            entry = _inbound_cache.get(inbound_id)
+            if entry is not None and entry['digest'] == digest:
+                continue
+            try:
+                settings = json.loads(settings_json)
+            except (TypeError, ValueError):
+                settings = {}
+            _cache_inbound(inbound_id, digest, settings)
         
-        # 2. AKTİF ET (hem JSON hem client_traffics)
-        c.execute("SELECT id, settings FROM inbounds")
-        inbounds = c.fetchall()
+        for inbound_id in [i for i in _inbound_cache if i not in seen]:
+            _uncache_inbound(inbound_id)
         
-        for inbound in inbounds:
-            inbound_id = inbound[0]
-            settings = json.loads(inbound[1])
-            clients = settings.get('clients', [])
-            
-            for client in clients:
-                if client.get('email') == email:
-                    client['enable'] = True
-                    break
-            
-            settings['clients'] = clients
-            new_json = json.dumps(settings, ensure_ascii=False)
-            c.execute("UPDATE inbounds SET settings = ? WHERE id = ?", (new_json, inbound_id))
-            conn.commit()
-            print(f"  ↑ {email} aktif edildi (JSON)")
+        return [(row[0], _inbound_cache[row[0]]['clients']) for row in rows]
+
+def load_inbound_settings(c, inbound_id):
+    """Tek bir inbound'un settings JSON'unu düzenlemek üzere taze olarak yükle"""
+    c.execute("SELECT settings FROM inbounds WHERE id = ?", (inbound_id,))
+    row = c.fetchone()
+    if not row:
+        return None
+    return json.loads(row[0])
+
+def save_inbound_settings(c, inbound_id, settings):
+    """Düzenlenen inbound'u yaz ve önbelleği yeni içerikle güncelle"""
+    new_json = json.dumps(settings, ensure_ascii=False)
+    c.execute("UPDATE inbounds SET settings = ? WHERE id = ?", (new_json, inbound_id))
+    # İşlem geri alınırsa özet tutmayacağı için sonraki okumada yeniden parse edilir
+    with _inbound_cache_lock:
+        _cache_inbound(inbound_id, _settings_digest(new_json), settings)
+
+def locate_client(c, email):
+    """Email için (inbound_id, client sırası) döndür, bulunamazsa None"""
+    with _inbound_cache_lock:
+        located = _client_index.get(email)
+    if located is None:
+        # Yeni eklenmiş olabilir: değişen inbound'ları okuyup indeksi tazele
+        load_inbounds(c)
+        with _inbound_cache_lock:
+            located = _client_index.get(email)
+    return located
+
+def existing_clients(c, emails):
+    """x-ui'de client'ı bulunan email'ler (girdi sırasıyla)"""
+    # Silinen client'lar da indeksten düşsün diye inbound'lar her seferinde kontrol edilir
+    load_inbounds(c)
+    with _inbound_cache_lock:
+        return [email for email in emails if email in _client_index]
+
+def patch_clients(c, patches):
+    """
+    {email: {alan: değer}} şeklindeki client güncellemelerini uygula.
+    Her etkilenen inbound satırı bir kez okunup bir kez geri yazılır;
+    x-ui tabloyu değiştirdiyse indeks yenilenip kalanlar bir kez daha denenir.
+    Güncellenen email'lerin kümesini döndürür.
+    """
+    patched = set()
+    pending = dict(patches)
+    
+    with _inbound_cache_lock:
+        unknown = any(email not in _client_index for email in pending)
+    if unknown:
+        # Yeni eklenmiş olabilir: değişen inbound'ları okuyup indeksi tazele
+        load_inbounds(c)
+    
+    for attempt in range(2):
+        by_inbound = {}
+        with _inbound_cache_lock:
+            for email in pending:
+                located = _client_index.get(email)
+                if located is not None:
+                    by_inbound.setdefault(located[0], []).append((email, located[1]))
+        
+        for inbound_id, targets in by_inbound.items():
+            settings = load_inbound_settings(c, inbound_id)
+            clients = settings.get('clients', []) if settings is not None else []
+            changed = False
+            for email, pos in targets:
+                if not (pos < len(clients) and clients[pos].get('email') == email):
+                    # Sıra kaymış olabilir, aynı inbound içinde ara
+                    pos = next((i for i, cl in enumerate(clients) if cl.get('email') == email), None)
+                    if pos is None:
+                        continue
+                clients[pos].update(pending.pop(email))
+                patched.add(email)
+                changed = True
+            if changed:
+                save_inbound_settings(c, inbound_id, settings)
+        
+        if not pending or attempt == 1:
             break
-        
-        c.execute("UPDATE client_traffics SET enable = 1 WHERE email = ?", (email,))
-        conn.commit()
-        print(f"  ↑ {email} aktif edildi (client_traffics)")
-        
-        conn.close()
-        
-        time.sleep(1)
-        
-        # 3. STOP + START (Config yeniden oluştur) - TAM PATH!
-        print(f"  🛑 x-ui durduruluyor...")
-        os.system('/usr/bin/systemctl stop x-ui')
-        time.sleep(2)
-        
-        print(f"  ▶️  x-ui başlatılıyor...")
-        os.system('/usr/bin/systemctl start x-ui')
-        time.sleep(5)
-        
-        print(f"✅ Toggle refresh tamamlandı: {email}")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Toggle refresh hatası: {e}")
-        return False
+        # İndeks eskimiş (x-ui client'ı başka inbound'a taşımış ya da silmiş)
+        load_inbounds(c)
+    return patched
+
+def patch_client(c, email, fields):
+    """Tek bir client'ın JSON alanlarını güncelle, bulunamazsa False döndür"""
+    return email in patch_clients(c, {email: fields})
+
+def _disable_clients(c, targets):
+    """{inbound_id: {email, ...}} şeklindeki client'ları JSON'da pasif et"""
+    for inbound_id, emails in targets.items():
+        settings = load_inbound_settings(c, inbound_id)
+        if settings is None:
+            continue
+        for client in settings.get('clients', []):
+            if client.get('email') in emails:
+                client['enable'] = False
+        save_inbound_settings(c, inbound_id, settings)
 
 def check_and_disable_quota_exceeded():
+    """Kotası dolan aktif kullanıcıları pasif et, pasif edilen sayısını döndür"""
     try:
-        if not os.path.exists(XUI_DB): return
+        if not os.path.exists(XUI_DB): return 0
         
-        conn = sqlite3.connect(XUI_DB)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT id, settings FROM inbounds")
-        inbounds = c.fetchall()
+        c = get_db(XUI_DB).cursor()
+        inbounds = load_inbounds(c)
         
         c.execute("SELECT email, up, down FROM client_traffics")
         traffic_dict = {}
         for row in c.fetchall():
             traffic_dict[row['email']] = {'up': row['up'] or 0, 'down': row['down'] or 0}
         
-        modified = False
-        for inbound in inbounds:
-            inbound_id = inbound['id']
-            settings = json.loads(inbound['settings'])
-            clients = settings.get('clients', [])
-            
-            inbound_modified = False
+        targets = {}
+        disabled_count = 0
+        for inbound_id, clients in inbounds:
             for client in clients:
                 email = client.get('email', '')
                 total_gb = client.get('totalGB', 0)
@@ -207,232 +953,1469 @@ def check_and_disable_quota_exceeded():
                     used = (traffic['up'] + traffic['down'])
                     
                     if used >= total_gb:
-                        client['enable'] = False
-                        inbound_modified = True
-                        modified = True
-                        
-                        # CLIENT_TRAFFICS'I DE PASIF ET (KRITIK!)
-                        c.execute("UPDATE client_traffics SET enable = 0 WHERE email = ?", (email,))
-                        
+                        targets.setdefault(inbound_id, set()).add(email)
+                        disabled_count += 1
                         print(f"Kullanıcı {email} kotası doldu, devre dışı bırakıldı")
-            
-            if inbound_modified:
-                settings['clients'] = clients
-                new_settings_json = json.dumps(settings, ensure_ascii=False)
-                c.execute("UPDATE inbounds SET settings = ? WHERE id = ?", (new_settings_json, inbound_id))
-        
-        if modified: 
-            conn.commit()
-            os.system('/usr/bin/systemctl stop x-ui')
-            time.sleep(2)
-            os.system('/usr/bin/systemctl start x-ui')
-            time.sleep(3)
-        conn.close()
+        
+        if targets: 
+            disabled_emails = [email for emails in targets.values() for email in emails]
+            with db_transaction(XUI_DB) as wc:
+                _disable_clients(wc, targets)
+                # CLIENT_TRAFFICS'I DE PASIF ET (KRITIK!)
+                for chunk in _chunked(disabled_emails):
+                    placeholders = ','.join('?' * len(chunk))
+                    wc.execute(f"UPDATE client_traffics SET enable = 0 WHERE email IN ({placeholders})", chunk)
+            schedule_xui_reload(f"kota doldu ({disabled_count})", emails=disabled_emails)
+        return disabled_count
     except Exception as e:
         print(f"Kota kontrol hatası: {e}")
+        raise
 
 def check_and_disable_expired_users():
+    """Süresi dolan aktif kullanıcıları pasif et, pasif edilen sayısını döndür"""
     try:
-        if not os.path.exists(XUI_DB): return
+        if not os.path.exists(XUI_DB): return 0
         
-        conn = sqlite3.connect(XUI_DB)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT id, settings FROM inbounds")
-        inbounds = c.fetchall()
+        inbounds = load_inbounds(get_db(XUI_DB).cursor())
         
         current_time_ms = int(time.time() * 1000)
-        modified = False
+        targets = {}
+        disabled_count = 0
         
-        for inbound in inbounds:
-            inbound_id = inbound['id']
-            settings = json.loads(inbound['settings'])
-            clients = settings.get('clients', [])
-            
-            inbound_modified = False
+        for inbound_id, clients in inbounds:
             for client in clients:
                 email = client.get('email', '')
                 expiry = client.get('expiryTime', 0)
                 
                 if expiry > 0 and expiry < current_time_ms and client.get('enable') == True:
-                    client['enable'] = False
-                    inbound_modified = True
-                    modified = True
+                    targets.setdefault(inbound_id, set()).add(email)
+                    disabled_count += 1
                     print(f"Kullanıcı {email} süresi doldu, devre dışı bırakıldı")
-            
-            if inbound_modified:
-                settings['clients'] = clients
-                new_settings_json = json.dumps(settings, ensure_ascii=False)
-                c.execute("UPDATE inbounds SET settings = ? WHERE id = ?", (new_settings_json, inbound_id))
         
-        if modified: 
-            conn.commit()
-        conn.close()
+        if targets: 
+            with db_transaction(XUI_DB) as wc:
+                _disable_clients(wc, targets)
+        return disabled_count
     except Exception as e:
         print(f"Süre kontrol hatası: {e}")
+        raise
+
+# --- ARKA PLAN KOTA/SÜRE DENETİMİ ---
+# Okuma endpoint'leri x-ui.db'ye yazmaz ve x-ui'yi yeniden başlatmaz;
+# kota/süre taramaları bu worker tarafından belirli aralıklarla yapılır.
+ENFORCEMENT_INTERVAL = 30  # saniye
+
+_enforcement_lock = threading.Lock()
+_enforcement_thread = None
+_enforcement_status = {
+    'running': False,
+    'in_progress': False,
+    'interval_seconds': ENFORCEMENT_INTERVAL,
+    'run_count': 0,
+    'last_run_started': None,
+    'last_run_finished': None,
+    'last_duration_ms': None,
+    'last_quota_disabled': 0,
+    'last_expired_disabled': 0,
+    'last_auto_reset': 0,
+    'last_error': None,
+    'next_run_at': None
+}
+
+def run_enforcement_cycle():
+    """Kota ve süre taramalarını tek seferde çalıştır, durumu güncelle"""
+    with _enforcement_lock:
+        started = time.time()
+        _enforcement_status['in_progress'] = True
+        _enforcement_status['last_run_started'] = datetime.fromtimestamp(started).strftime('%Y-%m-%d %H:%M:%S')
+        errors = []
+        quota_disabled = 0
+        expired_disabled = 0
+        
+        try:
+            replay_operation_journal()
+        except Exception as e:
+            errors.append(f"işlem günlüğü: {e}")
+        
+        # Kotası dolduğu için kapatılanlar yeni dönemde açılsın, önce sıfırla
+        auto_reset = 0
+        try:
+            auto_reset = run_auto_quota_resets()
+        except Exception as e:
+            errors.append(f"otomatik sıfırlama: {e}")
+        
+        try:
+            quota_disabled = check_and_disable_quota_exceeded()
+        except Exception as e:
+            errors.append(f"kota: {e}")
+        
+        try:
+            expired_disabled = check_and_disable_expired_users()
+        except Exception as e:
+            errors.append(f"süre: {e}")
+        
+        if quota_disabled or expired_disabled:
+            invalidate_users_snapshot()
+        
+        finished = time.time()
+        _enforcement_status.update({
+            'in_progress': False,
+            'run_count': _enforcement_status['run_count'] + 1,
+            'last_run_finished': datetime.fromtimestamp(finished).strftime('%Y-%m-%d %H:%M:%S'),
+            'last_duration_ms': int((finished - started) * 1000),
+            'last_quota_disabled': quota_disabled,
+            'last_expired_disabled': expired_disabled,
+            'last_auto_reset': auto_reset,
+            'last_error': '; '.join(errors) if errors else None
+        })
+        _publish_enforcement_status()
+
+def _publish_enforcement_status():
+    try:
+        with db_transaction(PANEL_DB) as c:
+            save_runtime_state(c, 'enforcement', _enforcement_status)
+    except Exception as e:
+        print(f"Denetim durumu kaydedilemedi: {e}")
+
+def _enforcement_loop():
+    while True:
+        try:
+            run_enforcement_cycle()
+        except Exception as e:
+            print(f"Denetim worker hatası: {e}")
+        next_run = time.time() + ENFORCEMENT_INTERVAL
+        _enforcement_status['next_run_at'] = datetime.fromtimestamp(next_run).strftime('%Y-%m-%d %H:%M:%S')
+        _publish_enforcement_status()
+        time.sleep(ENFORCEMENT_INTERVAL)
+
+def start_enforcement_worker():
+    """Kota/süre denetim worker'ını başlat (birden fazla çağrılırsa tek thread kalır)"""
+    global _enforcement_thread
+    if _enforcement_thread is not None and _enforcement_thread.is_alive():
+        return _enforcement_thread
+    _enforcement_thread = threading.Thread(target=_enforcement_loop, name='enforcement-worker', daemon=True)
+    _enforcement_thread.start()
+    _enforcement_status['running'] = True
+    print(f"Sistem: Kota/süre denetimi her {ENFORCEMENT_INTERVAL} saniyede bir çalışacak")
+    return _enforcement_thread
+
+# --- TRAFİK ZAMAN SERİSİ ---
+# Sayaç farkları (client_traffics up/down) dakikalık örneklenir ve aynı
+# anda dakika, saat ve gün kovalarına eklenir. Sadece trafiği olan
+# kullanıcılar için satır yazılır. Eski dakika ve saat kovaları saklama
+# süresi dolunca silinir; günlük kovalar saklanır. Son okunan sayaçlar
+# traffic_counters tablosunda tutulur (sadece değişince yazılır, sampled_at
+# son değişim zamanıdır), yeniden başlatmada fark kaybolmaz.
+TRAFFIC_SAMPLE_INTERVAL = 60  # saniye
+TRAFFIC_RESOLUTIONS = (60, 3600, 86400)
+TRAFFIC_RETENTION = {
+    60: 2 * 86400,       # dakikalık: 2 gün
+    3600: 90 * 86400     # saatlik: 90 gün (günlük kovalar silinmez)
+}
+TRAFFIC_COMPACT_INTERVAL = 3600
+
+_traffic_sampler_thread = None
+
+def record_traffic_deltas(c, counters, now=None, reset=False):
+    """
+    counters: {email: (up, down)} güncel sayaçlar. Son okunan değere göre
+    farkı kovalara yazar. reset=True ise sayaçlar sıfırlanacaktır, son
+    değer 0 kaydedilir. c panel veritabanı cursor'ı (işlem içinde).
+    """
+    if not counters:
+        return 0
+    now = int(now or time.time())
+    previous = {}
+    for chunk in _chunked(counters):
+        placeholders = ','.join('?' * len(chunk))
+        c.execute(f"SELECT email, up, down FROM traffic_counters WHERE email IN ({placeholders})", chunk)
+        for row in c.fetchall():
+            previous[row[0]] = (row[1], row[2])
+    
+    samples = []
+    updates = []  # son değeri değişen (ya da ilk görülen) kullanıcılar
+    for email, (up, down) in counters.items():
+        up, down = up or 0, down or 0
+        last_up, last_down = previous.get(email, (None, None))
+        stored = (0, 0) if reset else (up, down)
+        if (last_up, last_down) != stored:
+            updates.append((email, stored[0], stored[1], now))
+        if last_up is None:
+            continue  # ilk görülen kullanıcı: sadece başlangıç noktası kaydedilir
+        # Sayaç küçüldüyse arada sıfırlanmıştır, mevcut değerin tamamı yeni trafiktir
+        delta_up = up - last_up if up >= last_up else up
+        delta_down = down - last_down if down >= last_down else down
+        if delta_up or delta_down:
+            for resolution in TRAFFIC_RESOLUTIONS:
+                samples.append((email, resolution, now - now % resolution, delta_up, delta_down))
+    
+    if samples:
+        c.executemany("""INSERT INTO traffic_samples (email, resolution, bucket, up, down) VALUES (?, ?, ?, ?, ?)
+                         ON CONFLICT(email, resolution, bucket) DO UPDATE
+                         SET up = up + excluded.up, down = down + excluded.down""", samples)
+    # Trafiği olmayan kullanıcının satırı her dakika yeniden yazılmaz (WAL büyümesin)
+    if updates:
+        c.executemany("""INSERT INTO traffic_counters (email, up, down, sampled_at) VALUES (?, ?, ?, ?)
+                         ON CONFLICT(email) DO UPDATE
+                         SET up = excluded.up, down = excluded.down, sampled_at = excluded.sampled_at""",
+                      updates)
+    return len(samples) // len(TRAFFIC_RESOLUTIONS)
+
+def sample_traffic():
+    """Tüm kullanıcıların sayaçlarını okuyup farkları kaydet; trafiği olan kullanıcı sayısını döndür"""
+    if not os.path.exists(XUI_DB):
+        return 0
+    c = get_db(XUI_DB).cursor()
+    c.execute("SELECT email, up, down FROM client_traffics")
+    counters = {row['email']: (row['up'], row['down']) for row in c.fetchall() if row['email']}
+    with db_transaction(PANEL_DB) as pc:
+        return record_traffic_deltas(pc, counters)
+
+def compact_traffic_samples(now=None):
+    """Saklama süresi dolan dakika/saat kovalarını sil"""
+    now = int(now or time.time())
+    deleted = 0
+    with db_transaction(PANEL_DB) as c:
+        for resolution, retention in TRAFFIC_RETENTION.items():
+            c.execute("DELETE FROM traffic_samples WHERE resolution = ? AND bucket < ?",
+                      (resolution, now - retention))
+            deleted += c.rowcount
+    return deleted
+
+def _traffic_sampler_loop():
+    last_compact = 0
+    while True:
+        try:
+            sample_traffic()
+            if time.time() - last_compact >= TRAFFIC_COMPACT_INTERVAL:
+                deleted = compact_traffic_samples()
+                last_compact = time.time()
+                if deleted:
+                    print(f"Sistem: {deleted} eski trafik örneği silindi")
+        except Exception as e:
+            print(f"Trafik örnekleme hatası: {e}")
+        time.sleep(TRAFFIC_SAMPLE_INTERVAL)
+
+def start_traffic_sampler():
+    """Trafik örnekleyiciyi başlat (birden fazla çağrılırsa tek thread kalır)"""
+    global _traffic_sampler_thread
+    if _traffic_sampler_thread is not None and _traffic_sampler_thread.is_alive():
+        return _traffic_sampler_thread
+    _traffic_sampler_thread = threading.Thread(target=_traffic_sampler_loop, name='traffic-sampler', daemon=True)
+    _traffic_sampler_thread.start()
+    return _traffic_sampler_thread
+
+def get_usage_history(email, start, end, resolution=None):
+    """
+    [start, end) aralığındaki kovaları döndür. Çözünürlük verilmezse
+    aralığa göre seçilir: 6 saate kadar dakika, 14 güne kadar saat, sonrası gün.
+    """
+    span = end - start
+    if resolution is None:
+        resolution = 60 if span <= 6 * 3600 else (3600 if span <= 14 * 86400 else 86400)
+    c = get_db(PANEL_DB).cursor()
+    c.execute("""SELECT bucket, up, down FROM traffic_samples
+                 WHERE email = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+                 ORDER BY bucket""",
+              (email, resolution, start - start % resolution, end))
+    points = [[row[0], row[1], row[2]] for row in c.fetchall()]
+    return resolution, points
+
+# --- ARKA PLAN İŞLERİ İÇİN LİDER SEÇİMİ ---
+# Gunicorn ile birden fazla worker process çalışırken denetim ve yeniden
+# yükleme thread'leri yalnızca bir process'te çalışmalı. Kilit dosyasını
+# alan process lider olur; lider kapanırsa kilit serbest kalır ve bekleyen
+# process'lerden biri işleri devralır.
+LEADER_LOCK_FILE = os.environ.get('PANEL_LEADER_LOCK_FILE', 'admin_panel.leader.lock')
+
+_leader_thread = None
+_leader_lock_fd = None
+
+def _leader_loop(start_reload_worker):
+    global _leader_lock_fd
+    fd = os.open(LEADER_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+    fcntl.flock(fd, fcntl.LOCK_EX)  # lider olana kadar burada bekler
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    _leader_lock_fd = fd
+    print(f"Sistem: Arka plan işleri bu process'te çalışacak (pid {os.getpid()})")
+    start_reload_worker()
+    start_enforcement_worker()
+    start_traffic_sampler()
+
+def start_background_workers(start_reload_worker=None):
+    """
+    Lider seçimine katıl; lider olunca denetim ve yeniden yükleme worker'larını başlat.
+    start_reload_worker verilirse yeniden yükleme thread yerine onunla başlatılır (asgi.py).
+    """
+    global _leader_thread
+    if _leader_thread is not None:
+        return _leader_thread
+    _leader_thread = threading.Thread(target=_leader_loop, args=(start_reload_worker or _start_reload_worker,),
+                                      name='leader-election', daemon=True)
+    _leader_thread.start()
+    return _leader_thread
+
+# --- KULLANICI ALANLARININ TOPLU HESAPLANMASI ---
+# get_xui_users alanları kullanıcı kullanıcı değil, sütun sütun hesaplar:
+# önce tüm client'ların ham değerleri sütunlara toplanır, sonra her türetilmiş
+# alan tek geçişte hesaplanır. now/today bir kez alınır; tarih ayrıştırma ve
+# biçimlendirme aynı değer için tekrarlanmaz.
+GB = 1024 ** 3
+USER_SETTINGS_COLUMNS = ('email', 'monthly_price', 'last_payment_date', 'next_payment_date',
+                         'notes', 'quota_reset_date', 'folder', 'total_usage_ever')
+
+_parsed_days = {}
+
+def add_one_month(day, anchor_day=None):
+    """
+    Bir ay sonrası, ayın anchor_day'i (verilmezse day.day); ay kısaysa ayın
+    son günü (31 Ocak -> 28/29 Şubat -> 31 Mart).
+    """
+    year, month = (day.year + 1, 1) if day.month == 12 else (day.year, day.month + 1)
+    return day.replace(year=year, month=month,
+                       day=min(anchor_day or day.day, calendar.monthrange(year, month)[1]))
+
+def _parse_day(value):
+    """'YYYY-MM-DD' -> date (hatalıysa None); sonuçlar önbelleklenir"""
+    day = _parsed_days.get(value, False)
+    if day is False:
+        try:
+            day = datetime.strptime(value, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            day = None
+        if len(_parsed_days) > 10000:
+            _parsed_days.clear()
+        _parsed_days[value] = day
+    return day
+
+def _payment_bucket(days_diff, urgent_days, warning_days):
+    if days_diff is None:
+        return "none"
+    if days_diff < 0: 
+        return "overdue"
+    if days_diff <= urgent_days: 
+        return "urgent"
+    if days_diff <= warning_days: 
+        return "warning"
+    return "ok"
+
+def _package_tier(kota_limit):
+    if kota_limit == 0:
+        return "Sınırsız"
+    return "Gold" if kota_limit >= 100 else ("Silver" if kota_limit >= 50 else "Bronze")
+
+def online_state(last_online, current_time_ms):
+    """last_online (ms) -> (online_status, son_gorunme_kisa)"""
+    if last_online > 0:
+        time_diff_minutes = (current_time_ms - last_online) / 1000 / 60
+        if time_diff_minutes <= 1: 
+            return "online", "Aktif"
+        elif time_diff_minutes <= 10: 
+            return "idle", f"{int(time_diff_minutes)}dk"
+        elif time_diff_minutes <= 1440: 
+            hours = int(time_diff_minutes / 60)
+            return "offline", f"{hours}s"
+        else: 
+            days = int(time_diff_minutes / 1440)
+            return "offline", f"{days}g"
+    return "never", "Yok"
+
+# Snapshot'taki kullanıcılar dict değil UserRecord'dur: alan adları her
+# kullanıcıda tekrar tutulmaz (__slots__). JSON çıktısı kayıt başına ilk
+# istendiğinde üretilip saklanır; snapshot yenilendiğinde alanları
+# değişmeyen kullanıcının önceki kaydı (JSON'uyla) kullanılmaya devam eder.
+USER_FIELDS = (
+    'id', 'kullanici_adi', 'email', 'paket_tipi', 'sunucu_adi', 'kota_limit_gb',
+    'kullanilan_kota_gb', 'toplam_kullanim_gb', 'durum', 'bitis_tarihi', 'is_expired',
+    'inbound_id', 'online_status', 'son_gorunme_kisa', 'monthly_price', 'last_payment_date',
+    'next_payment_date', 'notes', 'payment_status', 'days_until_payment', 'expiry_date_only',
+    'quota_days', 'quota_reset_date', 'folder'
+)
+
+class UserRecord:
+    # kota_limit_gb: "Sınırsız" ya da GB; days_until_payment, quota_days: None olabilir
+    __slots__ = USER_FIELDS + ('_json',)
+    
+    def __init__(self, id, kullanici_adi, email, paket_tipi, sunucu_adi, kota_limit_gb,
+                 kullanilan_kota_gb, toplam_kullanim_gb, durum, bitis_tarihi, is_expired,
+                 inbound_id, online_status, son_gorunme_kisa, monthly_price, last_payment_date,
+                 next_payment_date, notes, payment_status, days_until_payment, expiry_date_only,
+                 quota_days, quota_reset_date, folder):
+        self.id = id
+        self.kullanici_adi = kullanici_adi
+        self.email = email
+        self.paket_tipi = paket_tipi
+        self.sunucu_adi = sunucu_adi
+        self.kota_limit_gb = kota_limit_gb
+        self.kullanilan_kota_gb = kullanilan_kota_gb
+        self.toplam_kullanim_gb = toplam_kullanim_gb
+        self.durum = durum
+        self.bitis_tarihi = bitis_tarihi
+        self.is_expired = is_expired
+        self.inbound_id = inbound_id
+        self.online_status = online_status
+        self.son_gorunme_kisa = son_gorunme_kisa
+        self.monthly_price = monthly_price
+        self.last_payment_date = last_payment_date
+        self.next_payment_date = next_payment_date
+        self.notes = notes
+        self.payment_status = payment_status
+        self.days_until_payment = days_until_payment
+        self.expiry_date_only = expiry_date_only
+        self.quota_days = quota_days
+        self.quota_reset_date = quota_reset_date
+        self.folder = folder
+        self._json = None
+    
+    def values(self):
+        """Alan değerleri USER_FIELDS sırasıyla"""
+        return _user_values(self)
+    
+    def as_dict(self):
+        return dict(zip(USER_FIELDS, _user_values(self)))
+    
+    def to_json(self):
+        if self._json is None:
+            self._json = dumps_compact(self.as_dict())
+        return self._json
+
+_user_values = operator.attrgetter(*USER_FIELDS)
+
+def dumps_compact(value):
+    """jsonify ile aynı biçimde JSON metni (app.json ayarları, boşluksuz)"""
+    return json.dumps(value, ensure_ascii=app.json.ensure_ascii, sort_keys=app.json.sort_keys,
+                      separators=(',', ':'))
+
+def build_user_records(columns):
+    """{alan: değer listesi} sütunlarından UserRecord listesi"""
+    return list(map(UserRecord, *(columns[name] for name in USER_FIELDS)))
+
+def users_json_response(payload):
+    """
+    Kullanıcı listesini ya da 'users' listesi içeren sonucu kayıtların
+    hazır JSON'larıyla yaz; çıktı jsonify ile aynıdır.
+    """
+    if isinstance(payload, list):
+        body = '[' + ','.join(user.to_json() for user in payload) + ']'
+    else:
+        parts = []
+        for key in sorted(payload):
+            value = payload[key]
+            if key == 'users':
+                text = '[' + ','.join(user.to_json() for user in value) + ']'
+            else:
+                text = dumps_compact(value)
+            parts.append(f"{dumps_compact(key)}:{text}")
+        body = '{' + ','.join(parts) + '}'
+    return Response(body + '\n', mimetype=app.json.mimetype)
+
+def derive_user_records(entries, traffic, settings, current_time_ms, today, thresholds):
+    """
+    entries: [(inbound_id, client)], traffic: {email: (up, down, last_online)},
+    settings: {email: user_settings satırı}, thresholds: bildirim eşikleri
+    (ödeme durumu için). UserRecord listesi döndürür.
+    """
+    no_traffic = (0, 0, 0)
+    emails = [client.get('email', '') for _, client in entries]
+    counters = [traffic.get(email, no_traffic) for email in emails]
+    rows = [settings.get(email) for email in emails]
+    
+    # Kota ve kullanım (GB)
+    used = [(up + down) / GB for up, down, _ in counters]
+    used_rounded = [round(value, 2) for value in used]
+    ever = [(row['total_usage_ever'] or 0) if row is not None else 0 for row in rows]
+    total_rounded = [round(e + u, 2) for e, u in zip(ever, used)]
+    limits = [(client.get('totalGB', 0) / GB if client.get('totalGB', 0) > 0 else 0) for _, client in entries]
+    tiers = [_package_tier(limit) for limit in limits]
+    limits_out = [round(limit, 2) if limit > 0 else "Sınırsız" for limit in limits]
+    
+    # Bitiş tarihi: saniyeye yuvarlanmış zaman tek kez biçimlendirilir
+    expiries = [client.get('expiryTime', 0) for _, client in entries]
+    expiry_text = [datetime.fromtimestamp(expiry // 1000).isoformat(' ') if expiry > 0 else None for expiry in expiries]
+    bitis = [text if text is not None else "Süresiz" for text in expiry_text]
+    expiry_day = [text[:10] if text is not None else "" for text in expiry_text]
+    expired = [expiry > 0 and expiry < current_time_ms for expiry in expiries]
+    quota_days = [max(0, int((expiry - current_time_ms) / 1000 / 86400)) if expiry > 0 else None for expiry in expiries]
+    
+    online = [online_state(last_online, current_time_ms) for _, _, last_online in counters]
+    
+    # Ödeme: panel tarihi yoksa x-ui bitiş günü kullanılır
+    next_payment = [((row['next_payment_date'] if row is not None else '') or day) for row, day in zip(rows, expiry_day)]
+    payment_days = []
+    for value in next_payment:
+        day = _parse_day(value) if value else None
+        payment_days.append((day - today).days if day is not None else None)
+    urgent_days, warning_days = thresholds['payment_urgent_days'], thresholds['payment_warning_days']
+    payment_status = [_payment_bucket(days, urgent_days, warning_days) for days in payment_days]
+    panel_name = get_panel_config()['panel_name']
+    
+    count = len(entries)
+    columns = {
+        'id': [client.get('id') for _, client in entries],
+        'kullanici_adi': emails,
+        'email': emails,
+        'paket_tipi': tiers,
+        'sunucu_adi': [panel_name] * count,
+        'kota_limit_gb': limits_out,
+        'kullanilan_kota_gb': used_rounded,
+        'toplam_kullanim_gb': total_rounded,
+        'durum': ['aktif' if client.get('enable') == True else 'pasif' for _, client in entries],
+        'bitis_tarihi': bitis,
+        'is_expired': expired,
+        'inbound_id': [inbound_id for inbound_id, _ in entries],
+        'online_status': [state[0] for state in online],
+        'son_gorunme_kisa': [state[1] for state in online],
+        'monthly_price': [row['monthly_price'] if row is not None else 0 for row in rows],
+        'last_payment_date': [row['last_payment_date'] if row is not None else '' for row in rows],
+        'next_payment_date': next_payment,
+        'notes': [row['notes'] if row is not None else '' for row in rows],
+        'payment_status': payment_status,
+        'days_until_payment': payment_days,
+        'expiry_date_only': expiry_day,
+        'quota_days': quota_days,
+        'quota_reset_date': [row['quota_reset_date'] if row is not None else '' for row in rows],
+        'folder': [row['folder'] if row is not None else 'Tümü' for row in rows]
+    }
+    return build_user_records(columns)
+
+def load_xui_users(thresholds=None):
+    """Kullanıcı kayıtlarını oluştur; x-ui.db yoksa ya da okunamazsa hata fırlatır"""
+    if not os.path.exists(XUI_DB):
+        raise FileNotFoundError(f"x-ui veritabanı bulunamadı: {XUI_DB}")
+    
+    c = get_db(XUI_DB).cursor()
+    inbounds = load_inbounds(c)
+    c.execute("SELECT email, up, down, last_online FROM client_traffics")
+    traffic = {row[0]: (row[1] or 0, row[2] or 0, row[3] or 0) for row in c.fetchall()}
+    
+    admin_c = get_db(PANEL_DB).cursor()
+    admin_c.execute(f"SELECT {', '.join(USER_SETTINGS_COLUMNS)} FROM user_settings")
+    settings = {row['email']: row for row in admin_c.fetchall()}
+    
+    entries = []
+    for inbound_id, clients in inbounds:
+        for client in clients:
+            email = client.get('email', '')
+            if not email or len(email) != 4: 
+                continue
+            entries.append((inbound_id, client))
+    
+    if thresholds is None:
+        thresholds = load_notification_thresholds(admin_c)
+    return derive_user_records(entries, traffic, settings, int(time.time() * 1000), date.today(), thresholds)
+
+def get_xui_users(thresholds=None):
+    try:
+        if not os.path.exists(XUI_DB): return []
+        return load_xui_users(thresholds)
+    except Exception as e:
+        print(f"Hata: {e}")
+        return []
+
+# --- KULLANICI SNAPSHOT ÖNBELLEĞİ ---
+# /api/users, /api/stats ve /api/notifications aynı snapshot'tan beslenir.
+# Snapshot TTL dolunca ya da x-ui.db (WAL dahil) değişince yeniden
+# oluşturulur. Panel veritabanı arka planda sürekli yazıldığı için dosya
+# imzasına bakılmaz: değişiklik yapan route'lar snapshot'ı geçersiz kılar ve
+# runtime_state'teki users_version sayacını artırır, diğer worker
+# process'leri sayaç değişince yeniden oluşturur.
+USERS_CACHE_TTL = int(os.environ.get('PANEL_USERS_CACHE_TTL', '10'))  # saniye
+
+_users_snapshot_lock = threading.Lock()
+_users_snapshot = {'users': None, 'view': None, 'built_at': 0, 'signature': None, 'version': 0}
+
+# --- KULLANICI DEĞİŞİKLİK AKIŞI ---
+# Her snapshot oluşturulduğunda kullanıcıların hesaplanan alanları bir
+# öncekiyle karşılaştırılır; değişen kullanıcıya snapshot sürümü
+# (oluşturulma zamanı, ms) yazılır. Sürümler saat tabanlı olduğundan farklı
+# worker process'lerinden alınan sürümler birbiriyle karşılaştırılabilir.
+# Bu process'in geçmişinden eski bir sürüm gelirse tam liste gönderilir.
+USER_CHANGES_RETENTION_SECONDS = 3600  # silinen kullanıcı kayıtları bu kadar tutulur
+
+_user_changes = {
+    'records': {},        # email -> son kayıt
+    'changed_at': {},     # email -> son değiştiği sürüm
+    'removed': {},        # email -> silindiği sürüm
+    'history_start': None # bu sürümden eskisine delta verilemez
+}
+
+def _track_user_changes(users, version):
+    """
+    Kayıtları öncekilerle karşılaştır; (değişen kullanıcılar, silinen emailler)
+    döndür. Değişmeyen kullanıcının önceki kaydı users listesine geri konur.
+    """
+    records = _user_changes['records']
+    changed_at = _user_changes['changed_at']
+    removed = _user_changes['removed']
+    if _user_changes['history_start'] is None:
+        _user_changes['history_start'] = version
+    
+    seen = set()
+    changed = []
+    for pos, user in enumerate(users):
+        email = user.email
+        seen.add(email)
+        previous = records.get(email)
+        if previous is not None and previous.values() == user.values():
+            users[pos] = previous
+            continue
+        records[email] = user
+        changed_at[email] = version
+        removed.pop(email, None)
+        changed.append(user)
+    gone = [email for email in records if email not in seen]
+    for email in gone:
+        del records[email]
+        del changed_at[email]
+        removed[email] = version
+    
+    cutoff = version - USER_CHANGES_RETENTION_SECONDS * 1000
+    if any(removed_at < cutoff for removed_at in removed.values()):
+        for email in [email for email, removed_at in removed.items() if removed_at < cutoff]:
+            del removed[email]
+        _user_changes['history_start'] = max(_user_changes['history_start'], cutoff)
+    return changed, gone
+
+def get_user_changes(since=None):
+    """
+    since sürümünden sonra değişen ve silinen kullanıcılar. since yoksa ya
+    da bu process'in geçmişinden eskiyse tüm liste döner (full=True).
+    """
+    with _users_snapshot_lock:
+        snapshot = _refresh_snapshot()
+        users = snapshot['users']
+        version = snapshot['version']
+        if since is None or since < _user_changes['history_start']:
+            return {'version': version, 'full': True, 'users': users, 'removed': []}
+        changed_at = _user_changes['changed_at']
+        return {
+            # Başka bir worker'dan daha yeni bir sürüm geldiyse istemcinin sürümü korunur
+            'version': max(version, since),
+            'full': False,
+            'users': [user for user in users if changed_at.get(user.email, 0) > since],
+            'removed': [email for email, removed_at in _user_changes['removed'].items() if removed_at > since]
+        }
+
+def _db_signature():
+    """x-ui.db dosyalarının (WAL dahil) mtime/boyut imzası ve panelin users_version sayacı"""
+    signature = []
+    for path in (XUI_DB, XUI_DB + '-wal'):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append(None)
+    signature.append(load_users_version(get_db(PANEL_DB).cursor()))
+    return tuple(signature)
+
+def load_users_version(c):
+    return load_runtime_state(c, 'users_version') or 0
+
+def bump_users_version():
+    """Kullanıcı listesini etkileyen değişikliği tüm process'lere duyur"""
+    try:
+        with db_transaction(PANEL_DB) as c:
+            c.execute("""INSERT INTO runtime_state (key, value, updated_at) VALUES ('users_version', '1', ?)
+                         ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1,
+                                                        updated_at = excluded.updated_at""",
+                      (time.time(),))
+    except Exception as e:
+        print(f"Kullanıcı sürümü güncellenemedi: {e}")
+
+def get_users_snapshot():
+    """Önbellekteki kullanıcı listesini döndür, gerekiyorsa yeniden oluştur"""
+    return _get_snapshot()['users']
+
+def get_users_view():
+    """Snapshot'ın filtre indeksini döndür"""
+    return _get_snapshot()['view']
+
+def _get_snapshot():
+    with _users_snapshot_lock:
+        return _refresh_snapshot()
+
+def _refresh_snapshot():
+    """_users_snapshot_lock tutulurken çağrılır"""
+    signature = _db_signature()
+    age = time.time() - _users_snapshot['built_at']
+    if (_users_snapshot['users'] is not None
+            and _users_snapshot['signature'] == signature
+            and age < USERS_CACHE_TTL):
+        return _users_snapshot
+    
+    thresholds = load_notification_thresholds(get_db(PANEL_DB).cursor())
+    try:
+        users = load_xui_users(thresholds)
+    except Exception as e:
+        # Okuma hatası "herkes silindi" sayılmasın: önceki snapshot (yoksa boş
+        # liste) TTL boyunca sunulur, değişiklik akışı ve sayaçlar dokunulmaz
+        print(f"Kullanıcı snapshot'ı oluşturulamadı, önceki liste kullanılıyor: {e}")
+        if _users_snapshot['users'] is None:
+            _users_snapshot['users'] = []
+            _users_snapshot['view'] = UsersView([])
+        _users_snapshot['built_at'] = time.time()
+        _users_snapshot['signature'] = signature
+        return _users_snapshot
+    built_at = time.time()
+    # Aynı milisaniyede iki kez oluşturulsa da sürüm ileri gitsin
+    version = max(int(built_at * 1000), _users_snapshot['version'] + 1)
+    changed, gone = _track_user_changes(users, version)
+    _users_stats.apply(changed, gone)
+    # Liste boş olsa da eşitlenir: son kullanıcı silinince bildirimleri çözülsün
+    try:
+        _notification_engine.sync(users, changed, gone, thresholds)
+    except Exception as e:
+        print(f"Bildirim güncelleme hatası: {e}")
+    _users_snapshot['users'] = users
+    _users_snapshot['view'] = UsersView(users)
+    _users_snapshot['built_at'] = built_at
+    _users_snapshot['signature'] = signature
+    _users_snapshot['version'] = version
+    return _users_snapshot
+
+def invalidate_users_snapshot():
+    """Bir sonraki okumada snapshot'ın (tüm process'lerde) yeniden oluşturulmasını sağla"""
+    bump_users_version()
+    with _users_snapshot_lock:
+        # Liste silinmez: yeniden oluşturma başarısız olursa o sunulmaya devam eder
+        _users_snapshot['signature'] = None
+
+# --- CANLI OLAY YAYINI (SSE) ---
+# Her process'te tek bir izleyici thread client_traffics tablosunu kısa
+# aralıklarla okur. Kullanım ve online durumu değişen kullanıcılar,
+# /api/events'e bağlı tüm admin oturumlarına 'traffic' olayı olarak
+# gönderilir. Kullanıcı listesini etkileyen diğer değişikliklerde
+# (aktif/pasif, kullanıcı eklenip silinmesi, users_version sayacını artıran
+# panel ayarları) 'users' olayı gider ve tarayıcı /api/users/changes ile
+# delta çeker. Bağlı admin yoksa izleyici bekler.
+EVENTS_POLL_SECONDS = 2
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_RETRY_MS = 5000
+EVENTS_MAX_CLIENTS = int(os.environ.get('PANEL_EVENTS_MAX_CLIENTS', '4'))  # process başına
+EVENTS_QUEUE_SIZE = 100
+
+_events_cond = threading.Condition()
+_events_subscribers = set()
+_events_thread = None
+
+def subscribe_events(queue_class=queue.Queue):
+    """Yeni abone kuyruğu döndür; limit doluysa None"""
+    global _events_thread
+    with _events_cond:
+        if len(_events_subscribers) >= EVENTS_MAX_CLIENTS:
+            return None
+        subscriber = queue_class(maxsize=EVENTS_QUEUE_SIZE)
+        _events_subscribers.add(subscriber)
+        if _events_thread is None or not _events_thread.is_alive():
+            _events_thread = threading.Thread(target=_events_loop, name='events-watcher', daemon=True)
+            _events_thread.start()
+        _events_cond.notify_all()
+        return subscriber
+
+def unsubscribe_events(subscriber):
+    with _events_cond:
+        _events_subscribers.discard(subscriber)
+
+def publish_event(event, data):
+    """Olayı tüm abonelere ilet; yetişemeyen abone tam senkrona düşürülür"""
+    with _events_cond:
+        subscribers = list(_events_subscribers)
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait((event, data))
+        except queue.Full:
+            with subscriber.mutex:
+                subscriber.queue.clear()
+            subscriber.put_nowait(('users', {}))
+
+def _events_loop():
+    live_state = None      # email -> (kullanılan byte, online_status, son_gorunme_kisa)
+    enable_state = None    # email -> enable
+    users_version = None   # runtime_state'teki sayaç (panel tarafı değişiklikler)
+    while True:
+        with _events_cond:
+            while not _events_subscribers:
+                # Abone kalmadı: tekrar bağlanan ilk abone güncel durumu sıfırdan alsın
+                live_state = None
+                _events_cond.wait()
+        
+        try:
+            if os.path.exists(XUI_DB):
+                c = get_db(XUI_DB).cursor()
+                c.execute("SELECT email, up, down, last_online, enable FROM client_traffics")
+                rows = c.fetchall()
+                current_time_ms = int(time.time() * 1000)
+                
+                new_state = {}
+                new_enable = {}
+                changed = []
+                for row in rows:
+                    email = row['email']
+                    used = (row['up'] or 0) + (row['down'] or 0)
+                    status, son_gorunme_kisa = online_state(row['last_online'] or 0, current_time_ms)
+                    state = (used, status, son_gorunme_kisa)
+                    new_state[email] = state
+                    new_enable[email] = row['enable']
+                    if live_state is not None and live_state.get(email) != state:
+                        changed.append({
+                            'email': email,
+                            'kullanilan_kota_gb': round(used / (1024**3), 2),
+                            'online_status': status,
+                            'son_gorunme_kisa': son_gorunme_kisa
+                        })
+                
+                resync = live_state is not None and (new_enable != enable_state or new_state.keys() != live_state.keys())
+                live_state, enable_state = new_state, new_enable
+                if changed:
+                    publish_event('traffic', {'users': changed})
+            else:
+                resync = False
+            
+            # Panel veritabanı arka planda sürekli yazılır (denetim durumu, trafik
+            # sayaçları, bildirimler); sadece kullanıcıyı etkileyen değişiklikler sayılır
+            version = load_users_version(get_db(PANEL_DB).cursor())
+            if users_version is not None and version != users_version:
+                resync = True
+            users_version = version
+            if resync:
+                publish_event('users', {})
+        except Exception as e:
+            print(f"Canlı olay izleyici hatası: {e}")
+        
+        time.sleep(EVENTS_POLL_SECONDS)
+
+def _format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_events(subscriber):
+    """Abone kuyruğunu SSE akışına çevir; sessizlikte heartbeat gönder"""
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        yield _format_event('hello', {'poll_seconds': EVENTS_POLL_SECONDS})
+        while True:
+            try:
+                event, data = subscriber.get(timeout=EVENTS_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            yield _format_event(event, data)
+    finally:
+        unsubscribe_events(subscriber)
+
+# --- KULLANICI İSTATİSTİKLERİ ---
+# Sayaçlar her snapshot'ta baştan sayılmaz: değişen kullanıcının eski
+# katkısı çıkarılıp yenisi eklenir, silinen kullanıcının katkısı düşülür.
+# Genel toplamın yanında klasör ve paket tipine göre kırılımlar tutulur;
+# /api/stats hazır sayaçları döndürür.
+STATS_FIELDS = ('total_users', 'active_users', 'passive_users', 'online_users', 'overdue_count', 'total_usage_gb')
+
+def _empty_stats():
+    return dict.fromkeys(STATS_FIELDS, 0)
+
+def _stats_contribution(user):
+    active = user.durum == 'aktif'
+    return (user.folder or 'Tümü', user.paket_tipi, active,
+            user.online_status == 'online', user.payment_status == 'overdue',
+            user.toplam_kullanim_gb)
+
+class UsersStats:
+    def __init__(self):
+        self.contributions = {}   # email -> _stats_contribution
+        self.totals = _empty_stats()
+        self.by_folder = {}
+        self.by_package = {}
+    
+    def apply(self, changed_users, removed_emails):
+        for email in removed_emails:
+            old = self.contributions.pop(email, None)
+            if old is not None:
+                self._add(old, -1)
+        for user in changed_users:
+            new = _stats_contribution(user)
+            old = self.contributions.get(user.email)
+            if old == new:
+                continue
+            if old is not None:
+                self._add(old, -1)
+            self._add(new, 1)
+            self.contributions[user.email] = new
+    
+    def _add(self, contribution, sign):
+        folder, package, active, online, overdue, usage = contribution
+        for bucket in (self.totals,
+                       self.by_folder.setdefault(folder, _empty_stats()),
+                       self.by_package.setdefault(package, _empty_stats())):
+            bucket['total_users'] += sign
+            bucket['active_users' if active else 'passive_users'] += sign
+            bucket['online_users'] += sign if online else 0
+            bucket['overdue_count'] += sign if overdue else 0
+            bucket['total_usage_gb'] += sign * usage
+    
+    def summary(self, folders=None):
+        """Genel (ya da verilen klasörlerin toplamı) sayaçlar ve kırılımlar"""
+        if folders:
+            result = _empty_stats()
+            for folder in folders:
+                for field, value in self.by_folder.get(folder, {}).items():
+                    result[field] += value
+        else:
+            result = dict(self.totals)
+        result['total_usage_gb'] = round(result['total_usage_gb'], 2)
+        result['by_folder'] = {folder: self._rounded(bucket) for folder, bucket in self.by_folder.items() if bucket['total_users']}
+        result['by_package'] = {package: self._rounded(bucket) for package, bucket in self.by_package.items() if bucket['total_users']}
+        return result
+    
+    @staticmethod
+    def _rounded(bucket):
+        bucket = dict(bucket)
+        bucket['total_usage_gb'] = round(bucket['total_usage_gb'], 2)
+        return bucket
+
+_users_stats = UsersStats()
+
+def get_users_stats(folders=None):
+    with _users_snapshot_lock:
+        _refresh_snapshot()
+        return _users_stats.summary(folders)
+
+# --- BİLDİRİM MOTORU ---
+# Kurallar her istekte bütün kullanıcılar için yeniden çalıştırılmaz:
+# snapshot yenilenirken sadece alanları değişen kullanıcılar değerlendirilir
+# ve sonuç notifications tablosuyla eşitlenir. Her (kullanıcı, tür) için en
+# fazla bir açık bildirim vardır; ilk görülme, okundu ve çözüldü zamanları
+# saklanır. Eşikler panel_settings tablosundan okunur, değişince bütün
+# kullanıcılar yeniden değerlendirilir.
+NOTIFICATION_DEFAULTS = {
+    'payment_urgent_days': 6,      # bu kadar gün ve altı: acil
+    'payment_warning_days': 14,    # bu kadar gün ve altı: uyarı
+    'quota_high_percent': 90,      # kota kullanım yüzdesi
+    'quota_reset_soon_days': 3     # kalan gün
+}
+NOTIFICATION_PRIORITY_RANK = {'high': 0, 'medium': 1, 'low': 2}
+NOTIFICATION_RETENTION_DAYS = 30   # çözülmüş bildirimler bu kadar saklanır
+
+def load_notification_thresholds(c):
+    """Kayıtlı eşikleri varsayılanlarla birleştirerek döndür"""
+    thresholds = dict(NOTIFICATION_DEFAULTS)
+    c.execute("SELECT value FROM panel_settings WHERE key = 'notification_thresholds'")
+    row = c.fetchone()
+    if row:
+        saved = json.loads(row[0])
+        thresholds.update({key: saved[key] for key in NOTIFICATION_DEFAULTS if key in saved})
+    return thresholds
+
+def evaluate_notification_rules(user, thresholds):
+    """Kullanıcı için açık olması gereken bildirimler: {tür: (öncelik, mesaj)}"""
+    active = {}
+    payment_status = user.payment_status
+    if payment_status == 'overdue':
+        active['payment_overdue'] = ('high', f"Ödeme {abs(user.days_until_payment)} gün gecikti!")
+    elif payment_status == 'urgent':
+        active['payment_urgent'] = ('medium', f"{user.days_until_payment} gün içinde ödeme")
+    elif payment_status == 'warning':
+        active['payment_warning'] = ('low', f"{user.days_until_payment} gün içinde ödeme")
+    
+    if user.kota_limit_gb != "Sınırsız":
+        usage_percent = (user.kullanilan_kota_gb / user.kota_limit_gb) * 100
+        if usage_percent >= thresholds['quota_high_percent']:
+            active['quota_high'] = ('medium', f"Kota %{int(usage_percent)} doldu")
+    
+    if user.quota_days is not None and user.quota_days <= thresholds['quota_reset_soon_days']:
+        active['quota_reset_soon'] = ('low', f"Kota {user.quota_days} gün içinde sıfırlanacak")
+    
+    if user.is_expired:
+        active['expired'] = ('high', "Kullanım süresi dolmuş!")
+    return active
+
+class NotificationEngine:
+    def __init__(self):
+        self.thresholds = None
+    
+    def sync(self, users, changed, gone, thresholds):
+        """Değişen kullanıcıların kurallarını çalıştır, tabloyu eşitle"""
+        full = thresholds != self.thresholds
+        targets = users if full else changed
+        if not targets and not gone:
+            return
+        desired = {user.email: evaluate_notification_rules(user, thresholds) for user in targets}
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        with db_transaction(PANEL_DB) as c:
+            existing = {}
+            if full:
+                c.execute("SELECT id, email, type, message FROM notifications WHERE resolved_at IS NULL")
+                rows = c.fetchall()
+            else:
+                rows = []
+                for chunk in _chunked(list(desired) + list(gone)):
+                    placeholders = ','.join('?' * len(chunk))
+                    c.execute(f"""SELECT id, email, type, message FROM notifications
+                                  WHERE resolved_at IS NULL AND email IN ({placeholders})""", chunk)
+                    rows.extend(c.fetchall())
+            for row in rows:
+                existing[(row['email'], row['type'])] = (row['id'], row['message'])
+            
+            inserts, updates, resolved = [], [], []
+            for email, active in desired.items():
+                for kind, (priority, message) in active.items():
+                    current = existing.pop((email, kind), None)
+                    if current is None:
+                        inserts.append((email, kind, priority, NOTIFICATION_PRIORITY_RANK[priority], message, now))
+                    elif current[1] != message:
+                        updates.append((message, current[0]))
+            # Kalan açık bildirimler artık geçerli değil (ya da kullanıcı silinmiş)
+            resolved = [(now, notification_id) for notification_id, _ in existing.values()]
+            
+            if inserts:
+                c.executemany("""INSERT INTO notifications (email, type, priority, priority_rank, message, first_seen)
+                                 VALUES (?, ?, ?, ?, ?, ?)
+                                 ON CONFLICT(email, type) WHERE resolved_at IS NULL DO NOTHING""", inserts)
+            if updates:
+                c.executemany("UPDATE notifications SET message = ? WHERE id = ?", updates)
+            if resolved:
+                c.executemany("UPDATE notifications SET resolved_at = ? WHERE id = ?", resolved)
+            if full:
+                cutoff = (datetime.now() - timedelta(days=NOTIFICATION_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+                c.execute("DELETE FROM notifications WHERE resolved_at IS NOT NULL AND resolved_at < ?", (cutoff,))
+        self.thresholds = thresholds
+
+_notification_engine = NotificationEngine()
+
+def get_active_notifications(include_acknowledged=True):
+    """Açık bildirimler: önce öncelik, sonra en yeni"""
+    c = get_db(PANEL_DB).cursor()
+    query = """SELECT id, email, type, priority, message, first_seen, acknowledged_at
+               FROM notifications WHERE resolved_at IS NULL"""
+    if not include_acknowledged:
+        query += " AND acknowledged_at IS NULL"
+    c.execute(query + " ORDER BY priority_rank, first_seen DESC, id DESC")
+    return [{
+        'id': row['id'],
+        'type': row['type'],
+        'user': row['email'],
+        'message': row['message'],
+        'priority': row['priority'],
+        'first_seen': row['first_seen'],
+        'acknowledged': row['acknowledged_at'] is not None
+    } for row in c.fetchall()]
+
+# --- KULLANICI LİSTESİ FİLTRE/SIRALAMA İNDEKSİ ---
+# Snapshot her oluşturulduğunda filtrelenen alanlar için değer -> sıra
+# numarası indeksi kurulur; /api/users sorguları listeyi baştan taramak
+# yerine indeksteki en küçük kümeden başlar. Sıralamalar ilk istendiğinde
+# hesaplanır ve snapshot yenilenene kadar saklanır.
+USERS_PAGE_MAX = 500
+USERS_INDEXED_FIELDS = {
+    'folder': 'folder',
+    'status': 'durum',
+    'online_status': 'online_status',
+    'payment_status': 'payment_status'
+}
+USERS_SORT_KEYS = {
+    'kullanici_adi': lambda u: u.kullanici_adi,
+    'folder': lambda u: u.folder or '',
+    'durum': lambda u: u.durum,
+    'kullanilan_kota_gb': lambda u: u.kullanilan_kota_gb,
+    'toplam_kullanim_gb': lambda u: u.toplam_kullanim_gb,
+    'kota_limit_gb': lambda u: float('inf') if u.kota_limit_gb == "Sınırsız" else u.kota_limit_gb,
+    'monthly_price': lambda u: u.monthly_price or 0,
+    'days_until_payment': lambda u: u.days_until_payment,
+    'next_payment_date': lambda u: u.next_payment_date or None,
+    'quota_days': lambda u: u.quota_days,
+    'bitis_tarihi': lambda u: u.expiry_date_only or None
+}
+
+class UsersView:
+    def __init__(self, users):
+        self.users = users
+        self.index = {param: {} for param in USERS_INDEXED_FIELDS}
+        self.search_text = []
+        for pos, user in enumerate(users):
+            for param, field in USERS_INDEXED_FIELDS.items():
+                self.index[param].setdefault(getattr(user, field), []).append(pos)
+            self.search_text.append(f"{user.kullanici_adi}\n{user.notes or ''}".lower())
+        self._orders = {}
+        self._orders_lock = threading.Lock()
+    
+    def order(self, sort_key):
+        """Artan sıralamadaki sıra numaraları; boş değerler sonda"""
+        with self._orders_lock:
+            positions = self._orders.get(sort_key)
+            if positions is None:
+                key = USERS_SORT_KEYS[sort_key]
+                def sort_value(pos):
+                    value = key(self.users[pos])
+                    return (value is None, value if value is not None else 0)
+                positions = sorted(range(len(self.users)), key=sort_value)
+                self._orders[sort_key] = positions
+            return positions
+    
+    def query(self, filters, search=None, sort=None):
+        """Filtrelere uyan kullanıcıları (sıralı) döndür"""
+        candidates = None
+        for param, values in sorted(filters.items(), key=lambda item: self._size(*item)):
+            matched = set()
+            for value in values:
+                matched.update(self.index[param].get(value, ()))
+            candidates = matched if candidates is None else candidates & matched
+            if not candidates:
+                return []
+        
+        if search:
+            search = search.lower()
+            pool = candidates if candidates is not None else range(len(self.users))
+            candidates = {pos for pos in pool if search in self.search_text[pos]}
+        
+        if sort:
+            descending = sort.startswith('-')
+            positions = self.order(sort.lstrip('-'))
+            if descending:
+                # Boş değerler azalan sıralamada da sonda kalsın
+                key = USERS_SORT_KEYS[sort.lstrip('-')]
+                filled = [pos for pos in positions if key(self.users[pos]) is not None]
+                positions = filled[::-1] + positions[len(filled):]
+            if candidates is not None:
+                positions = [pos for pos in positions if pos in candidates]
+        elif candidates is not None:
+            positions = sorted(candidates)
+        else:
+            positions = range(len(self.users))
+        return [self.users[pos] for pos in positions]
+    
+    def _size(self, param, values):
+        return sum(len(self.index[param].get(value, ())) for value in values)
+
+def parse_users_query(args):
+    """
+    /api/users sorgu parametrelerini ayrıştır. Filtreler virgülle çoklu
+    değer alabilir (ör. payment_status=overdue,urgent); folder=Tümü filtre
+    değildir. Hatalı parametrede ValueError fırlatır.
+    """
+    filters = {}
+    for param in USERS_INDEXED_FIELDS:
+        raw = args.get(param)
+        if not raw:
+            continue
+        values = [value.strip() for value in raw.split(',') if value.strip()]
+        if param == 'folder' and 'Tümü' in values:
+            continue
+        if values:
+            filters[param] = values
+    
+    sort = args.get('sort') or None
+    if sort and sort.lstrip('-') not in USERS_SORT_KEYS:
+        raise ValueError(f"Geçersiz sıralama: {sort}")
+    
+    try:
+        offset = int(args.get('offset') or args.get('cursor') or 0)
+        limit = int(args.get('limit') or USERS_PAGE_MAX)
+    except ValueError:
+        raise ValueError("limit/offset sayı olmalı")
+    if offset < 0 or limit <= 0:
+        raise ValueError("limit/offset negatif olamaz")
+    
+    return {
+        'filters': filters,
+        'search': (args.get('search') or args.get('q') or '').strip(),
+        'sort': sort,
+        'offset': offset,
+        'limit': min(limit, USERS_PAGE_MAX)
+    }
+
+# --- DIŞA AKTARMA ---
+# Muhasebe için CSV/JSON dökümler. Satırlar cursor'dan parça parça okunup
+# yanıta yazılır; bellek kullanımı satır sayısından bağımsızdır. Dökümler
+# ayrı, salt okunur bir bağlantıyla okunur: uzun süren bir indirme thread'in
+# havuzdaki bağlantısını meşgul etmez, yarıda kesilirse bağlantı kapanır.
+EXPORT_BATCH_ROWS = 500
+
+EXPORT_USER_FIELDS = ('kullanici_adi', 'folder', 'paket_tipi', 'durum', 'kota_limit_gb',
+                      'kullanilan_kota_gb', 'toplam_kullanim_gb', 'monthly_price',
+                      'last_payment_date', 'next_payment_date', 'payment_status',
+                      'days_until_payment', 'bitis_tarihi', 'quota_days', 'notes')
 
-def get_xui_users():
+# Veritabanı dökümleri: (sorgu, tarih sütunu, klasör sütunu, sıralama)
+EXPORT_QUERIES = {
+    'payments': ("""SELECT p.id, p.email, COALESCE(s.folder, 'Tümü') AS folder, p.amount,
+                           p.payment_date, p.payment_method, p.notes, p.created_at
+                    FROM payment_history p LEFT JOIN user_settings s ON s.email = p.email""",
+                 'p.payment_date', "COALESCE(s.folder, 'Tümü')", 'p.payment_date, p.id'),
+    'quota-resets': ("""SELECT r.id, r.email, COALESCE(s.folder, 'Tümü') AS folder,
+                               r.reset_date, r.reset_type, r.created_at
+                        FROM quota_reset_log r LEFT JOIN user_settings s ON s.email = r.email""",
+                     'r.reset_date', "COALESCE(s.folder, 'Tümü')", 'r.reset_date, r.id'),
+    'user-settings': ("""SELECT email, folder, monthly_price, last_payment_date, next_payment_date,
+                                quota_start_date, quota_reset_date, total_usage_ever, notes,
+                                created_at, updated_at
+                         FROM user_settings""",
+                      'next_payment_date', 'folder', 'email'),
+}
+EXPORT_DATASETS = ('users',) + tuple(EXPORT_QUERIES)
+
+class _EchoBuffer:
+    """csv.writer'ın yazdığı satırı geri döndüren sahte dosya"""
+    def write(self, value):
+        return value
+
+def parse_export_query(args):
+    """format, from/to (YYYY-MM-DD, dahil) ve folder parametreleri; hatada ValueError"""
+    export_format = (args.get('format') or 'csv').lower()
+    if export_format not in ('csv', 'json'):
+        raise ValueError("format csv ya da json olmalı")
+
+    bounds = {}
+    for param in ('from', 'to'):
+        raw = args.get(param)
+        if raw:
+            day = _parse_day(raw)
+            if day is None:
+                raise ValueError(f"{param} YYYY-MM-DD olmalı")
+            bounds[param] = day
+    if 'from' in bounds and 'to' in bounds and bounds['from'] > bounds['to']:
+        raise ValueError("from, to'dan sonra olamaz")
+
+    folders = [f.strip() for f in (args.get('folder') or '').split(',') if f.strip() and f.strip() != 'Tümü']
+    return {
+        'format': export_format,
+        # Tarih sütunları 'YYYY-MM-DD' ya da 'YYYY-MM-DD HH:MM:SS'; üst sınır ertesi gün (hariç)
+        'since': bounds['from'].isoformat() if 'from' in bounds else None,
+        'until': (bounds['to'] + timedelta(days=1)).isoformat() if 'to' in bounds else None,
+        'folders': folders
+    }
+
+def _export_db_rows(dataset, query):
+    """Veritabanı dökümü: önce sütun adları, sonra satır tuple'ları"""
+    sql, date_column, folder_column, order_by = EXPORT_QUERIES[dataset]
+    where, params = [], []
+    if query['since']:
+        where.append(f"{date_column} >= ?")
+        params.append(query['since'])
+    if query['until']:
+        where.append(f"{date_column} < ?")
+        params.append(query['until'])
+    if query['folders']:
+        where.append(f"{folder_column} IN ({', '.join('?' * len(query['folders']))})")
+        params.extend(query['folders'])
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {order_by}"
+
+    conn = sqlite3.connect(f"file:{PANEL_DB}?mode=ro", uri=True, timeout=DB_BUSY_TIMEOUT_MS / 1000)
     try:
-        check_and_disable_quota_exceeded()
-        check_and_disable_expired_users()
-        
-        if not os.path.exists(XUI_DB): return []
-        
-        conn = sqlite3.connect(XUI_DB)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT id, settings FROM inbounds")
-        inbounds = c.fetchall()
-        c.execute("SELECT email, up, down, inbound_id, last_online FROM client_traffics")
-        
-        traffic_dict = {}
-        for row in c.fetchall():
-            traffic_dict[row['email']] = {
-                'up': row['up'] or 0,
-                'down': row['down'] or 0,
-                'inbound_id': row['inbound_id'],
-                'last_online': row['last_online'] or 0
-            }
+        c = conn.execute(sql, params)
+        yield [column[0] for column in c.description]
+        while True:
+            rows = c.fetchmany(EXPORT_BATCH_ROWS)
+            if not rows:
+                break
+            yield from rows
+    finally:
         conn.close()
-        
-        admin_conn = sqlite3.connect(PANEL_DB)
-        admin_conn.row_factory = sqlite3.Row
-        admin_c = admin_conn.cursor()
-        admin_c.execute("SELECT * FROM user_settings")
-        settings_dict = {row['email']: dict(row) for row in admin_c.fetchall()}
-        admin_conn.close()
-        
-        current_time_ms = int(time.time() * 1000)
-        users = []
-        
-        for inbound in inbounds:
-            settings = json.loads(inbound['settings'])
-            clients = settings.get('clients', [])
-            for client in clients:
-                email = client.get('email', '')
-                if not email or len(email) != 4: 
-                    continue
-                
-                traffic = traffic_dict.get(email, {'up': 0, 'down': 0, 'inbound_id': inbound['id'], 'last_online': 0})
-                upload_gb = traffic['up'] / (1024**3)
-                download_gb = traffic['down'] / (1024**3)
-                kullanilan_kota = upload_gb + download_gb
-                
-                user_settings = settings_dict.get(email, {})
-                total_usage_ever = user_settings.get('total_usage_ever', 0) or 0
-                toplam_kullanim = total_usage_ever + kullanilan_kota
-                
-                total = client.get('totalGB', 0)
-                kota_limit = total / (1024**3) if total > 0 else 0
-                paket_tipi = "Sınırsız" if kota_limit == 0 else ("Gold" if kota_limit >= 100 else ("Silver" if kota_limit >= 50 else "Bronze"))
-                
-                expiry = client.get('expiryTime', 0)
-                bitis_tarihi = datetime.fromtimestamp(expiry/1000).strftime('%Y-%m-%d %H:%M:%S') if expiry > 0 else "Süresiz"
-                expiry_date_only = datetime.fromtimestamp(expiry/1000).strftime('%Y-%m-%d') if expiry > 0 else ""
-                
-                is_expired = False
-                if expiry > 0:
-                    is_expired = expiry < current_time_ms
-                
-                last_online = traffic.get('last_online', 0)
-                if last_online > 0:
-                    time_diff_minutes = (current_time_ms - last_online) / 1000 / 60
-                    if time_diff_minutes <= 1: 
-                        online_status = "online"
-                        son_gorunme_kisa = "Aktif"
-                    elif time_diff_minutes <= 10: 
-                        online_status = "idle"
-                        son_gorunme_kisa = f"{int(time_diff_minutes)}dk"
-                    elif time_diff_minutes <= 1440: 
-                        hours = int(time_diff_minutes / 60)
-                        online_status = "offline"
-                        son_gorunme_kisa = f"{hours}s"
-                    else: 
-                        days = int(time_diff_minutes / 1440)
-                        online_status = "offline"
-                        son_gorunme_kisa = f"{days}g"
-                else: 
-                    online_status = "never"
-                    son_gorunme_kisa = "Yok"
-                
-                next_payment = user_settings.get('next_payment_date', '') or expiry_date_only
-                payment_status = "none"
-                days_until_payment = None
-                
-                if next_payment:
-                    try:
-                        next_date = datetime.strptime(next_payment, '%Y-%m-%d')
-                        today = datetime.now()
-                        next_date = next_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                        today = today.replace(hour=0, minute=0, second=0, microsecond=0)
-                        
-                        days_diff = (next_date - today).days
-                        days_until_payment = days_diff
-                        if days_diff < 0: 
-                            payment_status = "overdue"
-                        elif days_diff <= 6: 
-                            payment_status = "urgent"
-                        elif days_diff <= 14: 
-                            payment_status = "warning"
-                        else: 
-                            payment_status = "ok"
-                    except: 
-                        pass
-                
-                quota_days = None
-                if expiry > 0:
-                    try:
-                        days_diff = (expiry - current_time_ms) / 1000 / 86400
-                        quota_days = max(0, int(days_diff))
-                    except:
-                        quota_days = None
-                
-                folder = user_settings.get('folder', 'Tümü')
-                
-                users.append({
-                    'id': client.get('id'),
-                    'kullanici_adi': email,
-                    'email': email,
-                    'paket_tipi': paket_tipi,
-                    'sunucu_adi': 'NovaCell-3',
-                    'kota_limit_gb': round(kota_limit, 2) if kota_limit > 0 else "Sınırsız",
-                    'kullanilan_kota_gb': round(kullanilan_kota, 2),
-                    'toplam_kullanim_gb': round(toplam_kullanim, 2),
-                    'durum': 'aktif' if client.get('enable') == True else 'pasif',
-                    'bitis_tarihi': bitis_tarihi,
-                    'is_expired': is_expired,
-                    'inbound_id': inbound['id'],
-                    'online_status': online_status,
-                    'son_gorunme_kisa': son_gorunme_kisa,
-                    'monthly_price': user_settings.get('monthly_price', 0),
-                    'last_payment_date': user_settings.get('last_payment_date', ''),
-                    'next_payment_date': next_payment,
-                    'notes': user_settings.get('notes', ''),
-                    'payment_status': payment_status,
-                    'days_until_payment': days_until_payment,
-                    'expiry_date_only': expiry_date_only,
-                    'quota_days': quota_days,
-                    'quota_reset_date': user_settings.get('quota_reset_date', ''),
-                    'folder': folder
-                })
-        return users
-    except Exception as e:
-        print(f"Hata: {e}")
-        return []
+
+def _export_user_rows(query):
+    """Hesaplanmış kullanıcı listesi (/api/users ile aynı görünüm)"""
+    filters = {'folder': query['folders']} if query['folders'] else {}
+    yield list(EXPORT_USER_FIELDS)
+    for user in get_users_view().query(filters):
+        day = user.next_payment_date or ''
+        if query['since'] and (not day or day < query['since']):
+            continue
+        if query['until'] and (not day or day >= query['until']):
+            continue
+        yield tuple(getattr(user, field) for field in EXPORT_USER_FIELDS)
+
+def export_rows(dataset, query):
+    if dataset == 'users':
+        return _export_user_rows(query)
+    return _export_db_rows(dataset, query)
+
+def stream_export(rows, export_format):
+    """Satır üreticisini CSV ya da JSON dizisi olarak parça parça yaz"""
+    try:
+        yield from _export_chunks(rows, export_format)
+    finally:
+        # İndirme yarıda kesilirse okuma bağlantısı hemen kapansın
+        rows.close()
+
+def _export_chunks(rows, export_format):
+    columns = next(rows)
+    chunk = []
+    if export_format == 'csv':
+        writer = csv.writer(_EchoBuffer())
+        # BOM: Excel Türkçe karakterleri doğru açsın
+        chunk.append('\ufeff' + writer.writerow(columns))
+        for row in rows:
+            chunk.append(writer.writerow(row))
+            if len(chunk) >= EXPORT_BATCH_ROWS:
+                yield ''.join(chunk)
+                chunk = []
+        chunk.append('')
+    else:
+        chunk.append('[')
+        separator = '\n'
+        for row in rows:
+            chunk.append(separator + json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            separator = ',\n'
+            if len(chunk) >= EXPORT_BATCH_ROWS:
+                yield ''.join(chunk)
+                chunk = []
+        chunk.append('\n]\n')
+    yield ''.join(chunk)
+
+# --- GELİR ÖZETİ ---
+# Tahsilat, ödeme tablosu yerine revenue_monthly özetinden (kullanıcı x ay)
+# toplanır; klasör, kullanıcının güncel klasörüdür. Beklenen gelir: ay
+# sonunda kayıtlı olan ücretli kullanıcıların güncel aylık ücreti toplamı.
+# Hesaplar SQL'de yapılır, Python'a sadece ay/klasör başına birer satır gelir.
+REVENUE_MONTHS_DEFAULT = 12
+REVENUE_MONTHS_MAX = 120
+
+def record_revenue(c, email, amount, payment_date):
+    """Yeni ödemeyi aylık özete ekle (ödeme ile aynı işlemde çağrılır)"""
+    c.execute("""INSERT INTO revenue_monthly (month, email, collected, payments)
+                 VALUES (substr(?, 1, 7), ?, ?, 1)
+                 ON CONFLICT(month, email) DO UPDATE SET
+                     collected = collected + excluded.collected,
+                     payments = payments + 1""",
+              (payment_date, email, amount))
+
+def _shift_month(month, delta):
+    year, mon = divmod(int(month[:4]) * 12 + int(month[5:7]) - 1 + delta, 12)
+    return f"{year:04d}-{mon + 1:02d}"
+
+def parse_revenue_query(args):
+    """from/to (YYYY-MM) ya da months=N (bu ay dahil son N ay), folder; hatada ValueError"""
+    month_from, month_to = args.get('from'), args.get('to')
+    for value in (month_from, month_to):
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m')
+            except ValueError:
+                raise ValueError("from/to YYYY-MM olmalı")
+    try:
+        months = int(args.get('months') or REVENUE_MONTHS_DEFAULT)
+    except ValueError:
+        raise ValueError("months sayı olmalı")
+    if not 1 <= months <= REVENUE_MONTHS_MAX:
+        raise ValueError(f"months 1-{REVENUE_MONTHS_MAX} arası olmalı")
+    
+    month_to = month_to or (_shift_month(month_from, months - 1) if month_from else date.today().strftime('%Y-%m'))
+    month_from = month_from or _shift_month(month_to, -(months - 1))
+    if month_from > month_to:
+        raise ValueError("from, to'dan sonra olamaz")
+    if _shift_month(month_from, REVENUE_MONTHS_MAX - 1) < month_to:
+        raise ValueError(f"En fazla {REVENUE_MONTHS_MAX} ay sorgulanabilir")
+    
+    folders = [f.strip() for f in (args.get('folder') or '').split(',') if f.strip() and f.strip() != 'Tümü']
+    return {'from': month_from, 'to': month_to, 'folders': folders}
+
+def get_revenue(query):
+    c = get_db(PANEL_DB).cursor()
+    folder_sql, folder_params = '', []
+    if query['folders']:
+        folder_sql = f" AND COALESCE(s.folder, 'Tümü') IN ({', '.join('?' * len(query['folders']))})"
+        folder_params = list(query['folders'])
+    today = date.today().isoformat()
+    
+    # Aylar boşluksuz üretilir; tahsilat özetten, beklenen gelir kayıt ayına göre birikimli
+    c.execute(f"""
+        WITH RECURSIVE months(month) AS (
+            SELECT ?
+            UNION ALL
+            SELECT strftime('%Y-%m', month || '-01', '+1 month') FROM months WHERE month < ?
+        ),
+        collected AS (
+            SELECT r.month, SUM(r.collected) AS collected, SUM(r.payments) AS payments,
+                   COUNT(*) AS payers
+            FROM revenue_monthly r LEFT JOIN user_settings s ON s.email = r.email
+            WHERE r.month BETWEEN ? AND ?{folder_sql}
+            GROUP BY r.month
+        ),
+        priced AS (
+            SELECT substr(COALESCE(s.created_at, ''), 1, 7) AS month, SUM(s.monthly_price) AS price
+            FROM user_settings s
+            WHERE s.monthly_price > 0{folder_sql}
+            GROUP BY 1
+        )
+        SELECT m.month,
+               COALESCE(col.collected, 0) AS collected,
+               COALESCE(col.payments, 0) AS payments,
+               COALESCE(col.payers, 0) AS payers,
+               (SELECT COALESCE(SUM(p.price), 0) FROM priced p WHERE p.month <= m.month) AS expected
+        FROM months m LEFT JOIN collected col ON col.month = m.month
+        ORDER BY m.month""",
+        [query['from'], query['to'], query['from'], query['to']] + folder_params + folder_params)
+    months = []
+    for row in c.fetchall():
+        expected = row['expected'] or 0
+        months.append({
+            'month': row['month'],
+            'collected': round(row['collected'], 2),
+            'expected': round(expected, 2),
+            'payments': row['payments'],
+            'payers': row['payers'],
+            'collection_rate': round(row['collected'] * 100 / expected, 1) if expected else None
+        })
+    
+    # Klasör bazında güncel MRR, gecikmiş alacak ve aralıktaki tahsilat
+    c.execute(f"""
+        SELECT COALESCE(s.folder, 'Tümü') AS folder,
+               COUNT(*) AS users,
+               COALESCE(SUM(s.monthly_price), 0) AS mrr,
+               COALESCE(SUM(CASE WHEN s.next_payment_date != '' AND s.next_payment_date < ?
+                                 THEN 1 ELSE 0 END), 0) AS overdue_users,
+               COALESCE(SUM(CASE WHEN s.next_payment_date != '' AND s.next_payment_date < ?
+                                 THEN s.monthly_price ELSE 0 END), 0) AS overdue_amount
+        FROM user_settings s
+        WHERE s.monthly_price > 0{folder_sql}
+        GROUP BY 1""", [today, today] + folder_params)
+    folders = {row['folder']: {'folder': row['folder'], 'users': row['users'],
+                               'mrr': round(row['mrr'], 2),
+                               'overdue_users': row['overdue_users'],
+                               'overdue_amount': round(row['overdue_amount'], 2),
+                               'collected': 0}
+               for row in c.fetchall()}
+    c.execute(f"""
+        SELECT COALESCE(s.folder, 'Tümü') AS folder, SUM(r.collected) AS collected
+        FROM revenue_monthly r LEFT JOIN user_settings s ON s.email = r.email
+        WHERE r.month BETWEEN ? AND ?{folder_sql}
+        GROUP BY 1""", [query['from'], query['to']] + folder_params)
+    for row in c.fetchall():
+        entry = folders.setdefault(row['folder'], {'folder': row['folder'], 'users': 0, 'mrr': 0,
+                                                   'overdue_users': 0, 'overdue_amount': 0})
+        entry['collected'] = round(row['collected'], 2)
+    by_folder = sorted(folders.values(), key=lambda entry: -entry['mrr'])
+    
+    return {
+        'from': query['from'],
+        'to': query['to'],
+        'mrr': round(sum(entry['mrr'] for entry in by_folder), 2),
+        'paying_users': sum(entry['users'] for entry in by_folder),
+        'overdue': {
+            'users': sum(entry['overdue_users'] for entry in by_folder),
+            'amount': round(sum(entry['overdue_amount'] for entry in by_folder), 2)
+        },
+        'collected_total': round(sum(month['collected'] for month in months), 2),
+        'months': months,
+        'by_folder': by_folder
+    }
 
 @app.route('/')
 def index():
     return send_from_directory('.', 'index.html')
 
+@app.route('/api/config')
+def panel_config():
+    config = get_panel_config()
+    return jsonify({key: config[key] for key in PANEL_CONFIG_PUBLIC})
+
 @app.route('/api/login', methods=['POST'])
 def login():
     data = request.json
-    conn = sqlite3.connect(PANEL_DB)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+    c = get_db(PANEL_DB).cursor()
     c.execute("SELECT * FROM admin_users WHERE username = ?", (data.get('username'),))
     user = c.fetchone()
-    conn.close()
     if user and bcrypt.checkpw(data.get('password').encode('utf-8'), user['password_hash']):
         session['user_id'] = user['id']
         session['username'] = user['username']
@@ -455,23 +2438,81 @@ def check_auth():
 def get_stats():
     if 'user_id' not in session: 
         return jsonify({'error': 'Unauthorized'}), 401
-    users = get_xui_users()
-    overdue_count = sum(1 for u in users if u.get('payment_status') == 'overdue')
-    total_usage = sum(u['toplam_kullanim_gb'] for u in users)
-    return jsonify({
-        'total_users': len(users),
-        'active_users': sum(1 for u in users if u['durum'] == 'aktif'),
-        'passive_users': len(users) - sum(1 for u in users if u['durum'] == 'aktif'),
-        'online_users': sum(1 for u in users if u['online_status'] == 'online'),
-        'total_usage_gb': round(total_usage, 2),
-        'overdue_count': overdue_count
-    })
+    # ?folder=GSM,AX verilirse sayaçlar sadece bu klasörlerin toplamıdır
+    folders = [f.strip() for f in request.args.get('folder', '').split(',') if f.strip() and f.strip() != 'Tümü']
+    return jsonify(get_users_stats(folders))
+
+@app.route('/api/revenue')
+def revenue():
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        query = parse_revenue_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(get_revenue(query))
+
+@app.route('/api/enforcement-status')
+def get_enforcement_status():
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    status = load_runtime_state(get_db(PANEL_DB).cursor(), 'enforcement')
+    return jsonify(status or dict(_enforcement_status))
+
+@app.route('/api/reload-status')
+@app.route('/api/reload-status/<int:job_id>')
+def reload_status(job_id=None):
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(get_reload_status(job_id))
 
 @app.route('/api/users')
 def get_users():
     if 'user_id' not in session: 
         return jsonify({'error': 'Unauthorized'}), 401
-    return jsonify(get_xui_users())
+    if not request.args:
+        return users_json_response(get_users_snapshot())
+    
+    # Parametre verilirse filtrelenmiş tek sayfa döner
+    try:
+        query = parse_users_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    matched = get_users_view().query(query['filters'], query['search'], query['sort'])
+    start, end = query['offset'], query['offset'] + query['limit']
+    return users_json_response({
+        'users': matched[start:end],
+        'total': len(matched),
+        'offset': start,
+        'limit': query['limit'],
+        'next_offset': end if end < len(matched) else None
+    })
+
+@app.route('/api/users/changes')
+def get_users_changes():
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    since = request.args.get('since')
+    if since:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'error': 'since sayı olmalı'}), 400
+    return users_json_response(get_user_changes(since or None))
+
+@app.route('/api/events')
+def events():
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    subscriber = subscribe_events()
+    if subscriber is None:
+        # Tarayıcı periyodik yenilemeye devam eder
+        return jsonify({'error': 'Canlı bağlantı limiti dolu'}), 503
+    response = Response(stream_events(subscriber), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Akış hiç başlamadan bağlantı kapanırsa da abonelik silinsin
+    response.call_on_close(lambda: unsubscribe_events(subscriber))
+    return response
 
 @app.route('/api/toggle-user', methods=['POST'])
 def toggle_user():
@@ -485,80 +2526,39 @@ def toggle_user():
         if not os.path.exists(XUI_DB): 
             return jsonify({'success': False, 'message': 'Database bulunamadı'}), 500
         
-        conn = sqlite3.connect(XUI_DB)
-        c = conn.cursor()
-        
-        c.execute("SELECT id, settings FROM inbounds")
-        inbounds = c.fetchall()
-        
-        updated = False
-        for inbound in inbounds:
-            inbound_id = inbound[0]
-            settings = json.loads(inbound[1])
-            clients = settings.get('clients', [])
-            for client in clients:
-                if client.get('email') == user_email:
-                    client['enable'] = new_enable
-                    updated = True
-                    break
-            if updated:
-                settings['clients'] = clients
-                new_settings_json = json.dumps(settings, ensure_ascii=False)
-                c.execute("UPDATE inbounds SET settings = ? WHERE id = ?", (new_settings_json, inbound_id))
-                break
-        
-        if not updated:
-            conn.close()
+        if locate_client(get_db(XUI_DB).cursor(), user_email) is None:
             return jsonify({'success': False, 'message': 'Kullanıcı bulunamadı'}), 404
         
-        # CLIENT_TRAFFICS'I DE GUNCELLE (KRITIK!)
-        if new_enable:
-            c.execute("UPDATE client_traffics SET enable = 1 WHERE email = ?", (user_email,))
+        with db_transaction(XUI_DB) as c:
+            client_fields = {'enable': new_enable}
             
-            c.execute("SELECT expiry_time FROM client_traffics WHERE email = ?", (user_email,))
-            result = c.fetchone()
-            if result:
-                current_expiry = result[0] or 0
-                current_time_ms = int(time.time() * 1000)
+            # CLIENT_TRAFFICS'I DE GUNCELLE (KRITIK!)
+            if new_enable:
+                c.execute("UPDATE client_traffics SET enable = 1 WHERE email = ?", (user_email,))
                 
-                if current_expiry < current_time_ms:
-                    new_expiry = current_time_ms + (30 * 24 * 60 * 60 * 1000)
-                    c.execute("UPDATE client_traffics SET expiry_time = ? WHERE email = ?", 
-                             (new_expiry, user_email))
+                c.execute("SELECT expiry_time FROM client_traffics WHERE email = ?", (user_email,))
+                result = c.fetchone()
+                if result:
+                    current_expiry = result[0] or 0
+                    current_time_ms = int(time.time() * 1000)
                     
-                    c.execute("SELECT id, settings FROM inbounds")
-                    for inbound in c.fetchall():
-                        inbound_id = inbound[0]
-                        settings = json.loads(inbound[1])
-                        clients = settings.get('clients', [])
-                        changed = False
-                        for client in clients:
-                            if client.get('email') == user_email:
-                                client['expiryTime'] = new_expiry
-                                changed = True
-                                break
-                        if changed:
-                            settings['clients'] = clients
-                            new_json = json.dumps(settings, ensure_ascii=False)
-                            c.execute("UPDATE inbounds SET settings = ? WHERE id = ?", (new_json, inbound_id))
-                            break
-                    
-                    print(f"Kullanıcı {user_email} aktif edildi ve süre 30 gün uzatıldı")
-        else:
-            c.execute("UPDATE client_traffics SET enable = 0 WHERE email = ?", (user_email,))
+                    if current_expiry < current_time_ms:
+                        new_expiry = current_time_ms + (30 * 24 * 60 * 60 * 1000)
+                        c.execute("UPDATE client_traffics SET expiry_time = ? WHERE email = ?", 
+                                 (new_expiry, user_email))
+                        client_fields['expiryTime'] = new_expiry
+                        
+                        print(f"Kullanıcı {user_email} aktif edildi ve süre 30 gün uzatıldı")
+            else:
+                c.execute("UPDATE client_traffics SET enable = 0 WHERE email = ?", (user_email,))
+            
+            patch_client(c, user_email, client_fields)
         
-        conn.commit()
-        conn.close()
+        invalidate_users_snapshot()
         
-        if new_enable:
-            toggle_refresh_user(user_email)
-        else:
-            os.system('/usr/bin/systemctl stop x-ui')
-            time.sleep(2)
-            os.system('/usr/bin/systemctl start x-ui')
-            time.sleep(3)
+        job_id = schedule_xui_reload(f"{user_email} {'aktif' if new_enable else 'pasif'}", emails=[user_email])
         
-        return jsonify({'success': True, 'message': 'Durum güncellendi ve cache temizlendi!'})
+        return jsonify({'success': True, 'message': 'Durum güncellendi, x-ui yeniden yüklenecek!', 'job_id': job_id})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -570,125 +2570,99 @@ def update_user_settings():
         data = request.json
         email = data.get('email')
         
-        conn = sqlite3.connect(PANEL_DB)
-        c = conn.cursor()
-        
-        expiry_or_payment = data.get('expiry_date') or data.get('next_payment_date')
-        folder = data.get('folder', 'Tümü')
-        
-        quota_reset_date = None
-        if data.get('quota') is not None:
-            quota_reset_date = datetime.now().strftime('%Y-%m-%d')
+        with db_transaction(PANEL_DB) as c:
+            expiry_or_payment = data.get('expiry_date') or data.get('next_payment_date')
+            folder = data.get('folder', 'Tümü')
         
-        c.execute("SELECT * FROM user_settings WHERE email = ?", (email,))
-        existing = c.fetchone()
+            quota_reset_date = None
+            if data.get('quota') is not None:
+                quota_reset_date = datetime.now().strftime('%Y-%m-%d')
         
-        if existing:
-            if quota_reset_date:
-                c.execute("""UPDATE user_settings 
-                             SET monthly_price = ?, next_payment_date = ?, notes = ?, folder = ?, 
-                                 quota_reset_date = ?, updated_at = CURRENT_TIMESTAMP
-                             WHERE email = ?""",
-                          (data.get('monthly_price', 0), expiry_or_payment, data.get('notes', ''), 
-                           folder, quota_reset_date, email))
-            else:
-                c.execute("""UPDATE user_settings 
-                             SET monthly_price = ?, next_payment_date = ?, notes = ?, folder = ?, 
-                                 updated_at = CURRENT_TIMESTAMP
-                             WHERE email = ?""",
-                          (data.get('monthly_price', 0), expiry_or_payment, data.get('notes', ''), 
-                           folder, email))
-        else:
-            if quota_reset_date:
-                c.execute("""INSERT INTO user_settings (email, monthly_price, next_payment_date, notes, folder, quota_reset_date)
-                             VALUES (?, ?, ?, ?, ?, ?)""",
-                          (email, data.get('monthly_price', 0), expiry_or_payment, data.get('notes', ''), 
-                           folder, quota_reset_date))
+            c.execute("SELECT * FROM user_settings WHERE email = ?", (email,))
+            existing = c.fetchone()
+        
+            if existing:
+                if quota_reset_date:
+                    c.execute("""UPDATE user_settings 
+                                 SET monthly_price = ?, next_payment_date = ?, notes = ?, folder = ?, 
+                                     quota_reset_date = ?, updated_at = CURRENT_TIMESTAMP
+                                 WHERE email = ?""",
+                              (data.get('monthly_price', 0), expiry_or_payment, data.get('notes', ''), 
+                               folder, quota_reset_date, email))
+                else:
+                    c.execute("""UPDATE user_settings 
+                                 SET monthly_price = ?, next_payment_date = ?, notes = ?, folder = ?, 
+                                     updated_at = CURRENT_TIMESTAMP
+                                 WHERE email = ?""",
+                              (data.get('monthly_price', 0), expiry_or_payment, data.get('notes', ''), 
+                               folder, email))
             else:
-                c.execute("""INSERT INTO user_settings (email, monthly_price, next_payment_date, notes, folder)
-                             VALUES (?, ?, ?, ?, ?)""",
-                          (email, data.get('monthly_price', 0), expiry_or_payment, data.get('notes', ''), folder))
-        
-        conn.commit()
-        conn.close()
+                if quota_reset_date:
+                    c.execute("""INSERT INTO user_settings (email, monthly_price, next_payment_date, notes, folder, quota_reset_date)
+                                 VALUES (?, ?, ?, ?, ?, ?)""",
+                              (email, data.get('monthly_price', 0), expiry_or_payment, data.get('notes', ''), 
+                               folder, quota_reset_date))
+                else:
+                    c.execute("""INSERT INTO user_settings (email, monthly_price, next_payment_date, notes, folder)
+                                 VALUES (?, ?, ?, ?, ?)""",
+                              (email, data.get('monthly_price', 0), expiry_or_payment, data.get('notes', ''), folder))
+        invalidate_users_snapshot()
         
         quota_changed = False
+        job_id = None
         if data.get('quota') is not None or data.get('expiry_date'):
-            xui_conn = sqlite3.connect(XUI_DB)
-            xui_c = xui_conn.cursor()
-            xui_c.execute("SELECT id, settings FROM inbounds")
-            inbounds = xui_c.fetchall()
+            with db_transaction(XUI_DB) as xui_c:
+                client_fields = {}
             
-            for inbound in inbounds:
-                inbound_id = inbound[0]
-                settings = json.loads(inbound[1])
-                clients = settings.get('clients', [])
-                inbound_changed = False
+                if locate_client(xui_c, email) is not None:
+                    # KOTA AYARLA
+                    if data.get('quota') is not None:
+                        quota_gb = float(data.get('quota'))
+                        quota_bytes = int(quota_gb * 1024 * 1024 * 1024) if quota_gb > 0 else 0
+                    
+                        # 1. JSON'U GUNCELLE
+                        client_fields['totalGB'] = quota_bytes
+                        client_fields['enable'] = True
+                    
+                        # 2. CLIENT_TRAFFICS'I DE GUNCELLE (KRITIK!)
+                        xui_c.execute("""UPDATE client_traffics 
+                                         SET total = ?, enable = 1 
+                                         WHERE email = ?""", 
+                                      (quota_bytes, email))
+                    
+                        quota_changed = True
+                    
+                        print(f"✅ Kota güncellendi: {email} -> {quota_gb} GB (hem JSON hem client_traffics)")
                 
-                for client in clients:
-                    if client.get('email') == email:
+                    # TARIH AYARLA VE SYNC ET
+                    if data.get('expiry_date'):
+                        try:
+                            expiry_dt = datetime.strptime(data.get('expiry_date'), '%Y-%m-%d')
+                            expiry_dt = expiry_dt.replace(hour=23, minute=59, second=59)
+                            new_expiry_ms = int(expiry_dt.timestamp() * 1000)
                         
-                        # KOTA AYARLA
-                        if data.get('quota') is not None:
-                            quota_gb = float(data.get('quota'))
-                            quota_bytes = int(quota_gb * 1024 * 1024 * 1024) if quota_gb > 0 else 0
-                            
-                            # 1. JSON'U GUNCELLE
-                            client['totalGB'] = quota_bytes
-                            client['enable'] = True
-                            
-                            # 2. CLIENT_TRAFFICS'I DE GUNCELLE (KRITIK!)
-                            xui_c.execute("""UPDATE client_traffics 
-                                             SET total = ?, enable = 1 
-                                             WHERE email = ?""", 
-                                          (quota_bytes, email))
-                            
-                            inbound_changed = True
-                            quota_changed = True
-                            
-                            reset_user_quota(email)
-                            
-                            print(f"✅ Kota güncellendi: {email} -> {quota_gb} GB (hem JSON hem client_traffics)")
+                            client_fields['expiryTime'] = new_expiry_ms
+                            client_fields['enable'] = True
                         
-                        # TARIH AYARLA VE SYNC ET
-                        if data.get('expiry_date'):
-                            try:
-                                expiry_dt = datetime.strptime(data.get('expiry_date'), '%Y-%m-%d')
-                                expiry_dt = expiry_dt.replace(hour=23, minute=59, second=59)
-                                new_expiry_ms = int(expiry_dt.timestamp() * 1000)
-                                
-                                client['expiryTime'] = new_expiry_ms
-                                client['enable'] = True
-                                
-                                inbound_changed = True
-                                
-                                sync_xui_expiry(email, new_expiry_ms)
-                                
-                            except Exception as ex: 
-                                print(f"Tarih convert hatasi: {ex}")
-                                pass
-                        break
-                
-                if inbound_changed:
-                    settings['clients'] = clients
-                    new_settings_json = json.dumps(settings, ensure_ascii=False)
-                    xui_c.execute("UPDATE inbounds SET settings = ? WHERE id = ?", 
-                                 (new_settings_json, inbound_id))
-                    print(f"✅ Inbound {inbound_id} güncellendi: {email}")
+                            xui_c.execute("UPDATE client_traffics SET expiry_time = ? WHERE email = ?", 
+                                          (new_expiry_ms, email))
+                            print(f"X-UI Sync: {email} -> {new_expiry_ms}")
+                        
+                        except Exception as ex: 
+                            print(f"Tarih convert hatasi: {ex}")
+                            pass
             
-            xui_conn.commit()
-            xui_conn.close()
+                if client_fields and patch_client(xui_c, email, client_fields):
+                    print(f"✅ Inbound güncellendi: {email}")
             
+            # Kota sıfırlama iki veritabanında kendi işlemlerini açar, x-ui işlemi bittikten sonra çalışmalı
             if quota_changed:
-                print(f"Kota değişti, toggle refresh yapılıyor: {email}")
-                toggle_refresh_user(email)
-            else:
-                os.system('/usr/bin/systemctl stop x-ui')
-                time.sleep(2)
-                os.system('/usr/bin/systemctl start x-ui')
-                time.sleep(3)
+                reset_user_quota(email)
+            invalidate_users_snapshot()
+            
+            job_id = schedule_xui_reload(f"{email} {'kota' if quota_changed else 'süre'} ayarı", emails=[email])
         
-        return jsonify({'success': True, 'message': 'Ayarlar güncellendi ve cache temizlendi!'})
+        return jsonify({'success': True, 'message': 'Ayarlar güncellendi ve cache temizlendi!', 'job_id': job_id})
     except Exception as e:
         print(f"❌ Ayar güncelleme hatası: {e}")
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -702,22 +2676,19 @@ def move_to_folder():
         email = data.get('email')
         new_folder = data.get('folder')
         
-        valid_folders = ['Tümü', 'Superbox', 'AX', 'GSM', 'ÖZEL', 'KLASÖR-1', 'KLASÖR-2', 'KLASÖR-3', 'KLASÖR-4']
-        if new_folder not in valid_folders:
+        if new_folder not in VALID_FOLDERS:
             return jsonify({'success': False, 'message': 'Geçersiz klasör adı'}), 400
         
-        conn = sqlite3.connect(PANEL_DB)
-        c = conn.cursor()
-        c.execute("SELECT email FROM user_settings WHERE email = ?", (email,))
-        exists = c.fetchone()
-        
-        if exists:
-            c.execute("UPDATE user_settings SET folder = ?, updated_at = CURRENT_TIMESTAMP WHERE email = ?", (new_folder, email))
-        else:
-            c.execute("INSERT INTO user_settings (email, folder, monthly_price, notes) VALUES (?, ?, 0, '')", (email, new_folder))
+        with db_transaction(PANEL_DB) as c:
+            c.execute("SELECT email FROM user_settings WHERE email = ?", (email,))
+            exists = c.fetchone()
+            
+            if exists:
+                c.execute("UPDATE user_settings SET folder = ?, updated_at = CURRENT_TIMESTAMP WHERE email = ?", (new_folder, email))
+            else:
+                c.execute("INSERT INTO user_settings (email, folder, monthly_price, notes) VALUES (?, ?, 0, '')", (email, new_folder))
         
-        conn.commit()
-        conn.close()
+        invalidate_users_snapshot()
         return jsonify({'success': True, 'message': f'Kullanıcı {new_folder} klasörüne taşındı!'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -731,22 +2702,217 @@ def update_user_note():
         email = data.get('email')
         note = data.get('note', '')
         
-        conn = sqlite3.connect(PANEL_DB)
-        c = conn.cursor()
-        c.execute("SELECT * FROM user_settings WHERE email = ?", (email,))
-        existing = c.fetchone()
-        
-        if existing:
-            c.execute("UPDATE user_settings SET notes = ?, updated_at = CURRENT_TIMESTAMP WHERE email = ?", (note, email))
-        else:
-            c.execute("INSERT INTO user_settings (email, notes) VALUES (?, ?)", (email, note))
+        with db_transaction(PANEL_DB) as c:
+            c.execute("SELECT * FROM user_settings WHERE email = ?", (email,))
+            existing = c.fetchone()
+            
+            if existing:
+                c.execute("UPDATE user_settings SET notes = ?, updated_at = CURRENT_TIMESTAMP WHERE email = ?", (note, email))
+            else:
+                c.execute("INSERT INTO user_settings (email, notes) VALUES (?, ?)", (email, note))
         
-        conn.commit()
-        conn.close()
+        invalidate_users_snapshot()
         return jsonify({'success': True, 'message': 'Not güncellendi!'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def _request_emails(data):
+    """İstekteki 'emails' listesini tekrarsız ve boşsuz hale getir"""
+    emails = data.get('emails') or []
+    if not isinstance(emails, list):
+        return []
+    return list(dict.fromkeys(e for e in emails if isinstance(e, str) and e))
+
+def _bulk_results(emails, succeeded, ok_message, fail_message='Kullanıcı bulunamadı'):
+    return [{'email': email,
+             'success': email in succeeded,
+             'message': ok_message if email in succeeded else fail_message}
+            for email in emails]
+
+@app.route('/api/bulk-toggle', methods=['POST'])
+def bulk_toggle():
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        data = request.json
+        emails = _request_emails(data)
+        new_enable = bool(data.get('enable'))
+        
+        if not emails:
+            return jsonify({'success': False, 'message': 'Kullanıcı seçilmedi'}), 400
+        if not os.path.exists(XUI_DB): 
+            return jsonify({'success': False, 'message': 'Database bulunamadı'}), 500
+        
+        with db_transaction(XUI_DB) as c:
+            patches = {email: {'enable': new_enable} for email in emails}
+            
+            # Aktif edilenlerden süresi dolmuş olanlar 30 gün uzatılır
+            extended = set()
+            if new_enable:
+                current_time_ms = int(time.time() * 1000)
+                new_expiry = current_time_ms + (30 * 24 * 60 * 60 * 1000)
+                for chunk in _chunked(emails):
+                    placeholders = ','.join('?' * len(chunk))
+                    c.execute(f"SELECT email, expiry_time FROM client_traffics WHERE email IN ({placeholders})", chunk)
+                    for email, expiry in c.fetchall():
+                        if (expiry or 0) < current_time_ms:
+                            patches[email]['expiryTime'] = new_expiry
+                            extended.add(email)
+            
+            patched = patch_clients(c, patches)
+            found = [email for email in emails if email in patched]
+            
+            # CLIENT_TRAFFICS'I DE GUNCELLE (KRITIK!)
+            for chunk in _chunked(found):
+                placeholders = ','.join('?' * len(chunk))
+                c.execute(f"UPDATE client_traffics SET enable = ? WHERE email IN ({placeholders})",
+                          [1 if new_enable else 0] + chunk)
+            for chunk in _chunked([email for email in found if email in extended]):
+                placeholders = ','.join('?' * len(chunk))
+                c.execute(f"UPDATE client_traffics SET expiry_time = ? WHERE email IN ({placeholders})",
+                          [new_expiry] + chunk)
+        
+        invalidate_users_snapshot()
+        
+        job_id = None
+        if found:
+            job_id = schedule_xui_reload(f"{len(found)} kullanıcı toplu {'aktif' if new_enable else 'pasif'}", emails=found)
+        
+        state = 'aktif' if new_enable else 'pasif'
+        results = _bulk_results(emails, patched, f'Kullanıcı {state} edildi')
+        for result in results:
+            if result['email'] in extended and result['success']:
+                result['message'] += ', süre 30 gün uzatıldı'
+        return jsonify({'success': True, 'updated': len(found), 'results': results, 'job_id': job_id,
+                        'message': f'{len(found)} kullanıcı {state} edildi'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/bulk-move', methods=['POST'])
+def bulk_move():
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        data = request.json
+        emails = _request_emails(data)
+        new_folder = data.get('folder')
+        
+        if not emails:
+            return jsonify({'success': False, 'message': 'Kullanıcı seçilmedi'}), 400
+        if new_folder not in VALID_FOLDERS:
+            return jsonify({'success': False, 'message': 'Geçersiz klasör adı'}), 400
+        
+        if not os.path.exists(XUI_DB): 
+            return jsonify({'success': False, 'message': 'Database bulunamadı'}), 500
+        
+        found = existing_clients(get_db(XUI_DB).cursor(), emails)
+        with db_transaction(PANEL_DB) as c:
+            c.executemany("""INSERT INTO user_settings (email, folder, monthly_price, notes) VALUES (?, ?, 0, '')
+                             ON CONFLICT(email) DO UPDATE
+                             SET folder = excluded.folder, updated_at = CURRENT_TIMESTAMP""",
+                          [(email, new_folder) for email in found])
+        
+        invalidate_users_snapshot()
+        
+        results = _bulk_results(emails, set(found), f'{new_folder} klasörüne taşındı')
+        return jsonify({'success': True, 'updated': len(found), 'results': results,
+                        'message': f'{len(found)} kullanıcı {new_folder} klasörüne taşındı!'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/bulk-settings', methods=['POST'])
+def bulk_settings():
+    """Seçili kullanıcılara aynı ayarları uygula; sadece gönderilen alanlar değişir"""
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        data = request.json
+        emails = _request_emails(data)
+        if not emails:
+            return jsonify({'success': False, 'message': 'Kullanıcı seçilmedi'}), 400
+        
+        panel_fields = {}
+        if data.get('monthly_price') is not None:
+            panel_fields['monthly_price'] = float(data.get('monthly_price'))
+        if data.get('notes') is not None:
+            panel_fields['notes'] = data.get('notes')
+        if data.get('folder') is not None:
+            if data.get('folder') not in VALID_FOLDERS:
+                return jsonify({'success': False, 'message': 'Geçersiz klasör adı'}), 400
+            panel_fields['folder'] = data.get('folder')
+        
+        expiry_or_payment = data.get('expiry_date') or data.get('next_payment_date')
+        if expiry_or_payment:
+            if _parse_day(expiry_or_payment) is None:
+                return jsonify({'success': False, 'message': 'Geçersiz tarih'}), 400
+            panel_fields['next_payment_date'] = expiry_or_payment
+        
+        client_fields = {}
+        quota_bytes = None
+        new_expiry_ms = None
+        if data.get('quota') is not None and data.get('quota') != '':
+            quota_gb = float(data.get('quota'))
+            quota_bytes = int(quota_gb * 1024 * 1024 * 1024) if quota_gb > 0 else 0
+            client_fields['totalGB'] = quota_bytes
+            client_fields['enable'] = True
+            panel_fields['quota_reset_date'] = datetime.now().strftime('%Y-%m-%d')
+        if data.get('expiry_date'):
+            try:
+                expiry_dt = datetime.strptime(data.get('expiry_date'), '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Geçersiz tarih'}), 400
+            expiry_dt = expiry_dt.replace(hour=23, minute=59, second=59)
+            new_expiry_ms = int(expiry_dt.timestamp() * 1000)
+            client_fields['expiryTime'] = new_expiry_ms
+            client_fields['enable'] = True
+        
+        if not panel_fields and not client_fields:
+            return jsonify({'success': False, 'message': 'Değiştirilecek ayar yok'}), 400
+        # Doğrulama ve kontroller bitmeden hiçbir veritabanına yazılmaz
+        if not os.path.exists(XUI_DB): 
+            return jsonify({'success': False, 'message': 'Database bulunamadı'}), 500
+        
+        found = existing_clients(get_db(XUI_DB).cursor(), emails)
+        if panel_fields and found:
+            columns = list(panel_fields)
+            assignments = ', '.join(f"{col} = excluded.{col}" for col in columns)
+            with db_transaction(PANEL_DB) as c:
+                c.executemany(f"""INSERT INTO user_settings (email, {', '.join(columns)})
+                                  VALUES (?, {', '.join('?' * len(columns))})
+                                  ON CONFLICT(email) DO UPDATE
+                                  SET {assignments}, updated_at = CURRENT_TIMESTAMP""",
+                              [[email] + [panel_fields[col] for col in columns] for email in found])
+        
+        succeeded = set(found)
+        job_id = None
+        if client_fields and found:
+            with db_transaction(XUI_DB) as xui_c:
+                succeeded = patch_clients(xui_c, {email: dict(client_fields) for email in found})
+                found = [email for email in emails if email in succeeded]
+                
+                # CLIENT_TRAFFICS'I DE GUNCELLE (KRITIK!)
+                for chunk in _chunked(found):
+                    placeholders = ','.join('?' * len(chunk))
+                    if quota_bytes is not None:
+                        xui_c.execute(f"UPDATE client_traffics SET total = ?, enable = 1 WHERE email IN ({placeholders})",
+                                      [quota_bytes] + chunk)
+                    if new_expiry_ms is not None:
+                        xui_c.execute(f"UPDATE client_traffics SET expiry_time = ? WHERE email IN ({placeholders})",
+                                      [new_expiry_ms] + chunk)
+            
+            if quota_bytes is not None and found:
+                reset_users_quota(found)
+            if found:
+                job_id = schedule_xui_reload(f"{len(found)} kullanıcı toplu ayar", emails=found)
+        
+        invalidate_users_snapshot()
+        results = _bulk_results(emails, succeeded, 'Ayarlar güncellendi')
+        return jsonify({'success': True, 'updated': len(succeeded), 'results': results, 'job_id': job_id,
+                        'message': f'{len(succeeded)} kullanıcının ayarları güncellendi!'})
+    except Exception as e:
+        print(f"❌ Toplu ayar hatası: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/api/add-payment', methods=['POST'])
 def add_payment():
     if 'user_id' not in session: 
@@ -759,231 +2925,484 @@ def add_payment():
         payment_method = data.get('payment_method', '')
         notes = data.get('notes', '')
         
-        conn = sqlite3.connect(PANEL_DB)
-        c = conn.cursor()
+        with db_transaction(PANEL_DB) as c:
+            c.execute("""INSERT INTO payment_history (email, amount, payment_date, payment_method, notes)
+                         VALUES (?, ?, ?, ?, ?)""",
+                      (email, amount, payment_date, payment_method, notes))
+            record_revenue(c, email, amount, payment_date)
         
-        c.execute("""INSERT INTO payment_history (email, amount, payment_date, payment_method, notes)
-                     VALUES (?, ?, ?, ?, ?)""",
-                  (email, amount, payment_date, payment_method, notes))
+            c.execute("SELECT next_payment_date FROM user_settings WHERE email = ?", (email,))
+            existing_record = c.fetchone()
         
-        c.execute("SELECT next_payment_date FROM user_settings WHERE email = ?", (email,))
-        existing_record = c.fetchone()
-        
-        next_payment = None
-        quota_reset_date = None
+            next_payment = None
+            quota_reset_date = None
 
-        if existing_record and existing_record[0]:
-            try:
-                current_next_payment = datetime.strptime(existing_record[0], '%Y-%m-%d')
-                payment_day = current_next_payment.day
+            if existing_record and existing_record[0]:
+                try:
+                    current_next_payment = datetime.strptime(existing_record[0], '%Y-%m-%d')
+                    payment_day = current_next_payment.day
                 
-                next_month = current_next_payment.month + 1
-                next_year = current_next_payment.year
+                    next_month = current_next_payment.month + 1
+                    next_year = current_next_payment.year
                 
-                if next_month > 12:
-                    next_month = 1
-                    next_year += 1
+                    if next_month > 12:
+                        next_month = 1
+                        next_year += 1
                 
-                max_day = calendar.monthrange(next_year, next_month)[1]
-                safe_day = min(payment_day, max_day)
+                    max_day = calendar.monthrange(next_year, next_month)[1]
+                    safe_day = min(payment_day, max_day)
                 
-                next_payment = datetime(next_year, next_month, safe_day).strftime('%Y-%m-%d')
-                quota_reset_date = existing_record[0]
-            except:
-                payment_dt = datetime.strptime(payment_date, '%Y-%m-%d')
-                next_payment = (payment_dt + timedelta(days=30)).strftime('%Y-%m-%d')
-                quota_reset_date = payment_date
-        else:
-            try:
-                payment_dt = datetime.strptime(payment_date, '%Y-%m-%d')
-                next_payment = (payment_dt + timedelta(days=30)).strftime('%Y-%m-%d')
-                quota_reset_date = payment_date
-            except:
-                next_payment = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-                quota_reset_date = datetime.now().strftime('%Y-%m-%d')
-        
-        c.execute("SELECT * FROM user_settings WHERE email = ?", (email,))
-        if c.fetchone():
-            c.execute("""UPDATE user_settings 
-                         SET last_payment_date = ?, next_payment_date = ?, quota_reset_date = ?, 
-                             updated_at = CURRENT_TIMESTAMP
-                         WHERE email = ?""",
-                      (payment_date, next_payment, quota_reset_date, email))
-        else:
-            c.execute("""INSERT INTO user_settings (email, last_payment_date, next_payment_date, quota_reset_date)
-                         VALUES (?, ?, ?, ?)""",
-                      (email, payment_date, next_payment, quota_reset_date))
-        
-        conn.commit()
-        conn.close()
-        
-        reset_user_quota(email)
-        
-        if next_payment:
+                    next_payment = datetime(next_year, next_month, safe_day).strftime('%Y-%m-%d')
+                    quota_reset_date = existing_record[0]
+                except:
+                    payment_dt = datetime.strptime(payment_date, '%Y-%m-%d')
+                    next_payment = (payment_dt + timedelta(days=30)).strftime('%Y-%m-%d')
+                    quota_reset_date = payment_date
+            else:
+                try:
+                    payment_dt = datetime.strptime(payment_date, '%Y-%m-%d')
+                    next_payment = (payment_dt + timedelta(days=30)).strftime('%Y-%m-%d')
+                    quota_reset_date = payment_date
+                except:
+                    next_payment = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
+                    quota_reset_date = datetime.now().strftime('%Y-%m-%d')
+        
+            c.execute("SELECT * FROM user_settings WHERE email = ?", (email,))
+            if c.fetchone():
+                c.execute("""UPDATE user_settings 
+                             SET last_payment_date = ?, next_payment_date = ?, quota_reset_date = ?, 
+                                 updated_at = CURRENT_TIMESTAMP
+                             WHERE email = ?""",
+                          (payment_date, next_payment, quota_reset_date, email))
+            else:
+                c.execute("""INSERT INTO user_settings (email, last_payment_date, next_payment_date, quota_reset_date)
+                             VALUES (?, ?, ?, ?)""",
+                          (email, payment_date, next_payment, quota_reset_date))
+            
+            # Kota sıfırlama ve süre uzatma ödemeyle aynı işlemde günlüğe yazılır
+            operation = None
+            if os.path.exists(XUI_DB):
+                payload = {'emails': [email], 'reset_type': 'manual'}
+                try:
+                    expiry_dt = datetime.strptime(next_payment, '%Y-%m-%d')
+                    expiry_dt = expiry_dt.replace(hour=23, minute=59, second=59)
+                    payload['expiry_ms'] = {email: int(expiry_dt.timestamp() * 1000)}
+                    payload['reload_reason'] = f"{email} ödeme"
+                except (TypeError, ValueError) as e:
+                    print(f"Ödeme sonrası süre uzatma hatası: {e}")
+                operation = (journal_operation(c, payload), payload)
+        
+        job_id = None
+        if operation:
             try:
-                expiry_dt = datetime.strptime(next_payment, '%Y-%m-%d')
-                expiry_dt = expiry_dt.replace(hour=23, minute=59, second=59)
-                new_expiry_ms = int(expiry_dt.timestamp() * 1000)
-                
-                sync_xui_expiry(email, new_expiry_ms)
-                
-                xui_conn = sqlite3.connect(XUI_DB)
-                xui_c = xui_conn.cursor()
-                xui_c.execute("SELECT id, settings FROM inbounds")
-                for row in xui_c.fetchall():
-                    inbound_id = row[0]
-                    settings = json.loads(row[1])
-                    clients = settings.get('clients', [])
-                    changed = False
-                    for client in clients:
-                        if client.get('email') == email:
-                            client['expiryTime'] = new_expiry_ms
-                            client['enable'] = True
-                            changed = True
-                            break
-                    if changed:
-                        settings['clients'] = clients
-                        new_json = json.dumps(settings, ensure_ascii=False)
-                        xui_c.execute("UPDATE inbounds SET settings = ? WHERE id = ?", (new_json, inbound_id))
-                
-                # CLIENT_TRAFFICS'I DE GUNCELLE (KRITIK!)
-                xui_c.execute("""UPDATE client_traffics 
-                                 SET enable = 1, up = 0, down = 0, expiry_time = ?
-                                 WHERE email = ?""", 
-                              (new_expiry_ms, email))
-                
-                xui_conn.commit()
-                xui_conn.close()
-                
-                print(f"Ödeme sonrası toggle refresh yapılıyor: {email}")
-                toggle_refresh_user(email)
-                
+                job_id = run_operation(*operation)
             except Exception as e:
-                print(f"Ödeme sonrası süre uzatma hatası: {e}")
+                # Günlükte bekliyor, lider process yeniden dener
+                print(f"Ödeme sonrası kota/süre işlemi yarım kaldı (#{operation[0]}): {e}")
+        invalidate_users_snapshot()
         
-        return jsonify({'success': True, 'message': 'Ödeme kaydedildi, kota sıfırlandı, süre uzatıldı ve cache temizlendi!'})
+        return jsonify({'success': True, 'message': 'Ödeme kaydedildi, kota sıfırlandı, süre uzatıldı ve cache temizlendi!', 'job_id': job_id})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/export/<dataset>')
+def export_data(dataset):
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    if dataset not in EXPORT_DATASETS:
+        return jsonify({'error': f"Geçersiz döküm: {dataset}"}), 404
+    try:
+        query = parse_export_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    export_format = query['format']
+    filename = f"novacell-{dataset}-{date.today().isoformat()}.{export_format}"
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/json'
+    return Response(stream_export(export_rows(dataset, query), export_format),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Accel-Buffering': 'no'})
+
 @app.route('/api/payment-history/<email>')
 def get_payment_history(email):
     if 'user_id' not in session: 
         return jsonify({'error': 'Unauthorized'}), 401
     try:
-        conn = sqlite3.connect(PANEL_DB)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
+        c = get_db(PANEL_DB).cursor()
         c.execute("SELECT * FROM payment_history WHERE email = ? ORDER BY payment_date DESC", (email,))
         history = [dict(row) for row in c.fetchall()]
-        conn.close()
         return jsonify(history)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+USAGE_HISTORY_RANGES = {'6h': 6 * 3600, '24h': 86400, '7d': 7 * 86400, '30d': 30 * 86400, '90d': 90 * 86400, '1y': 365 * 86400}
+
+@app.route('/api/usage-history/<email>')
+def usage_history(email):
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        now = int(time.time())
+        range_key = request.args.get('range', '24h')
+        if range_key not in USAGE_HISTORY_RANGES:
+            return jsonify({'error': f"Geçersiz aralık: {range_key}"}), 400
+        end = int(request.args.get('to') or now)
+        start = int(request.args.get('from') or end - USAGE_HISTORY_RANGES[range_key])
+        resolution = request.args.get('resolution')
+        if resolution is not None:
+            resolution = int(resolution)
+            if resolution not in TRAFFIC_RESOLUTIONS:
+                return jsonify({'error': f"Geçersiz çözünürlük: {resolution}"}), 400
+        if start >= end:
+            return jsonify({'error': 'from, to değerinden küçük olmalı'}), 400
+        
+        resolution, points = get_usage_history(email, start, end, resolution)
+        return jsonify({
+            'email': email,
+            'from': start,
+            'to': end,
+            'resolution': resolution,
+            'fields': ['bucket', 'up', 'down'],
+            'points': points,
+            'total_up': sum(p[1] for p in points),
+            'total_down': sum(p[2] for p in points)
+        })
+    except ValueError:
+        return jsonify({'error': 'from/to/resolution sayı olmalı'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/notifications')
 def get_notifications():
     if 'user_id' not in session: 
         return jsonify({'error': 'Unauthorized'}), 401
-    users = get_xui_users()
-    notifications = []
-    
-    for user in users:
-        if user.get('payment_status') == 'overdue':
-            notifications.append({
-                'type': 'payment_overdue',
-                'user': user['kullanici_adi'],
-                'message': f"Ödeme {abs(user['days_until_payment'])} gün gecikti!",
-                'priority': 'high'
-            })
-        elif user.get('payment_status') == 'urgent':
-            notifications.append({
-                'type': 'payment_urgent',
-                'user': user['kullanici_adi'],
-                'message': f"{user['days_until_payment']} gün içinde ödeme",
-                'priority': 'medium'
-            })
-        elif user.get('payment_status') == 'warning':
-            notifications.append({
-                'type': 'payment_warning',
-                'user': user['kullanici_adi'],
-                'message': f"{user['days_until_payment']} gün içinde ödeme",
-                'priority': 'low'
-            })
-        
-        if user['kota_limit_gb'] != "Sınırsız":
-            usage_percent = (user['kullanilan_kota_gb'] / user['kota_limit_gb']) * 100
-            if usage_percent >= 90:
-                notifications.append({
-                    'type': 'quota_high',
-                    'user': user['kullanici_adi'],
-                    'message': f"Kota %{int(usage_percent)} doldu",
-                    'priority': 'medium'
-                })
-        
-        if user.get('quota_days') is not None and user['quota_days'] <= 3:
-            notifications.append({
-                'type': 'quota_reset_soon',
-                'user': user['kullanici_adi'],
-                'message': f"Kota {user['quota_days']} gün içinde sıfırlanacak",
-                'priority': 'low'
-            })
-        
-        if user.get('is_expired'):
-            notifications.append({
-                'type': 'expired',
-                'user': user['kullanici_adi'],
-                'message': "Kullanım süresi dolmuş!",
-                'priority': 'high'
-            })
-    
-    return jsonify(notifications)
+    # Snapshot güncelse kurallar zaten çalışmıştır; değilse şimdi çalışır
+    get_users_snapshot()
+    include_acknowledged = request.args.get('include_acknowledged', '1') != '0'
+    return jsonify(get_active_notifications(include_acknowledged))
 
-def reset_user_quota(email):
+@app.route('/api/notifications/ack', methods=['POST'])
+def acknowledge_notifications():
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        data = request.json or {}
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with db_transaction(PANEL_DB) as c:
+            if data.get('all'):
+                c.execute("""UPDATE notifications SET acknowledged_at = ?
+                             WHERE resolved_at IS NULL AND acknowledged_at IS NULL""", (now,))
+                count = c.rowcount
+            else:
+                ids = [int(i) for i in data.get('ids') or []]
+                if not ids:
+                    return jsonify({'success': False, 'message': 'Bildirim seçilmedi'}), 400
+                count = 0
+                for chunk in _chunked(ids):
+                    placeholders = ','.join('?' * len(chunk))
+                    c.execute(f"""UPDATE notifications SET acknowledged_at = ?
+                                  WHERE acknowledged_at IS NULL AND id IN ({placeholders})""", [now] + chunk)
+                    count += c.rowcount
+        return jsonify({'success': True, 'acknowledged': count, 'message': f'{count} bildirim okundu işaretlendi'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/notification-settings', methods=['GET', 'POST'])
+def notification_settings():
+    if 'user_id' not in session: 
+        return jsonify({'error': 'Unauthorized'}), 401
+    if request.method == 'GET':
+        return jsonify(load_notification_thresholds(get_db(PANEL_DB).cursor()))
+    try:
+        data = request.json or {}
+        with db_transaction(PANEL_DB) as c:
+            thresholds = load_notification_thresholds(c)
+            for key in NOTIFICATION_DEFAULTS:
+                if data.get(key) is not None:
+                    value = int(data[key])
+                    if value < 0:
+                        return jsonify({'success': False, 'message': f'{key} negatif olamaz'}), 400
+                    thresholds[key] = value
+            if thresholds['payment_urgent_days'] > thresholds['payment_warning_days']:
+                return jsonify({'success': False, 'message': 'Acil eşiği uyarı eşiğinden büyük olamaz'}), 400
+            c.execute("""INSERT INTO panel_settings (key, value) VALUES ('notification_thresholds', ?)
+                         ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP""",
+                      (json.dumps(thresholds),))
+        invalidate_users_snapshot()
+        return jsonify({'success': True, 'thresholds': thresholds, 'message': 'Bildirim eşikleri güncellendi'})
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Eşikler tam sayı olmalı'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# --- İKİ VERİTABANINA YAZAN İŞLEMLER ---
+# Kota sıfırlama (ve ödemedeki süre uzatma) hem x-ui.db'ye hem panel
+# veritabanına yazar. ATTACH ile tek işlem WAL modunda veritabanları
+# arasında atomik olmadığından işlem önce günlüğe yazılır:
+#   1. operation_journal'a 'pending' satırı (ödeme kaydıyla aynı işlemde)
+#   2. x-ui'deki sayaçlar okunur ve günlük satırına (counters) yazılır
+#   3. x-ui adımı tek işlemde: sayaçlardan günlükteki değerler düşülür
+#      (okumadan sonra gelen trafik korunur), süre uzatılır
+#   4. panel adımı tek işlemde: total_usage_ever, sıfırlama logu, yeniden
+#      yükleme işi; günlük satırı 'done' olur
+# Yarıda kalan işlemler lider process'te yeniden oynatılır. Sayaçlar
+# günlükte varsa tekrar okunmaz; x-ui adımı sadece sayacı hâlâ günlükteki
+# değerden büyük ya da eşit olan kullanıcılara uygulanır, panel adımı
+# günlük 'done' ise atlanır. x-ui'nin veritabanına panel tablosu eklenmez.
+# (Adım 3 ile 4 arasında çökülür ve yeniden oynatmaya kadar kullanıcı
+# düşülen miktar kadar yeni trafik yaparsa o kullanıcı iki kez düşülür.)
+OPERATION_REPLAY_DELAY_SECONDS = 30     # bu kadar eski bekleyen işlemler yeniden oynatılır
+OPERATION_MAX_ATTEMPTS = 10
+OPERATION_JOURNAL_RETENTION_SECONDS = 30 * 86400
+
+def journal_operation(c, payload):
+    """
+    payload: {'emails': [...], 'reset_type': ..., 'expiry_ms': {email: ms},
+    'reload_reason': ...}. c panel veritabanı cursor'ı; işlem numarası döner.
+    """
+    now = time.time()
+    c.execute("""INSERT INTO operation_journal (kind, payload, state, created_at, updated_at)
+                 VALUES ('quota_reset', ?, 'pending', ?, ?)""",
+              (json.dumps(payload, ensure_ascii=False), now, now))
+    return c.lastrowid
+
+def _record_operation_counters(op_id, payload):
+    """Sıfırlanacak sayaçları günlüğe yaz (bir kez); {email: (up, down)} döndür"""
+    c = get_db(PANEL_DB).cursor()
+    c.execute("SELECT counters FROM operation_journal WHERE id = ?", (op_id,))
+    row = c.fetchone()
+    if row is not None and row[0] is not None:
+        return {email: tuple(value) for email, value in json.loads(row[0]).items()}
+    
+    counters = {}
+    xui_c = get_db(XUI_DB).cursor()
+    for chunk in _chunked(payload['emails']):
+        placeholders = ','.join('?' * len(chunk))
+        xui_c.execute(f"SELECT email, up, down FROM client_traffics WHERE email IN ({placeholders})", chunk)
+        for email, up, down in xui_c.fetchall():
+            counters[email] = (up or 0, down or 0)
+    with db_transaction(PANEL_DB) as wc:
+        wc.execute("UPDATE operation_journal SET counters = ?, updated_at = ? WHERE id = ? AND counters IS NULL",
+                   (json.dumps(counters), time.time(), op_id))
+    return counters
+
+def _apply_xui_operation(payload, counters):
+    """x-ui adımı; tekrar çağrılırsa sayacı zaten düşülmüş kullanıcıları atlar"""
+    expiry_ms = payload.get('expiry_ms') or {}
+    with db_transaction(XUI_DB) as c:
+        c.executemany("""UPDATE client_traffics SET up = up - ?, down = down - ?
+                         WHERE email = ? AND up >= ? AND down >= ?""",
+                      [(up, down, email, up, down) for email, (up, down) in counters.items()])
+        
+        if payload.get('reenable_quota_exceeded'):
+            # Kotası dolduğu için pasif edilmiş (süresi geçmemiş) kullanıcılar yeni dönemde açılır
+            now_ms = int(time.time() * 1000)
+            reenable = []
+            for chunk in _chunked(counters):
+                placeholders = ','.join('?' * len(chunk))
+                c.execute(f"""SELECT email, total, expiry_time FROM client_traffics
+                               WHERE email IN ({placeholders}) AND enable = 0 AND total > 0""", chunk)
+                reenable.extend(email for email, total, expiry in c.fetchall()
+                                if sum(counters[email]) >= total and (not expiry or expiry > now_ms))
+            if reenable:
+                patch_clients(c, {email: {'enable': True} for email in reenable})
+                for chunk in _chunked(reenable):
+                    placeholders = ','.join('?' * len(chunk))
+                    c.execute(f"UPDATE client_traffics SET enable = 1 WHERE email IN ({placeholders})", chunk)
+        
+        if expiry_ms:
+            patch_clients(c, {email: {'expiryTime': ms, 'enable': True} for email, ms in expiry_ms.items()})
+            # CLIENT_TRAFFICS'I DE GUNCELLE (KRITIK!)
+            c.executemany("UPDATE client_traffics SET enable = 1, expiry_time = ? WHERE email = ?",
+                          [(ms, email) for email, ms in expiry_ms.items()])
+
+def _apply_panel_operation(op_id, payload, counters, replay=False):
+    """Panel adımı; işlem zaten tamamlandıysa hiçbir şey yapmaz"""
+    job_id = None
+    with db_transaction(PANEL_DB) as c:
+        c.execute("SELECT state FROM operation_journal WHERE id = ?", (op_id,))
+        row = c.fetchone()
+        if row is None or row[0] == 'done':
+            return None
+        
+        if counters:
+            if not replay:
+                # Sıfırlamadan önceki son trafik de zaman serisine yazılsın. Yeniden
+                # oynatmada örnekleyici sıfırlanmış sayacı çoktan görmüştür.
+                record_traffic_deltas(c, counters, reset=True)
+            c.executemany("""INSERT INTO user_settings (email, total_usage_ever) VALUES (?, ?)
+                             ON CONFLICT(email) DO UPDATE
+                             SET total_usage_ever = COALESCE(total_usage_ever, 0) + excluded.total_usage_ever""",
+                          [(email, (up + down) / (1024**3)) for email, (up, down) in counters.items()])
+        
+        reset_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        c.executemany("INSERT INTO quota_reset_log (email, reset_date, reset_type) VALUES (?, ?, ?)",
+                      [(email, reset_date, payload.get('reset_type', 'manual')) for email in payload['emails']])
+        
+        # Sıfırlama dönemi: otomatik sıfırlamada vadesi gelen gün (dönem günü
+        # korunur), diğerlerinde kayıtlı quota_reset_date (ödeme/ayar ile
+        # yazılmış) ya da bugün; dönem günü o tarihin günü olur
+        auto_anchors = payload.get('anchors') or {}
+        periods = []
+        for chunk in _chunked(payload['emails']):
+            placeholders = ','.join('?' * len(chunk))
+            c.execute(f"""SELECT email, quota_reset_date, quota_reset_day FROM user_settings
+                          WHERE email IN ({placeholders})""", chunk)
+            for email, value, reset_day in c.fetchall():
+                if email in auto_anchors:
+                    anchor = _parse_day(auto_anchors[email])
+                    reset_day = reset_day or anchor.day
+                else:
+                    anchor = _parse_day(value) or date.today()
+                    reset_day = anchor.day
+                periods.append((anchor.isoformat(), add_one_month(anchor, reset_day).isoformat(),
+                                reset_day, email))
+        c.executemany("""UPDATE user_settings SET quota_reset_date = ?, next_quota_reset_date = ?,
+                                                  quota_reset_day = ?
+                         WHERE email = ?""", periods)
+        
+        # Yeniden oynatılan işlem x-ui.db'yi değiştirmiştir (sayaç, açma, süre);
+        # çalışan x-ui'ye uygulanması için gerekçesi olmasa da yeniden yükleme açılır
+        reload_reason = payload.get('reload_reason') or (f"yarım kalan işlem #{op_id}" if replay else None)
+        if reload_reason:
+            job_id = schedule_xui_reload(reload_reason, emails=payload['emails'])
+        
+        c.execute("UPDATE operation_journal SET state = 'done', updated_at = ?, error = NULL WHERE id = ?",
+                  (time.time(), op_id))
+    return job_id
+
+def run_operation(op_id, payload, replay=False):
+    """Günlükteki işlemi uygula (tekrar çağrılması güvenli); yeniden yükleme iş no'sunu döndür"""
+    try:
+        counters = _record_operation_counters(op_id, payload)
+        _apply_xui_operation(payload, counters)
+        return _apply_panel_operation(op_id, payload, counters, replay)
+    except Exception as e:
+        try:
+            with db_transaction(PANEL_DB) as c:
+                c.execute("""UPDATE operation_journal
+                             SET attempts = attempts + 1, error = ?, updated_at = ?,
+                                 state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE state END
+                             WHERE id = ? AND state = 'pending'""",
+                          (str(e), time.time(), OPERATION_MAX_ATTEMPTS, op_id))
+        except Exception:
+            pass
+        raise
+
+def replay_operation_journal(min_age=OPERATION_REPLAY_DELAY_SECONDS):
+    """Yarım kalmış işlemleri tamamla; tamamlanan sayısını döndür"""
+    if not os.path.exists(XUI_DB):
+        return 0
+    c = get_db(PANEL_DB).cursor()
+    now = time.time()
+    c.execute("""SELECT id, payload FROM operation_journal
+                 WHERE state = 'pending' AND created_at <= ? ORDER BY id""", (now - min_age,))
+    completed = 0
+    for row in c.fetchall():
+        try:
+            run_operation(row['id'], json.loads(row['payload']), replay=True)
+            completed += 1
+            print(f"♻️  Yarım kalan işlem tamamlandı (#{row['id']})")
+        except Exception as e:
+            print(f"❌ Yarım kalan işlem tamamlanamadı (#{row['id']}): {e}")
+    if completed:
+        invalidate_users_snapshot()
+    with db_transaction(PANEL_DB) as wc:
+        wc.execute("DELETE FROM operation_journal WHERE state = 'done' AND updated_at < ?",
+                   (now - OPERATION_JOURNAL_RETENTION_SECONDS,))
+    return completed
+
+# --- OTOMATİK AYLIK KOTA SIFIRLAMA ---
+# next_quota_reset_date'i gelen kullanıcılar denetim döngüsünde bulunur
+# (indeksli tarih sorgusu) ve AUTO_RESET_BATCH_SIZE'lık gruplar halinde
+# işlem günlüğü üzerinden sıfırlanır: her grup x-ui'de tek işlem, sayaçlar
+# tek UPDATE ile sıfırlanır, log 'auto'. Her grup kendi yeniden yükleme
+# işini açar; debounce turdaki işleri tek x-ui yeniden yüklemesinde toplar.
+# Ödeme günü sıfırlama gününden önce ya da aynı gün olan kullanıcı atlanır;
+# ödeme zaten kotayı sıfırlar. Sonraki sıfırlama quota_reset_day'e göre
+# hesaplanır: 31'inde başlayan dönem Şubat'ta 28'ine, Mart'ta yine 31'ine düşer.
+# Kota dönemi ilk ödemede ya da kota değişikliğinde başlar (eski kayıtlarda
+# son ödeme tarihinden, migration 9). Hiç ödeme ya da kota ayarı yapılmamış
+# kullanıcının dönemi yoktur, otomatik sıfırlanmaz.
+AUTO_RESET_BATCH_SIZE = 500
+
+def find_due_quota_resets(today=None):
+    """{email: yeni dönem başlangıcı} (vadesi gelmiş kullanıcılar)"""
+    today = today or date.today()
+    c = get_db(PANEL_DB).cursor()
+    c.execute("""SELECT email, next_quota_reset_date, quota_reset_day FROM user_settings
+                 WHERE next_quota_reset_date <= ? AND next_quota_reset_date != ''
+                   AND (next_payment_date IS NULL OR next_payment_date = ''
+                        OR next_payment_date > next_quota_reset_date)""",
+              (today.isoformat(),))
+    due = {}
+    for email, value, reset_day in c.fetchall():
+        anchor = _parse_day(value)
+        if anchor is None:
+            continue
+        # Panel uzun süre kapalı kaldıysa kaçırılan dönemler tek sıfırlamayla atlanır
+        while add_one_month(anchor, reset_day) <= today:
+            anchor = add_one_month(anchor, reset_day)
+        due[email] = anchor.isoformat()
+    return due
+
+def run_auto_quota_resets(today=None):
+    """Vadesi gelen kota sıfırlamalarını uygula, sıfırlanan kullanıcı sayısını döndür"""
+    if not os.path.exists(XUI_DB):
+        return 0
+    due = find_due_quota_resets(today)
+    if not due:
+        return 0
+    
+    reset = []
+    emails = sorted(due)
+    for i in range(0, len(emails), AUTO_RESET_BATCH_SIZE):
+        batch = emails[i:i + AUTO_RESET_BATCH_SIZE]
+        # Yeniden yükleme işi 'done' ile aynı işlemde yazılır; kuyruk turdaki
+        # grupları tek yeniden yüklemede birleştirir
+        payload = {'emails': batch, 'reset_type': 'auto', 'reenable_quota_exceeded': True,
+                   'anchors': {email: due[email] for email in batch},
+                   'reload_reason': f"otomatik kota sıfırlama ({len(batch)})"}
+        try:
+            with db_transaction(PANEL_DB) as c:
+                op_id = journal_operation(c, payload)
+            run_operation(op_id, payload)
+            reset.extend(batch)
+        except Exception as e:
+            print(f"❌ Otomatik kota sıfırlama hatası ({len(batch)} kullanıcı): {e}")
+    
+    if reset:
+        print(f"♻️  {len(reset)} kullanıcının aylık kotası otomatik sıfırlandı")
+        invalidate_users_snapshot()
+    return len(reset)
+
+def reset_users_quota(emails, reset_type='manual'):
+    """
+    Kullanıcıların kotasını topluca sıfırla: mevcut kullanım total_usage_ever'a
+    aktarılır, client_traffics up/down sıfırlanır ve her biri loglanır.
+    """
     try:
         if not os.path.exists(XUI_DB): 
             return False
         
-        conn = sqlite3.connect(XUI_DB)
-        c = conn.cursor()
-        c.execute("SELECT up, down FROM client_traffics WHERE email = ?", (email,))
-        result = c.fetchone()
-        
-        if result:
-            current_usage_bytes = (result[0] or 0) + (result[1] or 0)
-            current_usage_gb = current_usage_bytes / (1024**3)
-            
-            admin_conn = sqlite3.connect(PANEL_DB)
-            admin_c = admin_conn.cursor()
-            admin_c.execute("SELECT total_usage_ever FROM user_settings WHERE email = ?", (email,))
-            admin_result = admin_c.fetchone()
-            
-            if admin_result:
-                new_total = (admin_result[0] or 0) + current_usage_gb
-                admin_c.execute("UPDATE user_settings SET total_usage_ever = ? WHERE email = ?", 
-                              (new_total, email))
-            else:
-                admin_c.execute("INSERT INTO user_settings (email, total_usage_ever) VALUES (?, ?)", 
-                              (email, current_usage_gb))
-            
-            admin_conn.commit()
-            admin_conn.close()
-        
-        c.execute("UPDATE client_traffics SET up = 0, down = 0 WHERE email = ?", (email,))
-        conn.commit()
-        conn.close()
-        
-        admin_conn = sqlite3.connect(PANEL_DB)
-        admin_c = admin_conn.cursor()
-        admin_c.execute("INSERT INTO quota_reset_log (email, reset_date, reset_type) VALUES (?, ?, ?)",
-                       (email, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'manual'))
-        admin_conn.commit()
-        admin_conn.close()
+        emails = list(dict.fromkeys(emails))
+        if not emails:
+            return True
         
+        payload = {'emails': emails, 'reset_type': reset_type}
+        with db_transaction(PANEL_DB) as c:
+            op_id = journal_operation(c, payload)
+        run_operation(op_id, payload)
         return True
     except Exception as e:
         print(f"Kota sıfırlama hatası: {e}")
         return False
 
+def reset_user_quota(email):
+    return reset_users_quota([email])
+
 if __name__ == '__main__':
     init_db()
+    start_background_workers()
     app.run(host='0.0.0.0', port=8888, debug=False)
@@ -0,0 +1,342 @@
+"""
+NovaCell admin panel - asyncio (ASGI) çalışma modu.
+
+Çalıştırma: uvicorn asgi:app --host 0.0.0.0 --port 8888
+
+Flask route'ları aynen kullanılır (aynı URL, JSON ve oturum çerezi);
+her istek sınırlı bir thread havuzunda çalışır, böylece SQLite erişimi
+en fazla PANEL_ASGI_THREADS thread ile yapılır. Olay döngüsünü bloklayan
+iki iş döngünün kendisine taşınmıştır:
+  - /api/events: canlı bağlantılar thread tutmaz, asyncio ile beklenir
+  - x-ui yeniden yükleme (liderde): systemctl async subprocess ile
+    çağrılır, stop/start beklemeleri asyncio.sleep ile yapılır
+Denetim ve trafik örnekleme worker'ları thread olarak kalır.
+"""
+import asyncio
+import io
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app as panel
+
+ASGI_THREADS = int(os.environ.get('PANEL_ASGI_THREADS', '8'))
+# SQLite bağlantıları thread başına tutulduğu için havuz aynı zamanda bağlantı sınırıdır
+_pool = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='panel-asgi')
+# Yanıt başına olay döngüsünde bekleyen en fazla gövde parçası
+WSGI_BUFFER_CHUNKS = 8
+_reload_task = None
+
+
+async def run_blocking(func, *args):
+    """Bloklayan çağrıyı (SQLite, x-ui API) havuzda çalıştır"""
+    return await asyncio.get_running_loop().run_in_executor(_pool, func, *args)
+
+
+# --- X-UI KONTROLÜ ---
+async def _run_command(command):
+    process = await asyncio.create_subprocess_exec(*command)
+    return await process.wait()
+
+
+async def restart_xui_async():
+    """restart_xui ile aynı adımlar; beklerken olay döngüsü istek işlemeye devam eder"""
+    print("  🛑 x-ui durduruluyor...")
+    await _run_command(panel.XUI_STOP_COMMAND)
+    await asyncio.sleep(panel.XUI_STOP_WAIT_SECONDS)
+    print("  ▶️  x-ui başlatılıyor...")
+    await _run_command(panel.XUI_START_COMMAND)
+    await asyncio.sleep(panel.XUI_START_WAIT_SECONDS)
+
+
+async def apply_xui_changes_async(emails, full_restart):
+    """apply_xui_changes'in async karşılığı; kullanılan backend'i döndür"""
+    backend_name = await run_blocking(panel.apply_xui_live, emails, full_restart)
+    if backend_name is None:
+        await restart_xui_async()
+        backend_name = 'systemctl'
+    return backend_name
+
+
+async def reload_loop():
+    """app._reload_loop ile aynı kuyruk ve debounce; x-ui adımları async"""
+    while True:
+        try:
+            wait_for = await run_blocking(panel._reload_window_wait)
+            if wait_for is not None:
+                await asyncio.sleep(wait_for)
+                continue
+            batch = await run_blocking(panel._claim_reload_batch)
+        except Exception as e:
+            print(f"❌ Yeniden yükleme kuyruğu okunamadı: {e}")
+            await asyncio.sleep(panel.RELOAD_POLL_SECONDS)
+            continue
+        if batch is None:
+            continue
+        batch_id, reasons, emails, full_restart = batch
+
+        started = time.time()
+        error = None
+        backend = None
+        print(f"🔄 x-ui yeniden yükleniyor ({len(reasons)} değişiklik): {', '.join(reasons[:10])}")
+        try:
+            backend = await apply_xui_changes_async(sorted(emails), full_restart)
+        except Exception as e:
+            error = str(e)
+            print(f"❌ x-ui yeniden yükleme hatası: {e}")
+        await run_blocking(panel._finish_reload_batch, batch_id, started, backend, error)
+
+
+def _reload_worker_starter(loop):
+    """Lider seçimi thread'inden çağrılır; yeniden yükleme döngüsünü olay döngüsünde başlatır"""
+    def start():
+        panel._prepare_reload_worker()
+
+        def create_task():
+            global _reload_task
+            if _reload_task is None or _reload_task.done():
+                _reload_task = loop.create_task(reload_loop())
+        loop.call_soon_threadsafe(create_task)
+    return start
+
+
+# --- WSGI KÖPRÜSÜ ---
+def build_environ(scope, body):
+    """ASGI http scope'undan PEP 3333 environ"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = name
+        else:
+            key = 'HTTP_' + name
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _read_body(receive):
+    """İstek gövdesini topla; istemci koptuysa None"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def _start_wsgi(environ, started):
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                              for name, value in headers]
+        return lambda data: started.setdefault('written', []).append(data)
+    result = panel.app(environ, start_response)
+    return result, iter(result)
+
+
+def _close_wsgi(result):
+    if hasattr(result, 'close'):
+        result.close()
+
+
+def _run_wsgi(environ, loop, chunks, stop):
+    """Flask çağrısı, gövde üretimi ve close() aynı havuz thread'inde yürür.
+
+    Akış dökümleri SQLite bağlantısını üreticinin içinde açar; bağlantı
+    açıldığı thread dışında kullanılamaz. Parçalar olay döngüsüne sınırlı
+    bir kuyrukla aktarılır, istemci yavaşsa üretim de bekler.
+    """
+    def put(item):
+        if not stop.is_set():
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+    started = {}
+    result = None
+    try:
+        result, iterator = _start_wsgi(environ, started)
+        # start_response ilk parça üretilirken de çağrılabilir
+        data = next(iterator, None)
+        put(('start', started))
+        while data is not None and not stop.is_set():
+            if data:
+                put(('body', data))
+            data = next(iterator, None)
+    except Exception as e:
+        put(('error', e))
+    finally:
+        if result is not None:
+            _close_wsgi(result)
+        put(('end', None))
+
+
+async def _drain(chunks, worker):
+    """Yanıt yarıda bırakıldı: thread kuyrukta beklemesin, bitmesini bekle"""
+    while not worker.done():
+        getter = asyncio.ensure_future(chunks.get())
+        await asyncio.wait({worker, getter}, return_when=asyncio.FIRST_COMPLETED)
+        getter.cancel()
+
+
+async def handle_wsgi(scope, receive, send, body):
+    """Flask'ı havuzda çalıştır; gövde parçalarını (akış dökümleri dahil) sırayla gönder"""
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue(WSGI_BUFFER_CHUNKS)
+    stop = threading.Event()
+    worker = loop.run_in_executor(_pool, _run_wsgi, build_environ(scope, body), loop, chunks, stop)
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        while not disconnected.done():
+            kind, value = await chunks.get()
+            if kind == 'end':
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                break
+            if kind == 'error':
+                raise value
+            if kind == 'start':
+                await send({'type': 'http.response.start', 'status': value['status'], 'headers': value['headers']})
+                for data in value.get('written', []):
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+            else:
+                await send({'type': 'http.response.body', 'body': value, 'more_body': True})
+    finally:
+        stop.set()
+        disconnected.cancel()
+        await _drain(chunks, worker)
+
+
+# --- CANLI OLAYLAR ---
+class LoopQueue(queue.Queue):
+    """publish_event thread'lerden yazar; olay döngüsü ready ile uyandırılır"""
+    def __init__(self, maxsize=0, loop=None):
+        super().__init__(maxsize)
+        self.loop = loop
+        self.ready = asyncio.Event()
+
+    def _put(self, item):
+        super()._put(item)
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+
+async def _next_event(subscriber, timeout):
+    """Sıradaki olay; timeout içinde gelmezse None (heartbeat)"""
+    deadline = subscriber.loop.time() + timeout
+    while True:
+        subscriber.ready.clear()
+        try:
+            return subscriber.get_nowait()
+        except queue.Empty:
+            pass
+        remaining = deadline - subscriber.loop.time()
+        if remaining <= 0:
+            return None
+        try:
+            await asyncio.wait_for(subscriber.ready.wait(), remaining)
+        except asyncio.TimeoutError:
+            return None
+
+
+async def _stream_events(subscriber, send):
+    async def send_text(text):
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no')
+    ]})
+    await send_text(f"retry: {panel.EVENTS_RETRY_MS}\n\n")
+    await send_text(panel._format_event('hello', {'poll_seconds': panel.EVENTS_POLL_SECONDS}))
+    while True:
+        item = await _next_event(subscriber, panel.EVENTS_HEARTBEAT_SECONDS)
+        await send_text(": heartbeat\n\n" if item is None else panel._format_event(*item))
+
+
+def _session_authorized(environ):
+    with panel.app.request_context(environ):
+        return 'user_id' in panel.session
+
+
+async def handle_events(scope, receive, send):
+    """/api/events: Flask route'uyla aynı yanıtlar, bağlantı başına thread yok"""
+    environ = build_environ(scope, b'')
+    if not await run_blocking(_session_authorized, environ):
+        # 401 yanıtını Flask üretsin
+        return await handle_wsgi(scope, receive, send, b'')
+    subscriber = panel.subscribe_events(lambda maxsize: LoopQueue(maxsize, asyncio.get_running_loop()))
+    if subscriber is None:
+        body = panel.app.json.dumps({'error': 'Canlı bağlantı limiti dolu'}).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': 503,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+        return
+    stream = asyncio.ensure_future(_stream_events(subscriber, send))
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await asyncio.wait({stream, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stream.cancel()
+        disconnected.cancel()
+        panel.unsubscribe_events(subscriber)
+
+
+# --- ASGI UYGULAMASI ---
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await run_blocking(panel.init_db)
+                panel.start_background_workers(_reload_worker_starter(asyncio.get_running_loop()))
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _reload_task is not None:
+                _reload_task.cancel()
+            _pool.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    if scope['path'] == '/api/events' and scope['method'] == 'GET':
+        return await handle_events(scope, receive, send)
+    body = await _read_body(receive)
+    if body is None:
+        return
+    await handle_wsgi(scope, receive, send, body)
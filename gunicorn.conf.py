@@ -0,0 +1,34 @@
+# NovaCell admin panel - gunicorn ayarları
+# Çalıştırma: gunicorn -c gunicorn.conf.py app:app
+# Ayarlar ortam değişkenleriyle değiştirilebilir (systemd servis dosyası).
+import os
+import sys
+
+bind = os.environ.get('PANEL_BIND', '0.0.0.0:8888')
+workers = int(os.environ.get('PANEL_WORKERS', '2'))
+# Her canlı olay bağlantısı (/api/events) bir thread tutar
+threads = int(os.environ.get('PANEL_THREADS', '8'))
+worker_class = 'gthread'
+
+# x-ui API çağrıları ve toplu işlemler uzun sürebilir
+timeout = int(os.environ.get('PANEL_TIMEOUT', '60'))
+# HUP / systemctl reload: yeni worker'lar açılır, eskiler işlerini bitirip kapanır
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = None
+errorlog = '-'
+capture_output = True
+
+def on_starting(server):
+    """Veritabanı şemasını worker'lar açılmadan önce bir kez hazırla"""
+    import app as panel
+    panel.init_db()
+    panel.close_thread_connections()
+    # Master uygulamayı bellekte tutmasın: HUP sonrası worker'lar yeni kodu yükler
+    sys.modules.pop('app', None)
+
+def post_worker_init(worker):
+    """Her worker lider seçimine katılır; arka plan işleri sadece liderde çalışır"""
+    import app as panel
+    panel.start_background_workers()
@@ -30,7 +30,7 @@ fi
 echo -e "${GREEN}[1/13] TEMİZLİK...${NC}"
 systemctl stop xui-admin-panel 2>/dev/null || true
 systemctl disable xui-admin-panel 2>/dev/null || true
-rm -rf /opt/xui-admin-panel/app.py /opt/xui-admin-panel/index.html
+rm -rf /opt/xui-admin-panel/app.py /opt/xui-admin-panel/index.html /opt/xui-admin-panel/gunicorn.conf.py
 rm -f /etc/systemd/system/xui-admin-panel.service
 rm -f /usr/local/bin/reset-quota.sh
 rm -f /usr/local/bin/check-individual-quotas.sh
@@ -60,13 +60,17 @@ echo -e "${GREEN}[3/13] PYTHON ORTAMI...${NC}"
 python3 -m venv venv
 source venv/bin/activate
 pip install --quiet --upgrade pip
-pip install --quiet flask flask-cors bcrypt
+pip install --quiet flask flask-cors bcrypt gunicorn
 
 echo -e "${GREEN}[4/13] BACKEND DOSYASI...${NC}"
 curl -sL https://raw.githubusercontent.com/eren73546/novacell-admin-panel/main/app.py -o app.py || {
     echo -e "${RED}❌ Backend indirilemedi!${NC}"
     exit 1
 }
+curl -sL https://raw.githubusercontent.com/eren73546/novacell-admin-panel/main/gunicorn.conf.py -o gunicorn.conf.py || {
+    echo -e "${RED}❌ Gunicorn ayar dosyası indirilemedi!${NC}"
+    exit 1
+}
 
 echo -e "${GREEN}[5/13] FRONTEND DOSYASI...${NC}"
 curl -sL https://raw.githubusercontent.com/eren73546/novacell-admin-panel/main/index.html -o index.html || {
@@ -86,55 +90,16 @@ read -p "Panel ismi girin (boş bırakırsanız 'NovaCell-3 v4.5'): " PANEL_NAME
 PANEL_NAME=${PANEL_NAME:-NovaCell-3 v4.5}
 
 echo -e "${GREEN}✅ Seçilen İsim: $PANEL_NAME${NC}"
-echo -e "${YELLOW}⚙️  Dosya içerikleri güncelleniyor...${NC}"
-
-# ==============================================================================
-# KRİTİK DÜZELTME: PYTHON İLE DOĞRUDAN METİN DEĞİŞTİRME
-# GitHub'dan inen dosyadaki sabit isimleri bulup zorla değiştiriyoruz.
-# ==============================================================================
-python3 -c "
-import sys
-
-yeni_isim = '''$PANEL_NAME'''
-
-# 1. APP.PY DÜZENLEME
-try:
-    with open('app.py', 'r', encoding='utf-8') as f:
-        kod = f.read()
-    
-    # Sabit yazılı ismi bul ve değiştir
-    # 'sunucu_adi': 'NovaCell-3' -> 'sunucu_adi': 'GirdiginizIsim'
-    kod = kod.replace(\"'sunucu_adi': 'NovaCell-3'\", f\"'sunucu_adi': '{yeni_isim}'\")
-    
-    # Eğer başka yerlerde geçiyorsa onları da değiştir
-    kod = kod.replace('\"NovaCell-3\"', f'\"{yeni_isim}\"')
-    
-    # SERVER_NAME değişkeni varsa onu da güncelle
-    if 'SERVER_NAME =' in kod:
-        import re
-        kod = re.sub(r'SERVER_NAME = .*', f'SERVER_NAME = \"{yeni_isim}\"', kod)
-    
-    with open('app.py', 'w', encoding='utf-8') as f:
-        f.write(kod)
-    print('✅ app.py içindeki isimler güncellendi.')
-except Exception as e:
-    print(f'❌ app.py düzenleme hatası: {e}')
-
-# 2. INDEX.HTML DÜZENLEME
-try:
-    with open('index.html', 'r', encoding='utf-8') as f:
-        html = f.read()
-    
-    html = html.replace('NovaCell-3 v4.5', yeni_isim)
-    html = html.replace('NovaCell-3', yeni_isim)
-    
-    with open('index.html', 'w', encoding='utf-8') as f:
-        f.write(html)
-    print('✅ index.html içindeki başlıklar güncellendi.')
-except Exception as e:
-    print(f'❌ index.html düzenleme hatası: {e}')
+echo -e "${YELLOW}⚙️  Panel ayarları yazılıyor...${NC}"
+
+# Panel adı kaynak koda yazılmaz; panel_config.json'dan okunur
+# (panel açıkken değiştirilirse yeniden başlatmadan uygulanır)
+PANEL_NAME="$PANEL_NAME" python3 -c "
+import json, os
+with open('panel_config.json', 'w', encoding='utf-8') as f:
+    json.dump({'panel_name': os.environ['PANEL_NAME']}, f, ensure_ascii=False, indent=2)
+print('✅ panel_config.json oluşturuldu.')
 "
-# ==============================================================================
 
 echo ""
 echo -e "${GREEN}[7/13] VERITABANI...${NC}"
@@ -153,7 +118,10 @@ Type=simple
 User=root
 WorkingDirectory=$INSTALL_DIR
 Environment="PATH=$INSTALL_DIR/venv/bin"
-ExecStart=$INSTALL_DIR/venv/bin/python3 $INSTALL_DIR/app.py
+Environment="PANEL_WORKERS=2"
+Environment="PANEL_THREADS=8"
+ExecStart=$INSTALL_DIR/venv/bin/gunicorn -c $INSTALL_DIR/gunicorn.conf.py app:app
+ExecReload=/bin/kill -s HUP \$MAINPID
 Restart=always
 RestartSec=3
 
@@ -229,8 +197,10 @@ DATE=$(date +%Y%m%d-%H%M)
 BACKUP_DIR="/root/novacell-backups"
 mkdir -p "$BACKUP_DIR"
 
-cp /opt/xui-admin-panel/admin_panel.db "$BACKUP_DIR/admin_panel-$DATE.db" 2>/dev/null
-[ -f /etc/x-ui/x-ui.db ] && cp /etc/x-ui/x-ui.db "$BACKUP_DIR/x-ui-$DATE.db" 2>/dev/null
+# cp yerine .backup: panel WAL kipinde, son işlemler admin_panel.db-wal'da olabilir;
+# .backup tutarlı bir anlık kopya alır (yazma sürerken de yırtık dosya çıkmaz)
+sqlite3 /opt/xui-admin-panel/admin_panel.db ".backup '$BACKUP_DIR/admin_panel-$DATE.db'" 2>/dev/null
+[ -f /etc/x-ui/x-ui.db ] && sqlite3 /etc/x-ui/x-ui.db ".backup '$BACKUP_DIR/x-ui-$DATE.db'" 2>/dev/null
 
 cd "$BACKUP_DIR"
 if [ -f "x-ui-$DATE.db" ]; then
@@ -326,6 +296,7 @@ echo -e "${GREEN}🔧 Yönetim Komutları:${NC}"
 echo -e "   Durum: ${BLUE}systemctl status xui-admin-panel${NC}"
 echo -e "   Log: ${BLUE}journalctl -u xui-admin-panel -f${NC}"
 echo -e "   Yeniden Başlat: ${BLUE}systemctl restart xui-admin-panel${NC}"
+echo -e "   Kesintisiz Yenile: ${BLUE}systemctl reload xui-admin-panel${NC}"
 if [ "$TELEGRAM_ENABLED" = true ]; then
     echo -e "   Telegram Test: ${BLUE}bash /root/novacell-telegram-backup.sh${NC}"
 fi
@@ -0,0 +1,34 @@
+"""
+Testler için ortak kurulum: panel modülü geçici dizinde çalışan ayarlarla
+yüklenir, her test sınıfı kendi x-ui.db / admin_panel.db çiftini açar.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+# Panel modülü ayarlarını import sırasında ortamdan okur
+TMP_DIR = tempfile.mkdtemp(prefix='panel-test-')
+os.environ.setdefault('PANEL_SECRET_KEY', 'test')
+os.environ.setdefault('PANEL_CONFIG_FILE', os.path.join(TMP_DIR, 'panel_config.json'))
+os.environ.setdefault('PANEL_LEADER_LOCK_FILE', os.path.join(TMP_DIR, 'leader.lock'))
+
+import app as panel  # noqa: E402
+from xui_fixture import make_xui_db  # noqa: E402
+
+ADMIN_USERNAME = 'novacell'
+ADMIN_PASSWORD = 'NovaCell25Hakki'
+GB = 1024 ** 3
+
+
+def use_databases(inbounds=1, clients_per_inbound=10, seed=1):
+    """Yeni x-ui.db ve admin_panel.db oluşturup panele bağla; email listesini döndür"""
+    directory = tempfile.mkdtemp(dir=TMP_DIR)
+    panel.XUI_DB = os.path.join(directory, 'x-ui.db')
+    panel.PANEL_DB = os.path.join(directory, 'admin_panel.db')
+    emails = make_xui_db(panel.XUI_DB, inbounds=inbounds, clients_per_inbound=clients_per_inbound, seed=seed)
+    panel.init_db()
+    return emails
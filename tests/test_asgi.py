@@ -0,0 +1,114 @@
+"""
+asgi.py köprüsü testleri.
+
+Çalıştırma: python3 -m pytest -q tests   (ya da python3 -m unittest discover tests)
+"""
+import asyncio
+import sqlite3
+import unittest
+
+from panel_fixture import ADMIN_PASSWORD, ADMIN_USERNAME, panel, use_databases
+
+import asgi
+
+
+async def call(method, path, query=b'', body=b'', cookie=None):
+    """asgi.app'i tek istekle çağır: (status, headers, gövde)"""
+    headers = [(b'host', b'localhost'), (b'content-type', b'application/json'),
+               (b'content-length', str(len(body)).encode())]
+    if cookie:
+        headers.append((b'cookie', cookie))
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+             'headers': headers, 'http_version': '1.1', 'scheme': 'http',
+             'server': ('localhost', 8888), 'client': ('127.0.0.1', 5000)}
+    requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    response_done = asyncio.Event()
+    messages = []
+
+    async def receive():
+        if requests:
+            return requests.pop(0)
+        await response_done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+        if message['type'] == 'http.response.body' and not message.get('more_body'):
+            response_done.set()
+
+    await asyncio.wait_for(asgi.app(scope, receive, send), 30)
+    start = messages[0]
+    content = b''.join(m.get('body', b'') for m in messages[1:])
+    return start['status'], dict(start['headers']), content
+
+
+class ExportStreamTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        emails = use_databases()
+        cls.payments = panel.EXPORT_BATCH_ROWS * 3 + 7
+        conn = sqlite3.connect(panel.PANEL_DB)
+        conn.executemany("INSERT INTO payment_history (email, amount, payment_date, payment_method) VALUES (?, ?, ?, ?)",
+                         [(emails[i % len(emails)], 100 + i, '2026-01-15', 'Nakit') for i in range(cls.payments)])
+        conn.commit()
+        conn.close()
+
+    def login(self):
+        body = panel.app.json.dumps({'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD}).encode()
+        status, headers, _ = asyncio.run(call('POST', '/api/login', body=body))
+        self.assertEqual(status, 200)
+        return headers[b'set-cookie'].split(b';', 1)[0]
+
+    def test_export_larger_than_batch(self):
+        cookie = self.login()
+        status, headers, content = asyncio.run(call('GET', '/api/export/payments', cookie=cookie))
+        self.assertEqual(status, 200)
+        self.assertTrue(headers[b'content-type'].startswith(b'text/csv'))
+        lines = content.decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['id', 'email'])
+        self.assertEqual(len(lines), self.payments + 1)
+        self.assertEqual(lines[-1].split(',')[0], str(self.payments))
+
+    def test_export_json_larger_than_batch(self):
+        cookie = self.login()
+        status, _, content = asyncio.run(call('GET', '/api/export/payments', query=b'format=json', cookie=cookie))
+        self.assertEqual(status, 200)
+        self.assertEqual(len(panel.json.loads(content)), self.payments)
+
+    def test_export_stops_on_disconnect(self):
+        cookie = self.login()
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/export/payments', 'query_string': b'',
+                 'headers': [(b'host', b'localhost'), (b'cookie', cookie)]}
+        chunks = []
+
+        async def run():
+            first_chunk = asyncio.Event()
+            requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+            async def receive():
+                if requests:
+                    return requests.pop(0)
+                await first_chunk.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.body':
+                    chunks.append(message)
+                    first_chunk.set()
+                    # İstemci yavaş: üretici sınırlı kuyrukta beklemeli
+                    await asyncio.sleep(0.01)
+
+            await asyncio.wait_for(asgi.app(scope, receive, send), 30)
+
+        asyncio.run(run())
+        self.assertTrue(chunks)
+        self.assertTrue(all(m.get('more_body') for m in chunks))
+
+    def test_export_requires_login(self):
+        status, _, content = asyncio.run(call('GET', '/api/export/payments'))
+        self.assertEqual(status, 401)
+        self.assertEqual(panel.json.loads(content), {'error': 'Unauthorized'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Otomatik aylık kota sıfırlama testleri: ay sonu kırpması, kaçırılan
+dönemler ve kota dönemi olmayan kullanıcılar.
+"""
+import sqlite3
+import unittest
+from datetime import date
+
+from panel_fixture import GB, panel, use_databases
+
+
+class AutoQuotaResetTest(unittest.TestCase):
+    def setUp(self):
+        self.emails = use_databases()
+        self.email = self.emails[0]
+
+    def set_usage(self, email, up=GB, down=2 * GB):
+        xui = sqlite3.connect(panel.XUI_DB)
+        xui.execute("UPDATE client_traffics SET up = ?, down = ? WHERE email = ?", (up, down, email))
+        xui.commit()
+        xui.close()
+
+    def usage(self, email):
+        xui = sqlite3.connect(panel.XUI_DB)
+        try:
+            return xui.execute("SELECT up, down FROM client_traffics WHERE email = ?", (email,)).fetchone()
+        finally:
+            xui.close()
+
+    def period(self, email):
+        conn = sqlite3.connect(panel.PANEL_DB)
+        try:
+            return conn.execute("""SELECT quota_reset_date, next_quota_reset_date, quota_reset_day
+                                   FROM user_settings WHERE email = ?""", (email,)).fetchone()
+        finally:
+            conn.close()
+
+    def auto_resets(self, email):
+        conn = sqlite3.connect(panel.PANEL_DB)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM quota_reset_log WHERE email = ? AND reset_type = 'auto'",
+                                (email,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def start_period(self, email, day):
+        """Kota dönemini day gününde başlat (kota değişikliğindeki gibi)"""
+        with panel.db_transaction(panel.PANEL_DB) as c:
+            c.execute("INSERT INTO user_settings (email, quota_reset_date) VALUES (?, ?)", (email, day))
+        self.assertTrue(panel.reset_users_quota([email]))
+
+    def test_add_one_month_clamps_to_month_end(self):
+        self.assertEqual(panel.add_one_month(date(2026, 1, 31)), date(2026, 2, 28))
+        self.assertEqual(panel.add_one_month(date(2028, 1, 31)), date(2028, 2, 29))
+        self.assertEqual(panel.add_one_month(date(2026, 2, 28), 31), date(2026, 3, 31))
+        self.assertEqual(panel.add_one_month(date(2026, 3, 31), 31), date(2026, 4, 30))
+        self.assertEqual(panel.add_one_month(date(2026, 12, 31), 31), date(2027, 1, 31))
+
+    def test_day_31_keeps_month_end(self):
+        self.start_period(self.email, '2026-01-31')
+        self.assertEqual(self.period(self.email), ('2026-01-31', '2026-02-28', 31))
+
+        expected = [('2026-02-28', '2026-03-31'), ('2026-03-31', '2026-04-30'),
+                    ('2026-04-30', '2026-05-31'), ('2026-05-31', '2026-06-30')]
+        for start, following in expected:
+            self.set_usage(self.email)
+            today = date.fromisoformat(start)
+            # Vadesinden önceki gün sıfırlanmaz
+            self.assertEqual(panel.run_auto_quota_resets(date.fromordinal(today.toordinal() - 1)), 0)
+            self.assertEqual(panel.run_auto_quota_resets(today), 1)
+            self.assertEqual(self.period(self.email), (start, following, 31))
+            self.assertEqual(self.usage(self.email), (0, 0))
+        self.assertEqual(self.auto_resets(self.email), len(expected))
+
+    def test_day_30_in_february(self):
+        self.start_period(self.email, '2026-01-30')
+        self.assertEqual(panel.run_auto_quota_resets(date(2026, 2, 28)), 1)
+        self.assertEqual(self.period(self.email), ('2026-02-28', '2026-03-30', 30))
+        self.assertEqual(panel.run_auto_quota_resets(date(2026, 3, 30)), 1)
+        self.assertEqual(self.period(self.email), ('2026-03-30', '2026-04-30', 30))
+
+    def test_missed_periods_reset_once(self):
+        self.start_period(self.email, '2026-01-31')
+        self.set_usage(self.email)
+        # Panel Şubat sonundan Mayıs ortasına kadar kapalı kaldı
+        self.assertEqual(panel.run_auto_quota_resets(date(2026, 5, 15)), 1)
+        self.assertEqual(self.period(self.email), ('2026-04-30', '2026-05-31', 31))
+        self.assertEqual(self.auto_resets(self.email), 1)
+        self.assertEqual(panel.run_auto_quota_resets(date(2026, 5, 30)), 0)
+
+    def test_user_without_period_is_not_reset(self):
+        # Sadece klasör/not kaydı olan ve hiç kaydı olmayan kullanıcı
+        with panel.db_transaction(panel.PANEL_DB) as c:
+            c.execute("INSERT INTO user_settings (email, folder, notes) VALUES (?, 'GSM', 'not')", (self.emails[1],))
+        for email in self.emails[1:3]:
+            self.set_usage(email)
+        self.assertEqual(panel.find_due_quota_resets(date(2030, 1, 1)), {})
+        self.assertEqual(panel.run_auto_quota_resets(date(2030, 1, 1)), 0)
+        for email in self.emails[1:3]:
+            self.assertEqual(self.usage(email), (GB, 2 * GB))
+            self.assertEqual(self.auto_resets(email), 0)
+
+    def test_legacy_payment_seeds_period(self):
+        with panel.db_transaction(panel.PANEL_DB) as c:
+            c.execute("""INSERT INTO user_settings (email, last_payment_date, quota_reset_date)
+                         VALUES (?, '2026-01-31', 0)""", (self.email,))
+            panel._migration_seed_quota_anchor(c)
+        self.assertEqual(self.period(self.email), ('2026-01-31', '2026-02-28', 31))
+        self.set_usage(self.email)
+        self.assertEqual(panel.run_auto_quota_resets(date(2026, 2, 28)), 1)
+        self.assertEqual(self.usage(self.email), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+İki veritabanına yazan işlemlerin (operation_journal) yeniden oynatma testleri.
+
+Her senaryoda kullanım total_usage_ever'a bir kez eklenmeli ve x-ui
+sayaçları sıfırlanmış olmalı.
+"""
+import sqlite3
+import unittest
+from unittest import mock
+
+from panel_fixture import GB, panel, use_databases
+
+
+class Crash(Exception):
+    pass
+
+
+def crash(*args, **kwargs):
+    raise Crash('işlem yarıda kesildi')
+
+
+class OperationJournalTest(unittest.TestCase):
+    def setUp(self):
+        emails = use_databases()
+        self.emails = emails[:3]
+        xui = sqlite3.connect(panel.XUI_DB)
+        xui.executemany("UPDATE client_traffics SET up = ?, down = ? WHERE email = ?",
+                        [((i + 1) * GB, (i + 2) * GB, email) for i, email in enumerate(self.emails)])
+        xui.commit()
+        xui.close()
+        self.usage = {email: self.counters(email)[0] + self.counters(email)[1] for email in self.emails}
+
+    def counters(self, email):
+        xui = sqlite3.connect(panel.XUI_DB)
+        try:
+            return xui.execute("SELECT up, down FROM client_traffics WHERE email = ?", (email,)).fetchone()
+        finally:
+            xui.close()
+
+    def panel_query(self, sql, params=()):
+        conn = sqlite3.connect(panel.PANEL_DB)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def total_usage_ever(self, email):
+        rows = self.panel_query("SELECT total_usage_ever FROM user_settings WHERE email = ?", (email,))
+        return rows[0][0] if rows else None
+
+    def journal_states(self):
+        return [row[0] for row in self.panel_query("SELECT state FROM operation_journal ORDER BY id")]
+
+    def assert_reset_once(self):
+        for email in self.emails:
+            self.assertEqual(self.counters(email), (0, 0), email)
+            self.assertAlmostEqual(self.total_usage_ever(email), self.usage[email] / GB, places=6, msg=email)
+        logged = self.panel_query("SELECT COUNT(*) FROM quota_reset_log")[0][0]
+        self.assertEqual(logged, len(self.emails))
+        self.assertEqual(self.journal_states(), ['done'])
+
+    def test_completed_operation(self):
+        self.assertTrue(panel.reset_users_quota(self.emails))
+        self.assert_reset_once()
+        # Her iki veritabanı da yazıldıktan sonra yeniden oynatılacak bir şey kalmaz
+        self.assertEqual(panel.replay_operation_journal(min_age=0), 0)
+        self.assert_reset_once()
+
+    def test_crash_before_xui_commit(self):
+        # Günlük ve okunan sayaçlar panelde, x-ui'ye hiç yazılmamış
+        with mock.patch.object(panel, '_apply_xui_operation', side_effect=crash):
+            self.assertFalse(panel.reset_users_quota(self.emails))
+        self.assertEqual(self.journal_states(), ['pending'])
+        self.assertIsNotNone(self.panel_query("SELECT counters FROM operation_journal")[0][0])
+        for email in self.emails:
+            self.assertNotEqual(self.counters(email), (0, 0))
+            self.assertIsNone(self.total_usage_ever(email))
+
+        self.assertEqual(panel.replay_operation_journal(min_age=0), 1)
+        self.assert_reset_once()
+
+    def test_crash_after_xui_commit(self):
+        # x-ui sayaçları sıfırlanmış, panel adımı (total_usage_ever) yazılmamış
+        with mock.patch.object(panel, '_apply_panel_operation', side_effect=crash):
+            self.assertFalse(panel.reset_users_quota(self.emails))
+        self.assertEqual(self.journal_states(), ['pending'])
+        for email in self.emails:
+            self.assertEqual(self.counters(email), (0, 0))
+            self.assertIsNone(self.total_usage_ever(email))
+
+        self.assertEqual(panel.replay_operation_journal(min_age=0), 1)
+        self.assert_reset_once()
+
+    def test_replay_twice(self):
+        with mock.patch.object(panel, '_apply_panel_operation', side_effect=crash):
+            self.assertFalse(panel.reset_users_quota(self.emails))
+        self.assertEqual(panel.replay_operation_journal(min_age=0), 1)
+        self.assertEqual(panel.replay_operation_journal(min_age=0), 0)
+        self.assert_reset_once()
+
+    def test_replay_of_same_operation_runs_once(self):
+        # Aynı işlem iki kez çalıştırılsa da (ör. iki process) sonuç değişmez
+        with mock.patch.object(panel, '_apply_panel_operation', side_effect=crash):
+            self.assertFalse(panel.reset_users_quota(self.emails))
+        op_id, payload = self.panel_query("SELECT id, payload FROM operation_journal")[0]
+        payload = panel.json.loads(payload)
+        panel.run_operation(op_id, payload, replay=True)
+        panel.run_operation(op_id, payload, replay=True)
+        self.assert_reset_once()
+
+    def test_traffic_after_counters_read_is_kept(self):
+        with mock.patch.object(panel, '_apply_xui_operation', side_effect=crash):
+            self.assertFalse(panel.reset_users_quota(self.emails))
+        # Yeniden oynatmadan önce gelen trafik yeni dönemde kalır
+        xui = sqlite3.connect(panel.XUI_DB)
+        xui.execute("UPDATE client_traffics SET down = down + 5 WHERE email = ?", (self.emails[0],))
+        xui.commit()
+        xui.close()
+
+        self.assertEqual(panel.replay_operation_journal(min_age=0), 1)
+        self.assertEqual(self.counters(self.emails[0]), (0, 5))
+        self.assertAlmostEqual(self.total_usage_ever(self.emails[0]), self.usage[self.emails[0]] / GB, places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
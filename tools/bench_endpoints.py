@@ -0,0 +1,237 @@
+"""
+Panel uç noktaları için benchmark.
+
+Her kullanıcı sayısı için geçici bir dizinde sahte x-ui.db ve
+admin_panel.db oluşturur (tools/xui_fixture.py), XUI_DB / PANEL_DB
+ortam değişkenleriyle uygulamayı bu dosyalara yönlendirir ve uç
+noktaları Flask test client'ı ile çağırır. systemctl çağrıları ve
+time.sleep etkisizdir; arka plan worker'ları başlatılmaz (x-ui yeniden
+yükleme işleri sadece kuyruğa yazılır). Her boyut ayrı bir process'te
+çalışır, böylece önbellekler birbirini etkilemez.
+
+Çıktı: uç nokta başına p50/p95/p99/max gecikme (ms) ve saniyedeki işlem.
+--json ile sonuçlar kaydedilir, --baseline ile önceki bir kayıtla
+karşılaştırılıp p50'si eşikten fazla yavaşlayanlar işaretlenir.
+
+Kullanım:
+  python3 tools/bench_endpoints.py --sizes 100,1000,10000,50000 --json bench.json
+  python3 tools/bench_endpoints.py --sizes 1000 --baseline bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(TOOLS_DIR, '..')
+
+
+def percentile(sorted_values, pct):
+    """Sıralı listede en yakın sıra yöntemiyle yüzdelik"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _measure(func, iterations, max_seconds):
+    timings, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        if not func():
+            errors += 1
+        timings.append((time.perf_counter() - t0) * 1000)
+        if time.perf_counter() - started > max_seconds:
+            break
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    return {
+        'n': len(timings),
+        'errors': errors,
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'max': timings[-1],
+        'ops_per_sec': len(timings) / elapsed if elapsed else None
+    }
+
+
+def run_worker(args):
+    """Tek boyut için ölçüm (ayrı process); sonuçları JSON olarak yazdır"""
+    sys.path.insert(0, TOOLS_DIR)
+    sys.path.insert(0, ROOT_DIR)
+    import xui_fixture
+
+    per_inbound = max(1, -(-args.clients // args.inbounds))
+    emails = xui_fixture.make_xui_db(os.environ['XUI_DB'], args.inbounds, per_inbound, args.seed)
+
+    with contextlib.redirect_stdout(sys.stderr if args.verbose else open(os.devnull, 'w')):
+        import app as panel
+        # systemctl ve beklemeler ölçüme girmesin
+        panel.os.system = lambda command: 0
+        panel.time.sleep = lambda seconds: None
+        panel.init_db()
+        xui_fixture.fill_panel_db(panel.PANEL_DB, emails, args.seed)
+
+        client = panel.app.test_client()
+        response = client.post('/api/login', json={'username': 'novacell', 'password': 'NovaCell25Hakki'})
+        assert response.status_code == 200, response.data
+        rnd = random.Random(args.seed)
+        today = date.today()
+
+        def ok(response):
+            return response.status_code == 200
+
+        def users_cold():
+            panel.invalidate_users_snapshot()
+            return ok(client.get('/api/users'))
+
+        def toggle_user():
+            return ok(client.post('/api/toggle-user', json={'email': rnd.choice(emails),
+                                                            'enable': rnd.random() > 0.5}))
+
+        def update_user_settings():
+            return ok(client.post('/api/update-user-settings', json={
+                'email': rnd.choice(emails),
+                'monthly_price': rnd.choice([100, 150, 200]),
+                'next_payment_date': (today + timedelta(days=rnd.randint(1, 30))).isoformat(),
+                'notes': 'bench',
+                'folder': rnd.choice(xui_fixture.FOLDERS)
+            }))
+
+        def update_user_quota():
+            # x-ui tarafını da değiştiren yol: inbounds.settings yaması, client_traffics ve kota sıfırlama
+            payload = {
+                'email': rnd.choice(emails),
+                'monthly_price': rnd.choice([100, 150, 200]),
+                'next_payment_date': (today + timedelta(days=rnd.randint(1, 30))).isoformat(),
+                'notes': 'bench',
+                'folder': rnd.choice(xui_fixture.FOLDERS)
+            }
+            if rnd.random() < 0.7:
+                payload['quota'] = rnd.choice([0, 50, 100, 200])
+            if 'quota' not in payload or rnd.random() < 0.5:
+                payload['expiry_date'] = (today + timedelta(days=rnd.randint(1, 90))).isoformat()
+            return ok(client.post('/api/update-user-settings', json=payload))
+
+        def add_payment():
+            return ok(client.post('/api/add-payment', json={
+                'email': rnd.choice(emails),
+                'amount': rnd.choice([100, 150, 200]),
+                'payment_date': today.isoformat(),
+                'payment_method': 'Nakit'
+            }))
+
+        def quota_check():
+            panel.check_and_disable_quota_exceeded()
+            return True
+
+        benchmarks = [
+            ('get_xui_users', lambda: bool(panel.get_xui_users()) or not emails),
+            ('GET /api/users (soğuk)', users_cold),
+            ('GET /api/users (önbellek)', lambda: ok(client.get('/api/users'))),
+            ('GET /api/users?folder&sort&limit',
+             lambda: ok(client.get('/api/users?folder=GSM&sort=-kullanilan_kota_gb&limit=50'))),
+            ('GET /api/stats', lambda: ok(client.get('/api/stats'))),
+            ('POST /api/toggle-user', toggle_user),
+            ('POST /api/update-user-settings', update_user_settings),
+            ('POST /api/update-user-settings (kota/bitiş)', update_user_quota),
+            ('POST /api/add-payment', add_payment),
+            # İlk tur kotası dolanları pasif eder, sonrakiler dakikalık taramanın maliyeti
+            ('check_and_disable_quota_exceeded', quota_check),
+        ]
+        results = {}
+        for name, func in benchmarks:
+            if args.only and args.only not in name:
+                continue
+            results[name] = _measure(func, args.iterations, args.max_seconds)
+
+    print(json.dumps({'clients': len(emails), 'results': results}))
+
+
+def run_size(args, clients):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   XUI_DB=os.path.join(tmp, 'x-ui.db'),
+                   PANEL_DB=os.path.join(tmp, 'admin_panel.db'),
+                   PANEL_SECRET_KEY='bench',
+                   PANEL_LEADER_LOCK_FILE=os.path.join(tmp, 'leader.lock'))
+        command = [sys.executable, os.path.abspath(__file__), '--worker',
+                   '--clients', str(clients), '--inbounds', str(args.inbounds),
+                   '--iterations', str(args.iterations), '--max-seconds', str(args.max_seconds),
+                   '--seed', str(args.seed)]
+        if args.only:
+            command += ['--only', args.only]
+        if args.verbose:
+            command.append('--verbose')
+        output = subprocess.run(command, env=env, cwd=tmp, check=True,
+                                stdout=subprocess.PIPE, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+
+def print_report(runs, baseline, threshold):
+    header = f"{'client':>7}  {'uç nokta':<44} {'n':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'işlem/sn':>9}"
+    print(header)
+    print('-' * len(header))
+    regressions = []
+    for run in runs:
+        for name, result in run['results'].items():
+            line = (f"{run['clients']:>7}  {name:<44} {result['n']:>4} {result['p50']:>9.2f} "
+                    f"{result['p95']:>9.2f} {result['p99']:>9.2f} {result['max']:>9.2f} {result['ops_per_sec']:>9.1f}")
+            if result['errors']:
+                line += f"  ❌ {result['errors']} hata"
+            previous = baseline.get(str(run['clients']), {}).get(name)
+            if previous and previous['p50']:
+                ratio = result['p50'] / previous['p50']
+                line += f"  ({ratio:.2f}x)"
+                if ratio > threshold:
+                    line += " ⚠️"
+                    regressions.append((run['clients'], name, ratio))
+            print(line)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Panel uç noktaları benchmark')
+    parser.add_argument('--sizes', default='100,1000,10000,50000', help='virgülle client sayıları')
+    parser.add_argument('--inbounds', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=50, help='uç nokta başına en fazla çağrı')
+    parser.add_argument('--max-seconds', type=float, default=20, help='uç nokta başına süre sınırı')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', help='sadece adında bu metin geçen uç noktalar')
+    parser.add_argument('--json', help='sonuçları bu dosyaya yaz')
+    parser.add_argument('--baseline', help='karşılaştırılacak önceki --json çıktısı')
+    parser.add_argument('--threshold', type=float, default=1.25, help='p50 bu oranı aşarsa gerileme')
+    parser.add_argument('--verbose', action='store_true', help='uygulama çıktısını göster')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--clients', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        sys.exit(0)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    runs = []
+    for size in [int(value) for value in args.sizes.split(',') if value.strip()]:
+        print(f"⏱️  {size} client ölçülüyor...", file=sys.stderr)
+        runs.append(run_size(args, size))
+    regressions = print_report(runs, baseline, args.threshold)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({str(run['clients']): run['results'] for run in runs}, f, indent=2, ensure_ascii=False)
+    if regressions:
+        print(f"\n⚠️  {len(regressions)} uç noktada p50 {args.threshold}x eşiğini aştı")
+        sys.exit(1)
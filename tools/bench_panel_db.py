@@ -0,0 +1,117 @@
+"""
+admin_panel.db sorgu planı ve süre ölçümü.
+
+Geçici bir panel veritabanı oluşturur, sahte ödeme / kota sıfırlama /
+yeniden yükleme kayıtlarıyla doldurur ve panelin sık yaptığı sorguları
+önce migration indeksleri olmadan, sonra migrate_panel_db() ile indeksler
+eklendikten sonra çalıştırır. Her sorgu için EXPLAIN QUERY PLAN çıktısı
+ve ortalama süre yazdırılır.
+
+Kullanım:
+  python3 tools/bench_panel_db.py --payments 100000 --users 2000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# app import edilirken .secret_key dosyası oluşturulmasın
+os.environ.setdefault('PANEL_SECRET_KEY', 'bench')
+import app as panel  # noqa: E402
+
+QUERIES = [
+    ('ödeme geçmişi',
+     "SELECT * FROM payment_history WHERE email = ? ORDER BY payment_date DESC", 'email'),
+    ('son 30 gün ödemeleri (döküm)',
+     "SELECT * FROM payment_history WHERE payment_date >= ? ORDER BY payment_date, id", 'since'),
+    ('kullanıcı sıfırlama geçmişi',
+     "SELECT reset_date, reset_type FROM quota_reset_log WHERE email = ? ORDER BY reset_date DESC", 'email'),
+    ('son 30 gün sıfırlamaları',
+     "SELECT COUNT(*) FROM quota_reset_log WHERE reset_date >= ?", 'since'),
+    ('bekleyen yeniden yükleme işleri',
+     "SELECT MIN(requested_at), MAX(requested_at) FROM xui_reload_jobs WHERE started_at IS NULL", None),
+    ('kullanıcı ayarları',
+     "SELECT * FROM user_settings WHERE email = ?", 'email'),
+]
+
+# migrate_panel_db() tarafından eklenen indeksler ("önce" ölçümü için silinir)
+MIGRATION_INDEXES = [
+    'idx_payment_history_email_date',
+    'idx_quota_reset_log_email_date',
+    'idx_quota_reset_log_date',
+    'idx_xui_reload_jobs_pending',
+    'idx_xui_reload_jobs_batch',
+    'idx_xui_reload_jobs_applied',
+    'idx_payment_history_date',
+]
+
+
+def populate(conn, payments, users, rnd):
+    emails = [f"user{i:05d}@bench" for i in range(users)]
+    start = date.today() - timedelta(days=3 * 365)
+    conn.executemany("INSERT INTO user_settings (email, monthly_price, folder) VALUES (?, ?, ?)",
+                     [(email, rnd.choice([100, 150, 200]), 'Tümü') for email in emails])
+    conn.executemany("""INSERT INTO payment_history (email, amount, payment_date, payment_method, notes)
+                        VALUES (?, ?, ?, 'Nakit', '')""",
+                     [(rnd.choice(emails), rnd.choice([100, 150, 200]),
+                       (start + timedelta(days=rnd.randrange(3 * 365))).isoformat())
+                      for _ in range(payments)])
+    conn.executemany("INSERT INTO quota_reset_log (email, reset_date, reset_type) VALUES (?, ?, ?)",
+                     [(rnd.choice(emails), (start + timedelta(days=rnd.randrange(3 * 365))).isoformat(),
+                       rnd.choice(['auto', 'manual', 'bulk']))
+                      for _ in range(payments)])
+    now = time.time()
+    conn.executemany("""INSERT INTO xui_reload_jobs (reason, requested_at, started_at, applied_at, batch_id)
+                        VALUES ('bench', ?, ?, ?, ?)""",
+                     [(now - i, now - i, now - i, i) for i in range(5000)])
+    conn.commit()
+    return emails
+
+
+def measure(conn, emails, repeat, rnd):
+    since = (date.today() - timedelta(days=30)).isoformat()
+    for title, sql, param in QUERIES:
+        args = {'email': lambda: (rnd.choice(emails),), 'since': lambda: (since,), None: lambda: ()}[param]
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, args()).fetchall()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(sql, args()).fetchall()
+        avg_ms = (time.perf_counter() - started) * 1000 / repeat
+        print(f"  {title:<34} {avg_ms:8.3f} ms")
+        for row in plan:
+            print(f"      {row[3]}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='admin_panel.db indeks karşılaştırması')
+    parser.add_argument('--payments', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=200, help='sorgu başına tekrar')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        panel.PANEL_DB = os.path.join(tmp, 'admin_panel.db')
+        panel.init_db()
+        conn = panel.get_db(panel.PANEL_DB)
+        print(f"📦 {args.payments} ödeme, {args.users} kullanıcı oluşturuluyor...")
+        emails = populate(conn, args.payments, args.users, rnd)
+
+        for name in MIGRATION_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.execute("PRAGMA user_version = 1")
+        conn.execute("ANALYZE")
+        conn.commit()
+        print("\n⏱️  İndekssiz (şema sürümü 1)")
+        measure(conn, emails, args.repeat, rnd)
+
+        with panel.db_transaction(panel.PANEL_DB) as c:
+            version = panel.migrate_panel_db(c)
+        print(f"\n⏱️  Migration sonrası (şema sürümü {version})")
+        measure(conn, emails, args.repeat, rnd)
+        panel.close_thread_connections()
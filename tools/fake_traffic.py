@@ -0,0 +1,52 @@
+"""
+Yerel test için sahte trafik üreticisi.
+
+Bir x-ui.db dosyasındaki client_traffics satırlarına düzenli aralıklarla
+rastgele up/down ekler ve last_online'ı günceller; böylece panelin canlı
+olay akışı (/api/events) gerçek bir Xray olmadan denenebilir.
+
+Kullanım:
+  python3 tools/fake_traffic.py --db /etc/x-ui/x-ui.db --interval 2 --active 20
+"""
+import argparse
+import random
+import sqlite3
+import time
+
+
+def tick(conn, active, max_mb, rnd=random):
+    """Rastgele `active` kullanıcıya trafik ekle, güncellenen email'leri döndür"""
+    emails = [row[0] for row in conn.execute("SELECT email FROM client_traffics")]
+    chosen = rnd.sample(emails, min(active, len(emails)))
+    now_ms = int(time.time() * 1000)
+    conn.executemany("""UPDATE client_traffics
+                        SET up = COALESCE(up, 0) + ?, down = COALESCE(down, 0) + ?, last_online = ?
+                        WHERE email = ?""",
+                     [(rnd.randint(0, max_mb) * 1024**2, rnd.randint(0, max_mb * 4) * 1024**2, now_ms, email)
+                      for email in chosen])
+    conn.commit()
+    return chosen
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='client_traffics için sahte trafik')
+    parser.add_argument('--db', default='/etc/x-ui/x-ui.db')
+    parser.add_argument('--interval', type=float, default=2.0, help='saniye')
+    parser.add_argument('--active', type=int, default=20, help='her turda trafik alan kullanıcı sayısı')
+    parser.add_argument('--max-mb', type=int, default=50, help='tur başına en fazla upload (MB)')
+    parser.add_argument('--rounds', type=int, default=0, help='0 = durdurulana kadar')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=5)
+    print(f'Sahte trafik: {args.db}, her {args.interval} sn {args.active} kullanıcı')
+    rounds = 0
+    try:
+        while not args.rounds or rounds < args.rounds:
+            chosen = tick(conn, args.active, args.max_mb)
+            rounds += 1
+            print(f'  tur {rounds}: {len(chosen)} kullanıcı güncellendi')
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
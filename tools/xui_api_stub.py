@@ -0,0 +1,129 @@
+"""
+x-ui panel API'sinin yerel taklidi (test için).
+
+app.py'deki 'api' backend'inin kullandığı uçları taklit eder:
+  POST /login                                    -> oturum çerezi verir
+  POST /panel/api/inbounds/updateClient/<id>     -> gelen client'ı kaydeder
+  GET  /stub/calls                               -> kaydedilen çağrıları listeler
+
+Kullanım:
+  python3 tools/xui_api_stub.py --port 2099
+  XUI_APPLY_BACKEND=api XUI_API_URL=http://127.0.0.1:2099 python3 app.py
+"""
+import argparse
+import json
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote
+
+
+class XuiApiStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, username='admin', password='admin', fail_emails=()):
+        super().__init__(address, XuiApiStubHandler)
+        self.username = username
+        self.password = password
+        self.fail_emails = set(fail_emails)
+        self.sessions = set()
+        self.calls = []
+        self.lock = threading.Lock()
+
+
+class XuiApiStubHandler(BaseHTTPRequestHandler):
+    server_version = 'XuiApiStub/1.0'
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status, payload, cookie=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if cookie:
+            self.send_header('Set-Cookie', f'3x-ui={cookie}; Path=/; HttpOnly')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8') if length else ''
+
+    def _session(self):
+        for part in (self.headers.get('Cookie') or '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == '3x-ui':
+                return value
+        return None
+
+    def do_GET(self):
+        if self.path == '/stub/calls':
+            with self.server.lock:
+                return self._send_json(200, list(self.server.calls))
+        self._send_json(404, {'success': False, 'msg': 'not found'})
+
+    def do_POST(self):
+        body = self._read_body()
+
+        if self.path == '/login':
+            form = parse_qs(body)
+            if (form.get('username', [''])[0] == self.server.username
+                    and form.get('password', [''])[0] == self.server.password):
+                token = secrets.token_hex(16)
+                with self.server.lock:
+                    self.server.sessions.add(token)
+                return self._send_json(200, {'success': True, 'msg': 'Login Successfully'}, cookie=token)
+            return self._send_json(200, {'success': False, 'msg': 'Wrong username or password'})
+
+        # x-ui oturumsuz API isteklerine 404 döndürür
+        if self._session() not in self.server.sessions:
+            return self._send_json(404, {'success': False, 'msg': 'not logged in'})
+
+        prefix = '/panel/api/inbounds/updateClient/'
+        if self.path.startswith(prefix):
+            try:
+                payload = json.loads(body or '{}')
+                clients = json.loads(payload.get('settings') or '{}').get('clients', [])
+            except ValueError:
+                return self._send_json(200, {'success': False, 'msg': 'invalid json'})
+            if len(clients) != 1:
+                return self._send_json(200, {'success': False, 'msg': 'exactly one client expected'})
+
+            client = clients[0]
+            with self.server.lock:
+                self.server.calls.append({
+                    'client_id': unquote(self.path[len(prefix):]),
+                    'inbound_id': payload.get('id'),
+                    'client': client
+                })
+            if client.get('email') in self.server.fail_emails:
+                return self._send_json(200, {'success': False, 'msg': 'stub failure'})
+            return self._send_json(200, {'success': True, 'msg': 'Inbound client has been updated.'})
+
+        self._send_json(404, {'success': False, 'msg': 'not found'})
+
+
+def start_stub_server(port=0, **kwargs):
+    """Stub sunucuyu arka planda başlat, (server, url) döndür"""
+    server = XuiApiStubServer(('127.0.0.1', port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever, name='xui-api-stub', daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='x-ui panel API stub')
+    parser.add_argument('--port', type=int, default=2099)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--fail', action='append', default=[], help='bu email için hata döndür')
+    args = parser.parse_args()
+
+    server = XuiApiStubServer(('127.0.0.1', args.port), args.username, args.password, args.fail)
+    print(f'x-ui API stub http://127.0.0.1:{args.port} adresinde çalışıyor')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,162 @@
+"""
+Benchmark ve yerel test için sahte x-ui.db üreticisi.
+
+x-ui'nin kullandığı inbounds (settings JSON içinde clients) ve
+client_traffics tablolarını N inbound x M client olacak şekilde
+oluşturur. Kota, bitiş tarihi, trafik ve son görülme zamanı rastgele
+ama gerçekçi dağılımlarla verilir (kotası dolmuş, süresi geçmiş,
+pasif kullanıcılar dahil). İstenirse admin_panel.db'ye de ücret,
+ödeme tarihi ve klasör bilgisi yazılır.
+
+Kullanım:
+  python3 tools/xui_fixture.py --xui-db /tmp/x-ui.db --inbounds 10 --clients 1000
+  python3 tools/xui_fixture.py --xui-db /tmp/x-ui.db --panel-db /tmp/admin_panel.db --clients 5000
+"""
+import argparse
+import json
+import random
+import sqlite3
+import string
+import time
+import uuid
+from datetime import date, timedelta
+
+GB = 1024 ** 3
+FOLDERS = ['Tümü', 'Superbox', 'AX', 'GSM', 'ÖZEL']
+# Panel sadece 4 karakterli email'leri kullanıcı sayar
+EMAIL_ALPHABET = string.digits + string.ascii_lowercase
+
+
+def client_email(n):
+    """n. client için 4 karakterlik benzersiz email (36^4 kullanıcıya kadar)"""
+    chars = []
+    for _ in range(4):
+        n, rem = divmod(n, len(EMAIL_ALPHABET))
+        chars.append(EMAIL_ALPHABET[rem])
+    return ''.join(reversed(chars))
+
+
+def _random_client(rnd, email, now_ms):
+    total_gb = rnd.choice([0, 50, 100, 100, 200, 500])
+    expiry = rnd.choices(
+        [0, now_ms - rnd.randint(1, 60) * 86400000, now_ms + rnd.randint(1, 90) * 86400000],
+        weights=[2, 1, 7])[0]
+    enable = rnd.random() > 0.1
+    limit = total_gb * GB
+    # Çoğu kullanıcı kotasının altında, bir kısmı sınırda ya da aşmış
+    used = int(limit * rnd.choice([0.1, 0.3, 0.6, 0.8, 0.95, 1.05])) if limit else rnd.randint(0, 300) * GB
+    up = int(used * rnd.uniform(0.05, 0.3))
+    last_online = rnd.choice([0, now_ms - 20000, now_ms - 600000, now_ms - rnd.randint(1, 30) * 86400000])
+    client = {
+        'id': str(uuid.UUID(int=rnd.getrandbits(128))),
+        'flow': '',
+        'email': email,
+        'limitIp': 0,
+        'totalGB': limit,
+        'expiryTime': expiry,
+        'enable': enable,
+        'tgId': '',
+        'subId': ''.join(rnd.choices(EMAIL_ALPHABET, k=16)),
+        'reset': 0
+    }
+    traffic = (enable, email, up, used - up, expiry, limit, last_online)
+    return client, traffic
+
+
+def make_xui_db(path, inbounds=10, clients_per_inbound=100, seed=1):
+    """x-ui.db oluştur (varsa üzerine yazar), oluşturulan email listesini döndür"""
+    rnd = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        DROP TABLE IF EXISTS inbounds;
+        DROP TABLE IF EXISTS client_traffics;
+        CREATE TABLE inbounds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER, up INTEGER, down INTEGER, total INTEGER,
+            remark TEXT, enable NUMERIC, expiry_time INTEGER,
+            listen TEXT, port INTEGER UNIQUE, protocol TEXT,
+            settings TEXT, stream_settings TEXT, tag TEXT UNIQUE, sniffing TEXT);
+        CREATE TABLE client_traffics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            inbound_id INTEGER, enable NUMERIC, email TEXT UNIQUE,
+            up INTEGER, down INTEGER, expiry_time INTEGER, total INTEGER,
+            reset INTEGER DEFAULT 0, last_online INTEGER DEFAULT 0);
+    """)
+    emails = []
+    for inbound_id in range(1, inbounds + 1):
+        clients, traffics = [], []
+        for _ in range(clients_per_inbound):
+            email = client_email(len(emails))
+            emails.append(email)
+            client, traffic = _random_client(rnd, email, now_ms)
+            clients.append(client)
+            traffics.append((inbound_id,) + traffic)
+        settings = json.dumps({'clients': clients, 'decryption': 'none', 'fallbacks': []}, indent=2)
+        port = 20000 + inbound_id
+        conn.execute("""INSERT INTO inbounds (id, user_id, up, down, total, remark, enable, expiry_time,
+                                              listen, port, protocol, settings, stream_settings, tag, sniffing)
+                        VALUES (?, 1, 0, 0, 0, ?, 1, 0, '', ?, 'vless', ?, '{}', ?, '{}')""",
+                     (inbound_id, f"inbound-{inbound_id}", port, settings, f"inbound-{port}"))
+        conn.executemany("""INSERT INTO client_traffics (inbound_id, enable, email, up, down, expiry_time, total, last_online)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", traffics)
+    conn.commit()
+    conn.close()
+    return emails
+
+
+def fill_panel_db(path, emails, seed=1, with_settings=0.7, payments_per_user=3):
+    """
+    admin_panel.db'ye kullanıcı ayarları ve ödeme geçmişi ekle. Tablolar
+    önceden app.init_db() ile oluşturulmuş olmalıdır.
+    """
+    rnd = random.Random(seed)
+    today = date.today()
+    settings, payments = [], []
+    for email in emails:
+        if rnd.random() > with_settings:
+            continue
+        price = rnd.choice([0, 100, 150, 200, 250])
+        next_payment = today + timedelta(days=rnd.randint(-20, 35))
+        settings.append((email, price, next_payment.isoformat(), rnd.choice(FOLDERS), rnd.choice(['', 'not'])))
+        for months_back in range(rnd.randint(0, payments_per_user)):
+            paid = next_payment - timedelta(days=30 * (months_back + 1))
+            payments.append((email, price, paid.isoformat(), 'Nakit'))
+    conn = sqlite3.connect(path)
+    conn.executemany("""INSERT OR REPLACE INTO user_settings (email, monthly_price, next_payment_date, folder, notes)
+                        VALUES (?, ?, ?, ?, ?)""", settings)
+    conn.executemany("INSERT INTO payment_history (email, amount, payment_date, payment_method) VALUES (?, ?, ?, ?)",
+                     payments)
+    # Aylık gelir özeti normalde add_payment ile güncellenir
+    conn.execute("DELETE FROM revenue_monthly")
+    conn.execute("""INSERT INTO revenue_monthly (month, email, collected, payments)
+                    SELECT substr(payment_date, 1, 7), email, SUM(amount), COUNT(*)
+                    FROM payment_history GROUP BY 1, 2""")
+    conn.commit()
+    conn.close()
+    return len(settings), len(payments)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sahte x-ui.db üret')
+    parser.add_argument('--xui-db', required=True)
+    parser.add_argument('--panel-db', help='verilirse tabloları oluşturup ayar/ödeme ekler')
+    parser.add_argument('--inbounds', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=1000, help='toplam client sayısı')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    per_inbound = max(1, -(-args.clients // args.inbounds))
+    emails = make_xui_db(args.xui_db, args.inbounds, per_inbound, args.seed)
+    print(f"✅ {args.xui_db}: {args.inbounds} inbound, {len(emails)} client")
+    if args.panel_db:
+        import os
+        import sys
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        os.environ.setdefault('PANEL_SECRET_KEY', 'fixture')
+        import app as panel
+        panel.PANEL_DB = args.panel_db
+        panel.init_db()
+        panel.close_thread_connections()
+        count, payment_count = fill_panel_db(args.panel_db, emails, args.seed)
+        print(f"✅ {args.panel_db}: {count} kullanıcı ayarı, {payment_count} ödeme")